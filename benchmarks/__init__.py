@@ -0,0 +1,8 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+#
+# This file is part of csv2vcard package
+
+"""
+Throughput benchmarks, see benchmarks/bench.py
+"""
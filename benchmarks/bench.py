@@ -0,0 +1,318 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+#
+# This file is part of csv2vcard
+
+__intname__ = "benchmarks.bench"
+__author__ = "Orsiris de Jong"
+__copyright__ = "Copyright (C) 2023 NetInvent SASU"
+__licence__ = "MIT"
+__build__ = "2026101801"
+
+
+"""
+Throughput benchmarks for csv2vcard
+
+Times parse_csv(), create_vcard(), export_vcard(), BatchedVcardExporter and csv2vcard() in per contact
+and single file modes, on generated CSV files, and writes a JSON result that can be compared across commits
+
+Usage:
+    python benchmarks/bench.py --rows 1000,100000 --profiles default,orange --output result.json
+    python benchmarks/bench.py --rows 1000 --compare previous_result.json
+"""
+
+
+from typing import Callable, List
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from datetime import datetime
+from argparse import ArgumentParser
+
+# Insert parent dir as path se we get to use our package
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from csv2vcard.csv_handler import parse_csv, csv2vcard
+from csv2vcard.create_vcard import create_vcard, CompiledMapping
+from csv2vcard.export_vcard import export_vcard, BatchedVcardExporter
+from benchmarks.generate_csv import generate_csv, get_mapping_file, PROFILES
+
+# Stages working on in-memory contacts are limited to this amount of contacts
+DEFAULT_SAMPLE_ROWS = 100000
+# Per contact output is skipped above this amount of files
+DEFAULT_MAX_FILES = 100000
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(__file__),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(fn: Callable, memory: bool = False) -> dict:
+    """
+    Runs fn once, returning its wall time, result and optional peak Python memory allocation
+    """
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    peak_memory = None
+    if memory:
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {"seconds": seconds, "peak_memory": peak_memory, "result": result}
+
+
+def _record(
+    results: List[dict],
+    stage: str,
+    case: dict,
+    measurement: dict,
+    rows: int,
+    size: int = None,
+) -> None:
+    seconds = measurement["seconds"]
+    entry = dict(
+        case,
+        stage=stage,
+        rows=rows,
+        seconds=round(seconds, 6),
+        rows_per_second=round(rows / seconds, 1) if seconds else None,
+        bytes_per_second=round(size / seconds, 1) if size and seconds else None,
+        peak_memory=measurement["peak_memory"],
+    )
+    results.append(entry)
+    print(
+        f"{case['profile']:>8} {case['encoding']:>10} {case['rows']:>9} rows  {stage:<22}"
+        f"{seconds:10.3f}s {entry['rows_per_second'] or 0:>12.0f} rows/s"
+    )
+
+
+def bench_case(
+    work_dir: str,
+    profile: str,
+    rows: int,
+    encoding: str,
+    seed: int,
+    sample_rows: int,
+    max_files: int,
+    memory: bool,
+) -> List[dict]:
+    results = []
+    case = {"profile": profile, "rows": rows, "encoding": encoding}
+    csv_filename = os.path.join(work_dir, f"{profile}-{rows}-{encoding}.csv")
+    mapping_file = get_mapping_file(profile)
+    # Orange exports need accents stripped so the header matches the mapping
+    strip_accents = profile == "orange"
+
+    generate_csv(csv_filename, rows, profile, seed=seed, encoding=encoding)
+    size = os.path.getsize(csv_filename)
+    mapping = CompiledMapping(mapping_file, strip_accents)
+
+    def _parse():
+        count = 0
+        for _ in parse_csv(
+            csv_filename,
+            ";",
+            encoding=None,
+            strip_accents=strip_accents,
+            columns=mapping.columns,
+            records=True,
+        ):
+            count += 1
+        return count
+
+    _record(results, "parse_csv", case, measure(_parse, memory), rows, size)
+
+    contacts = []
+    for contact in parse_csv(
+        csv_filename,
+        ";",
+        strip_accents=strip_accents,
+        columns=mapping.columns,
+        records=True,
+    ):
+        contacts.append(contact)
+        if len(contacts) >= sample_rows:
+            break
+
+    def _create():
+        return [create_vcard(contact, 4, mapping=mapping) for contact in contacts]
+
+    measurement = measure(_create, memory)
+    vcards = [vcard for vcard in measurement["result"] if vcard[0]]
+    _record(results, "create_vcard", case, measurement, len(contacts))
+
+    sample_vcards = vcards[:max_files]
+    export_dir = os.path.join(work_dir, "export_vcard")
+    os.makedirs(export_dir)
+
+    def _export():
+        for vcard, filename in sample_vcards:
+            export_vcard(vcard, export_dir, filename)
+
+    _record(results, "export_vcard", case, measure(_export, memory), len(sample_vcards))
+    shutil.rmtree(export_dir)
+
+    batched_dir = os.path.join(work_dir, "batched_export")
+    os.makedirs(batched_dir)
+
+    def _batched_export():
+        with BatchedVcardExporter(batched_dir) as exporter:
+            for vcard, filename in sample_vcards:
+                exporter.write(vcard, filename)
+
+    _record(
+        results,
+        "batched_export",
+        case,
+        measure(_batched_export, memory),
+        len(sample_vcards),
+    )
+    shutil.rmtree(batched_dir)
+
+    for stage, single_vcard_file in [
+        ("csv2vcard_per_file", False),
+        ("csv2vcard_single_file", True),
+    ]:
+        if not single_vcard_file and rows > max_files:
+            print(f"Skipping {stage} for {rows} rows, above {max_files} files")
+            continue
+        output_dir = os.path.join(work_dir, stage)
+
+        def _convert():
+            return csv2vcard(
+                csv_filename,
+                ";",
+                mapping_file=mapping_file,
+                output_dir=output_dir,
+                single_vcard_file=single_vcard_file,
+                strip_accents=strip_accents,
+                mapping=mapping,
+            )
+
+        _record(results, stage, case, measure(_convert, memory), rows, size)
+        shutil.rmtree(output_dir)
+
+    os.remove(csv_filename)
+    return results
+
+
+def compare(results: List[dict], previous_filename: str) -> None:
+    """
+    Prints throughput ratios against a previous result file
+    """
+    with open(previous_filename, "r", encoding="utf-8") as fp:
+        previous = json.load(fp)
+
+    def _key(entry):
+        return (entry["profile"], entry["rows"], entry["encoding"], entry["stage"])
+
+    previous_results = {_key(entry): entry for entry in previous["results"]}
+    print(f"\nComparison with {previous_filename} ({previous['meta'].get('commit')})")
+    for entry in results:
+        old_entry = previous_results.get(_key(entry))
+        if not old_entry or not old_entry["seconds"]:
+            continue
+        ratio = old_entry["seconds"] / entry["seconds"] if entry["seconds"] else 0
+        print(
+            f"{entry['profile']:>8} {entry['encoding']:>10} {entry['rows']:>9} rows  {entry['stage']:<22}"
+            f"{ratio:8.2f}x"
+        )
+
+
+def main():
+    parser = ArgumentParser(description="csv2vcard throughput benchmarks")
+    parser.add_argument(
+        "--rows",
+        default="1000,10000",
+        help="Comma separated CSV sizes, eg 1000,100000,10000000",
+    )
+    parser.add_argument("--profiles", default=",".join(PROFILES))
+    parser.add_argument(
+        "--encodings",
+        default="utf-8,cp1252",
+        help="Comma separated CSV file encodings, eg utf-8,utf-8-sig,cp1252",
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--sample-rows",
+        type=int,
+        default=DEFAULT_SAMPLE_ROWS,
+        help="Max contacts kept in memory for create_vcard and export stages",
+    )
+    parser.add_argument(
+        "--max-files",
+        type=int,
+        default=DEFAULT_MAX_FILES,
+        help="Max files written by per contact stages",
+    )
+    parser.add_argument(
+        "--memory",
+        action="store_true",
+        default=False,
+        help="Measure peak memory with tracemalloc, which slows down every stage",
+    )
+    parser.add_argument("--work-dir", default=None, help="Directory for temp files")
+    parser.add_argument("--output", default=None, help="JSON result file")
+    parser.add_argument("--compare", default=None, help="Previous JSON result file")
+    args = parser.parse_args()
+
+    # Keep logging from measuring console output
+    # Per contact errors still happen, eg when cp1252 files are detected as another single byte codepage
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="csv2vcard-bench-", dir=args.work_dir)
+    try:
+        for profile in args.profiles.split(","):
+            for encoding in args.encodings.split(","):
+                for rows in args.rows.split(","):
+                    results += bench_case(
+                        work_dir,
+                        profile,
+                        int(rows),
+                        encoding,
+                        args.seed,
+                        args.sample_rows,
+                        args.max_files,
+                        args.memory,
+                    )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    result = {
+        "meta": {
+            "commit": _git_commit(),
+            "date": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fp:
+            json.dump(result, fp, indent=4)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+#
+# This file is part of csv2vcard
+
+__intname__ = "benchmarks.generate_csv"
+__author__ = "Orsiris de Jong"
+__copyright__ = "Copyright (C) 2023 NetInvent SASU"
+__licence__ = "MIT"
+__build__ = "2026101801"
+
+
+"""
+Seeded generator of realistic contact CSV files, used by the benchmarks
+
+Two header profiles exist:
+ - default: columns of the csv2vcard default mapping
+ - orange: columns of mappings/orange_webmail.json, padded with unmapped columns like real webmail exports
+Generated values contain accents, embedded newlines and optional inline base64 photos
+"""
+
+
+from typing import List
+import os
+import sys
+import csv
+import json
+import base64
+import random
+from argparse import ArgumentParser
+
+# Insert parent dir as path se we get to use our package
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from csv2vcard.create_vcard import default_mapping
+
+ORANGE_MAPPING_FILE = os.path.join(
+    os.path.dirname(__file__), "..", "mappings", "orange_webmail.json"
+)
+# Real webmail exports have about 88 columns, most of them not being mapped
+ORANGE_COLUMN_COUNT = 88
+
+PROFILES = ["default", "orange"]
+
+FIRST_NAMES = ["Forrest", "Jérôme", "Zoë", "Françoise", "Björn", "Ana", "José", "Li"]
+LAST_NAMES = ["Gump", "Dupont", "Müller", "Łukasiewicz", "O'Brien", "Nuñez", "Smith"]
+CITIES = ["Baytown", "Paris", "Besançon", "Köln", "Zürich", "São Paulo", "Łódź"]
+WORDS = ["shrimp", "boat", "café", "naïve", "crème", "brûlée", "façade", "run"]
+
+
+def ordered_columns(value) -> List[str]:
+    """
+    Returns the column names of a mapping, in mapping order and without duplicates
+    """
+    columns = []
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        for sub_value in value:
+            for column in ordered_columns(sub_value):
+                if column not in columns:
+                    columns.append(column)
+    return columns
+
+
+def get_header(profile: str) -> List[str]:
+    if profile == "default":
+        return ordered_columns(default_mapping)
+    if profile == "orange":
+        with open(ORANGE_MAPPING_FILE, "r", encoding="utf-8") as fp:
+            header = ordered_columns(json.load(fp))
+        num = 1
+        while len(header) < ORANGE_COLUMN_COUNT:
+            header.append(f"Champ personnalisé {num}")
+            num += 1
+        return header
+    raise ValueError(f"Unknown profile {profile}")
+
+
+def get_mapping_file(profile: str) -> str:
+    if profile == "orange":
+        return ORANGE_MAPPING_FILE
+    return None
+
+
+def _value(rng: random.Random, column: str, contact: dict, photo_ratio: float) -> str:
+    lower_column = column.lower()
+    if "mail" in lower_column or "messagerie" in lower_column:
+        return f"{contact['first']}.{contact['last']}@example.com".replace(" ", "")
+    if any(
+        name in lower_column for name in ["phone", "fax", "pager", "text", "tél", "tel"]
+    ):
+        return f"+33 {rng.randint(1, 9)} {rng.randint(10, 99)} {rng.randint(10, 99)} {rng.randint(10, 99)} {rng.randint(10, 99)}"
+    if any(name in lower_column for name in ["birthday", "anniversa"]):
+        return f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(1940, 2005)}"
+    if lower_column in ["gender", "sexe"]:
+        return rng.choice(["M", "F", ""])
+    if lower_column == "geo":
+        return f"{rng.uniform(-90, 90):.4f};{rng.uniform(-180, 180):.4f}"
+    if lower_column in ["key", "logo"]:
+        if rng.random() < 0.1:
+            return f"https://example.com/{lower_column}/{rng.randint(1, 10000)}"
+        return ""
+    if lower_column == "photo":
+        if rng.random() < photo_ratio:
+            size = rng.randint(2048, 8192)
+            data = rng.getrandbits(size * 8).to_bytes(size, "little")
+            return base64.b64encode(data).decode("ascii")
+        return ""
+    if lower_column in ["last_name", "nom"]:
+        return contact["last"]
+    if lower_column in ["first_name", "prénom"]:
+        return contact["first"]
+    if "city" in lower_column or "ville" in lower_column:
+        return rng.choice(CITIES)
+    if lower_column in ["remarks", "notes"]:
+        # Multiline notes are quoted by the CSV writer, and cleaned by csv2vcard
+        return "\r\n".join(
+            " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+            for _ in range(rng.randint(1, 3))
+        )
+    if rng.random() < 0.3:
+        return ""
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 3)))
+
+
+def generate_csv(
+    filename: str,
+    rows: int,
+    profile: str = "default",
+    seed: int = 42,
+    encoding: str = "utf-8",
+    delimiter: str = ";",
+    photo_ratio: float = 0.05,
+) -> List[str]:
+    """
+    Writes a CSV file of synthetic contacts, always identical for a given seed, and returns its header
+    Values that cannot be represented in the requested encoding are replaced
+    """
+    rng = random.Random(seed)
+    header = get_header(profile)
+    with open(
+        filename, "w", encoding=encoding, errors="replace", newline=""
+    ) as file_handle:
+        writer = csv.writer(file_handle, delimiter=delimiter)
+        writer.writerow(header)
+        for _ in range(rows):
+            contact = {
+                "first": rng.choice(FIRST_NAMES),
+                "last": rng.choice(LAST_NAMES),
+            }
+            writer.writerow(
+                [_value(rng, column, contact, photo_ratio) for column in header]
+            )
+    return header
+
+
+def main():
+    parser = ArgumentParser(description="Generates synthetic contact CSV files")
+    parser.add_argument("output", help="Path to CSV file to create")
+    parser.add_argument("--rows", type=int, default=1000, help="Number of contacts")
+    parser.add_argument("--profile", choices=PROFILES, default="default")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--encoding", default="utf-8", help="eg utf-8, utf-8-sig, cp1252, latin-1"
+    )
+    parser.add_argument("--delimiter", default=";")
+    parser.add_argument(
+        "--photo-ratio",
+        type=float,
+        default=0.05,
+        help="Ratio of contacts with an inline base64 photo",
+    )
+    args = parser.parse_args()
+    generate_csv(
+        args.output,
+        args.rows,
+        args.profile,
+        args.seed,
+        args.encoding,
+        args.delimiter,
+        args.photo_ratio,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -15,16 +15,22 @@ __version__ = "0.6.2"
 
 import os
 import sys
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
 import ofunctions.logger_utils
-from csv2vcard.csv_handler import interface_entrypoint
+from csv2vcard.csv_handler import interface_entrypoint, parse_target
 from csv2vcard.path_helper import CURRENT_DIR
 
-
 LOG_FILE = os.path.join(CURRENT_DIR, "{}.log".format(__intname__))
 logger = ofunctions.logger_utils.logger_get_logger(LOG_FILE)
 
 
+def target_spec(spec: str):
+    try:
+        return parse_target(spec)
+    except ValueError as exc:
+        raise ArgumentTypeError(str(exc))
+
+
 def cli_interface():
     parser = ArgumentParser(
         prog=__intname__,
@@ -40,7 +46,7 @@ This is free software, and you are welcome to redistribute it under certain cond
         dest="source",
         default=None,
         required=True,
-        help="Path to source CSV file / folder containing CSV files",
+        help="Path to source CSV file / folder containing CSV files, or - for stdin",
     )
 
     parser.add_argument(
@@ -49,8 +55,18 @@ This is free software, and you are welcome to redistribute it under certain cond
         type=str,
         dest="output_dir",
         default=None,
-        required=True,
-        help="Path to destination folder",
+        required=False,
+        help="Path to destination folder, or - to write a single VCF stream to stdout, or a .zip, .tar, .tar.gz file, or an http(s) CardDAV address book URL",
+    )
+
+    parser.add_argument(
+        "--target",
+        type=target_spec,
+        dest="targets",
+        action="append",
+        default=[],
+        required=False,
+        help="Additional output from the same conversion, like format=jcard,output=contacts or format=3,output=out,single,max_vcards=500. Options are format (3, 4 or jcard), output, single, max_size, max_vcards and template. Can be given multiple times",
     )
 
     parser.add_argument(
@@ -97,6 +113,15 @@ This is free software, and you are welcome to redistribute it under certain cond
         help="Optional encoding for CSV file",
     )
 
+    parser.add_argument(
+        "--encoding-probe-bytes",
+        type=int,
+        dest="encoding_probe_bytes",
+        default=None,
+        required=False,
+        help="Amount of data read to guess CSV file encoding, defaults to 1MB",
+    )
+
     parser.add_argument(
         "--max-vcard-file-size",
         type=int,
@@ -115,6 +140,85 @@ This is free software, and you are welcome to redistribute it under certain cond
         help="Optional max number of vCards in a single vCard file",
     )
 
+    parser.add_argument(
+        "--fsync",
+        action="store_true",
+        default=False,
+        help="Sync per contact vCard files to disk by batches",
+    )
+
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        default=False,
+        help="Overwrite an existing archive, or existing contacts of a CardDAV server",
+    )
+
+    parser.add_argument(
+        "--keep-existing",
+        action="store_true",
+        dest="keep_existing",
+        default=False,
+        help="Keep per contact vCard files of earlier runs, using unique filenames for new ones",
+    )
+
+    parser.add_argument(
+        "--shard-depth",
+        type=int,
+        dest="shard_depth",
+        default=0,
+        required=False,
+        help="Spread per contact vCard files over hashed folders like ab/cd/, 256 folders per level, 1 or 2 levels",
+    )
+
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="Only convert added or changed contacts into per contact vCard files, and remove vCard files of deleted contacts, using a manifest stored in the output folder",
+    )
+
+    parser.add_argument(
+        "--output-template",
+        type=str,
+        dest="output_template",
+        default=None,
+        required=False,
+        help="Write single vCard files named after a template like {name}-{num:03d}.vcf, num being the file number when split, name the CSV file name",
+    )
+
+    parser.add_argument(
+        "--carddav-connections",
+        type=int,
+        dest="carddav_connections",
+        default=None,
+        required=False,
+        help="Number of concurrent uploads to a CardDAV server, defaults to 8",
+    )
+
+    parser.add_argument(
+        "--month-first",
+        action="store_true",
+        default=False,
+        help="Read ambiguous BDAY and ANNIVERSARY dates like 03/04/1965 as month first, instead of day first",
+    )
+
+    parser.add_argument(
+        "--normalize-tel",
+        action="store_true",
+        default=False,
+        help="Write TEL values as E.164 numbers, tel: URIs in vCard 4.0",
+    )
+
+    parser.add_argument(
+        "--tel-region",
+        type=str,
+        dest="tel_region",
+        default=None,
+        required=False,
+        help="Two letter country code used to read national phone numbers, like FR or DE, implies --normalize-tel",
+    )
+
     parser.add_argument(
         "--strip-accents",
         action="store_true",
@@ -122,21 +226,89 @@ This is free software, and you are welcome to redistribute it under certain cond
         help="Optional strip accents from vCards for max compatibility",
     )
 
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        dest="jobs",
+        default=1,
+        required=False,
+        help="Number of conversion processes, used per CSV file when source is a folder, else per batch of contacts. 0 uses all CPUs, defaults to 1",
+    )
+
+    parser.add_argument(
+        "--mmap",
+        action="store_true",
+        dest="use_mmap",
+        default=False,
+        help="Read local CSV files through a memory map. With --jobs, a single CSV file is split into byte ranges parsed by every process",
+    )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        default=False,
+        help="Log every contact conversion error as it happens, instead of a summary per CSV file",
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        dest="metrics_file",
+        default=None,
+        required=False,
+        help="Write per stage timings, counters and error counts of the conversion to a JSON file",
+    )
+
+    parser.add_argument(
+        "--profile",
+        type=str,
+        dest="profile_file",
+        default=None,
+        required=False,
+        help="Write cProfile stats of the conversion to a file, readable with pstats",
+    )
+
     args = parser.parse_args()
     version_string = f"{__intname__} {__version__}\n{__description__}\n{__copyright__}"
-    print(version_string)
+    if args.output_dir == "-" or any(target.output == "-" for target in args.targets):
+        # Keep stdout for vCards only
+        for handler in logger.handlers:
+            if getattr(handler, "stream", None) is sys.stdout:
+                handler.setStream(sys.stderr)
+        print(version_string, file=sys.stderr)
+    else:
+        print(version_string)
 
     config = {"settings": {}}
     config["settings"]["csv_filename"] = args.source
     config["settings"]["csv_delimiter"] = args.delimiter
     config["settings"]["mapping_file"] = args.mapping_file
     config["settings"]["encoding"] = args.encoding
+    config["settings"]["encoding_probe_bytes"] = args.encoding_probe_bytes
     config["settings"]["output_dir"] = args.output_dir
     config["settings"]["vcard_version"] = args.vcard_version
     config["settings"]["single_vcard_file"] = args.single_vcard
     config["settings"]["max_vcard_file_size"] = args.max_vcard_file_size
     config["settings"]["max_vcards_per_file"] = args.max_vcards_per_file
+    config["settings"]["output_template"] = args.output_template
+    config["settings"]["targets"] = args.targets
     config["settings"]["strip_accents"] = args.strip_accents
+    config["settings"]["month_first"] = args.month_first
+    config["settings"]["normalize_tel"] = args.normalize_tel or bool(args.tel_region)
+    config["settings"]["tel_region"] = args.tel_region
+    config["settings"]["fsync"] = args.fsync
+    config["settings"]["overwrite"] = args.overwrite
+    config["settings"]["keep_existing"] = args.keep_existing
+    config["settings"]["incremental"] = args.incremental
+    config["settings"]["shard_depth"] = args.shard_depth
+    config["settings"]["carddav_connections"] = args.carddav_connections
+    config["settings"]["jobs"] = args.jobs
+    config["settings"]["use_mmap"] = args.use_mmap
+    config["settings"]["verbose"] = args.verbose
+    config["settings"]["metrics_file"] = args.metrics_file
+    config["settings"]["profile_file"] = args.profile_file
     interface_entrypoint(config)
 
 
@@ -0,0 +1,298 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+#
+# This file is part of csv2vcard
+
+
+"""
+Asyncio API, eg for web services receiving uploaded CSV files
+
+CSV data is read from an async byte stream and cut into blocks of complete CSV records,
+which are converted in an executor so vCard creation never blocks the event loop
+
+    async with session.get(url) as response:
+        count = await aconvert(response.content, "/path/to/vcards")
+"""
+
+from typing import AsyncIterator, List, Tuple, Union, Any
+import os
+import io
+import csv
+import codecs
+import asyncio
+from concurrent.futures import Executor
+from logging import getLogger
+from csv2vcard.csv_handler import (
+    make_row_parser,
+    detect_sample_encoding,
+    ENCODING_PROBE_BYTES,
+)
+from csv2vcard.create_vcard import create_vcard, CompiledMapping
+from csv2vcard.errors import ErrorAggregator
+from csv2vcard.mmap_reader import RecordScanner
+from csv2vcard.export_vcard import (
+    check_export_dir,
+    RollingVcardWriter,
+    BatchedVcardExporter,
+)
+from ofunctions.string_handling import convert_accents
+
+
+logger = getLogger()
+
+# Amount of data read from the source stream at once
+CHUNK_SIZE = 64 * 1024
+# Amount of CSV data converted at once in the executor
+BATCH_CHARS = 1024**2
+
+
+async def _iter_chunks(source: Any, chunk_size: int) -> AsyncIterator[bytes]:
+    """
+    Reads an async byte stream, eg an aiohttp or asyncio StreamReader, or any async iterable of bytes
+    """
+    if hasattr(source, "read"):
+        while True:
+            chunk = await source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        async for chunk in source:
+            if chunk:
+                yield chunk
+
+
+async def _iter_blocks(
+    source: Any, encoding: str, csv_delimiter: str, chunk_size: int, batch_chars: int
+) -> AsyncIterator[str]:
+    """
+    Yields decoded blocks of complete CSV records of at least batch_chars characters, but the last one
+    When encoding is None, it is guessed from the first bytes of the stream
+    """
+    chunks = _iter_chunks(source, chunk_size)
+    probe = b""
+    if not encoding:
+        async for chunk in chunks:
+            probe += chunk
+            if len(probe) >= ENCODING_PROBE_BYTES:
+                break
+        encoding = detect_sample_encoding(
+            probe, truncated=len(probe) >= ENCODING_PROBE_BYTES
+        )
+        logger.info(f"Guessed stream encoding: {encoding}")
+
+    decoder = codecs.getincrementaldecoder(encoding)()
+    text = decoder.decode(probe)
+    # Quoting state is carried along, so every character is only scanned once
+    scanner = RecordScanner(csv_delimiter)
+    async for chunk in chunks:
+        text += decoder.decode(chunk)
+        if len(text) < batch_chars:
+            continue
+        end = scanner.scan(text, final=False)
+        if end > 0:
+            yield text[:end]
+            text = text[end:]
+            scanner.shift(end)
+    text += decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+def _convert_block(
+    block: str,
+    header: List[str],
+    csv_delimiter: str,
+    strip_accents: bool,
+    vcard_version: int,
+    mapping: CompiledMapping,
+) -> Tuple[List[Tuple[str, str]], ErrorAggregator]:
+    """
+    Creates the vCards of a block of CSV records, in an executor thread or process
+    """
+    parse_row = make_row_parser(header, strip_accents, mapping.columns, records=True)
+    vcards = []
+    for row in csv.reader(io.StringIO(block, newline=""), delimiter=csv_delimiter):
+        vcard, filename = create_vcard(parse_row(row), vcard_version, mapping=mapping)
+        if vcard:
+            vcards.append((vcard, filename))
+    return vcards, mapping.errors.pop()
+
+
+def _read_header(
+    block: str, csv_delimiter: str, strip_accents: bool
+) -> Tuple[List[str], str]:
+    """
+    Splits the CSV header from the first block, returning the header and the remaining records
+    """
+    fp = io.StringIO(block, newline="")
+    header = next(csv.reader(fp, delimiter=csv_delimiter), None)
+    if header is None:
+        return None, ""
+    if strip_accents:
+        header = [convert_accents(column) for column in header]
+    return header, block[fp.tell() :]
+
+
+async def aiter_vcard_batches(
+    source: Any,
+    csv_delimiter: str = ";",
+    encoding: str = None,
+    vcard_version: int = 4,
+    mapping_file: str = None,
+    strip_accents: bool = False,
+    mapping: CompiledMapping = None,
+    executor: Executor = None,
+    chunk_size: int = CHUNK_SIZE,
+    batch_chars: int = BATCH_CHARS,
+    name: str = "stream",
+) -> AsyncIterator[List[Tuple[str, str]]]:
+    """
+    Yields lists of (vcard, filename) tuples created from an async CSV byte stream
+
+    Blocks of batch_chars characters are converted by executor, the event loop default executor
+    being used when none is given. With a process pool, the mapping is sent along with every block
+    A compiled mapping should not be shared between concurrent conversions, since it counts errors
+    """
+    if mapping is None:
+        mapping = CompiledMapping(mapping_file, strip_accents)
+    loop = asyncio.get_running_loop()
+    header = None
+    try:
+        async for block in _iter_blocks(
+            source, encoding, csv_delimiter, chunk_size, batch_chars
+        ):
+            if header is None:
+                header, block = _read_header(block, csv_delimiter, strip_accents)
+                if header is None:
+                    continue
+                if not mapping.check_header(header):
+                    return
+            vcards, errors = await loop.run_in_executor(
+                executor,
+                _convert_block,
+                block,
+                header,
+                csv_delimiter,
+                strip_accents,
+                vcard_version,
+                mapping,
+            )
+            mapping.errors.merge(errors)
+            if vcards:
+                yield vcards
+        if header is None:
+            logger.error(f"CSV stream {name} is empty")
+    except UnicodeDecodeError as exc:
+        logger.error(
+            f"Failed to decode {name}. Try to adjust manually with encoding parameter: {exc}"
+        )
+    finally:
+        mapping.errors.pop().log_summary(name)
+
+
+async def aiter_vcards(source: Any, **kwargs) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Yields (vcard, filename) tuples created from an async CSV byte stream
+    Accepts the same arguments as aiter_vcard_batches()
+    """
+    async for vcards in aiter_vcard_batches(source, **kwargs):
+        for vcard in vcards:
+            yield vcard
+
+
+def _write_vcards(
+    writer: Union[RollingVcardWriter, BatchedVcardExporter],
+    vcards: List[Tuple[str, str]],
+) -> None:
+    for vcard, filename in vcards:
+        writer.write(vcard, filename)
+
+
+def _encode_vcards(vcards: List[Tuple[str, str]], first: bool) -> bytes:
+    # vCards are separated by an empty line, like in single vCard files
+    data = "\n".join(vcard for vcard, _ in vcards)
+    if not first:
+        data = "\n" + data
+    return data.encode("utf-8")
+
+
+async def aconvert(
+    source: Any,
+    sink: Any,
+    csv_delimiter: str = ";",
+    encoding: str = None,
+    vcard_version: int = 4,
+    mapping_file: str = None,
+    strip_accents: bool = False,
+    mapping: CompiledMapping = None,
+    single_vcard_file: bool = False,
+    max_vcard_file_size: int = None,
+    max_vcards_per_file: int = None,
+    keep_existing: bool = False,
+    executor: Executor = None,
+    chunk_size: int = CHUNK_SIZE,
+    batch_chars: int = BATCH_CHARS,
+    name: str = "stream",
+) -> int:
+    """
+    Converts an async CSV byte stream, returning the number of created vCards
+
+    sink can be:
+     - a path to an output directory, where vCards are written like csv2vcard() does, single vCard
+       files being named after name. Files are written by the event loop default executor
+     - an object with a write() method, eg an aiohttp StreamResponse, an asyncio StreamWriter or an
+       aiofiles file opened in binary mode, which receives vCards as UTF-8 bytes. write() may be
+       a coroutine, and asyncio StreamWriter are drained after every batch
+    """
+    loop = asyncio.get_running_loop()
+    batches = aiter_vcard_batches(
+        source,
+        csv_delimiter=csv_delimiter,
+        encoding=encoding,
+        vcard_version=vcard_version,
+        mapping_file=mapping_file,
+        strip_accents=strip_accents,
+        mapping=mapping,
+        executor=executor,
+        chunk_size=chunk_size,
+        batch_chars=batch_chars,
+        name=name,
+    )
+    count = 0
+
+    if isinstance(sink, (str, os.PathLike)):
+        output_dir = os.fspath(sink)
+        # Writers cannot be sent to other processes, so file I/O always happens in threads
+        await loop.run_in_executor(None, check_export_dir, output_dir)
+        if single_vcard_file:
+            writer = RollingVcardWriter(
+                output_dir,
+                name,
+                # Make sure we are counting in KB
+                max_file_size=(
+                    max_vcard_file_size * 1024 if max_vcard_file_size else None
+                ),
+                max_vcards=max_vcards_per_file,
+            )
+        else:
+            writer = await loop.run_in_executor(
+                None,
+                lambda: BatchedVcardExporter(output_dir, keep_existing=keep_existing),
+            )
+        try:
+            async for vcards in batches:
+                await loop.run_in_executor(None, _write_vcards, writer, vcards)
+                count += len(vcards)
+        finally:
+            await loop.run_in_executor(None, writer.close)
+        return count
+
+    async for vcards in batches:
+        result = sink.write(_encode_vcards(vcards, first=not count))
+        if asyncio.iscoroutine(result) or isinstance(result, asyncio.Future):
+            await result
+        if isinstance(sink, asyncio.StreamWriter):
+            await sink.drain()
+        count += len(vcards)
+    return count
@@ -0,0 +1,282 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+#
+# This file is part of csv2vcard
+
+
+"""
+CardDAV upload of vCards, eg when migrating contacts into a groupware
+
+Every vCard is PUT as its own resource of an address book collection, by a pool of threads
+keeping their HTTP connection alive, so thousands of contacts don't need thousands of TLS handshakes
+"""
+
+from typing import Tuple, Optional
+import os
+import time
+import base64
+import threading
+import http.client
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, quote, unquote
+from logging import getLogger
+from csv2vcard.create_vcard import JCARD
+from csv2vcard.export_vcard import FilenameAllocator, get_vcard_uid
+
+
+logger = getLogger()
+
+# Credentials used when the collection URL has none
+USER_ENV = "CSV2VCARD_CARDDAV_USER"
+PASSWORD_ENV = "CSV2VCARD_CARDDAV_PASSWORD"
+CARDDAV_CONNECTIONS = 8
+CARDDAV_RETRIES = 4
+# Seconds waited before the first retry, doubled on every retry
+CARDDAV_BACKOFF = 0.5
+MAX_RETRY_AFTER = 60
+# Statuses worth sending the same request again
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+# Statuses that would fail for every vCard, eg bad credentials or missing collection
+FATAL_STATUSES = (401, 403, 404, 405, 409)
+CONTENT_TYPES = {
+    None: "text/vcard; charset=utf-8",
+    JCARD: "application/vcard+json; charset=utf-8",
+}
+
+
+def is_carddav_url(path: str) -> bool:
+    return bool(path) and str(path).lower().startswith(("http://", "https://"))
+
+
+class CardDavError(OSError):
+    pass
+
+
+class CardDavWriter:
+    """
+    Uploads one resource per vCard into a CardDAV address book collection
+
+    url is the collection URL, credentials being given in the URL or by the CSV2VCARD_CARDDAV_USER
+    and CSV2VCARD_CARDDAV_PASSWORD environment variables
+    At most connections uploads run at once, each thread reusing its own keep-alive connection
+    Timeouts, throttling and server errors are retried with an exponential backoff, honoring
+    Retry-After headers
+    Unless overwrite is set, resources are created with If-None-Match: *, so existing contacts are
+    never replaced, vCards whose name is taken getting another name like BatchedVcardExporter does
+    When a request is sent again after a timeout or a dropped connection, the server may have stored
+    the first one, so a resource that already exists is fetched, and taken as the uploaded vCard if
+    it has the same UID, or the same content for vCards without UID
+    ETags of resources uploaded by this writer are kept in etags by resource name, they are not
+    stored between runs
+    """
+
+    def __init__(
+        self,
+        url: str,
+        connections: int = None,
+        overwrite: bool = False,
+        retries: int = CARDDAV_RETRIES,
+        backoff: float = CARDDAV_BACKOFF,
+        timeout: float = 30,
+        output_format: str = None,
+        log_every: int = 1000,
+    ):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"Invalid CardDAV collection URL {url}")
+        self._connection_class = (
+            http.client.HTTPSConnection
+            if parts.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self._host = parts.hostname
+        self._port = parts.port
+        self._path = parts.path.rstrip("/") + "/"
+        # Never log credentials
+        self.url = f"{parts.scheme}://{parts.netloc.rpartition('@')[2]}{self._path}"
+        self.files = [self.url]
+        user = unquote(parts.username) if parts.username else os.environ.get(USER_ENV)
+        password = (
+            unquote(parts.password)
+            if parts.password
+            else os.environ.get(PASSWORD_ENV, "")
+        )
+        self._headers = {
+            "Content-Type": CONTENT_TYPES[JCARD if output_format == JCARD else None]
+        }
+        # vCard lines end with CRLF, see RFC 6350
+        self._crlf = output_format != JCARD
+        if user:
+            credentials = base64.b64encode(f"{user}:{password}".encode("utf-8"))
+            self._headers["Authorization"] = f"Basic {credentials.decode('ascii')}"
+        self.overwrite = overwrite
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.log_every = log_every
+        self.allocator = FilenameAllocator(None)
+        self.etags = {}
+        self.count = 0
+        self.bytes_written = 0
+        self.failed = 0
+        self.retried = 0
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        connections = connections or CARDDAV_CONNECTIONS
+        self._pending = deque()
+        self._max_pending = connections * 4
+        self._executor = ThreadPoolExecutor(max_workers=connections)
+
+    def _get_connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._connection_class(
+                self._host, self._port, timeout=self.timeout
+            )
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _request(
+        self, method: str, filename: str, headers: dict, data: bytes = None
+    ) -> Tuple[int, Optional[str], bytes, bool]:
+        """
+        Sends a request about a resource, retrying failed attempts, and returns the response status,
+        ETag and body, and whether an attempt without response may have been processed by the server
+        """
+        href = self._path + quote(filename)
+        attempt = 0
+        resent = False
+        while True:
+            connection = self._get_connection()
+            delay = self.backoff * 2**attempt
+            try:
+                connection.request(method, href, body=data, headers=headers)
+                response = connection.getresponse()
+                # The response must be read entirely before the connection can be reused
+                body = response.read()
+                status = response.status
+                if status not in RETRY_STATUSES or attempt >= self.retries:
+                    return status, response.getheader("ETag"), body, resent
+                retry_after = response.getheader("Retry-After", "")
+                if retry_after.isdigit():
+                    delay = min(int(retry_after), MAX_RETRY_AFTER)
+                reason = f"HTTP {status}"
+            except (OSError, http.client.HTTPException) as exc:
+                # Keep-alive connections may have been closed by the server meanwhile
+                connection.close()
+                if attempt >= self.retries:
+                    raise CardDavError(f"Cannot upload {href}: {exc}") from exc
+                reason = str(exc) or exc.__class__.__name__
+                resent = True
+            attempt += 1
+            with self._lock:
+                self.retried += 1
+            logger.debug(f"Retrying upload of {href} in {delay}s: {reason}")
+            time.sleep(delay)
+
+    def _is_stored(self, filename: str, data: bytes) -> bool:
+        """
+        Returns True when a resource holds the given vCard, eg stored by an attempt whose response
+        was lost
+        """
+        headers = {
+            name: value
+            for name, value in self._headers.items()
+            if name != "Content-Type"
+        }
+        status, _, body, _ = self._request("GET", filename, headers)
+        if status != 200:
+            return False
+        stored = body.decode("utf-8", errors="replace").replace("\r\n", "\n")
+        vcard = data.decode("utf-8").replace("\r\n", "\n")
+        uid = get_vcard_uid(vcard)
+        if uid:
+            return get_vcard_uid(stored) == uid
+        return stored.strip() == vcard.strip()
+
+    def _upload(self, vcard: str, filename: str) -> Tuple[int, int]:
+        """
+        Uploads a vCard, returning the number of uploaded vCards and bytes
+        """
+        if self._crlf:
+            vcard = vcard.replace("\n", "\r\n")
+        data = vcard.encode("utf-8")
+        headers = dict(self._headers)
+        if not self.overwrite:
+            headers["If-None-Match"] = "*"
+        while True:
+            status, etag, _, resent = self._request("PUT", filename, headers, data)
+            if status in (200, 201, 204):
+                if etag:
+                    with self._lock:
+                        self.etags[filename] = etag
+                logger.debug(f"Uploaded vCard {filename}")
+                return 1, len(data)
+            if status == 412:
+                if resent and self._is_stored(filename, data):
+                    logger.debug(
+                        f"Uploaded vCard {filename}, response of first attempt lost"
+                    )
+                    return 1, len(data)
+                # A resource with the same name already exists on the server
+                filename = self.allocator.allocate(filename)
+                continue
+            if status in FATAL_STATUSES:
+                raise CardDavError(
+                    f"CardDAV server refused upload to {self.url} with HTTP {status}"
+                )
+            logger.error(f"Cannot upload vCard {filename}: HTTP {status}")
+            with self._lock:
+                self.failed += 1
+            return 0, 0
+
+    def _collect(self, max_pending: int) -> None:
+        while len(self._pending) > max_pending:
+            try:
+                uploaded, size = self._pending.popleft().result()
+            except CardDavError:
+                # Queued uploads would fail the same way
+                for future in self._pending:
+                    future.cancel()
+                self._pending.clear()
+                raise
+            previous_count = self.count
+            self.count += uploaded
+            self.bytes_written += size
+            if self.count // self.log_every > previous_count // self.log_every:
+                logger.info(f"Uploaded {self.count} vCards to {self.url}")
+
+    def write(self, vcard: str, filename: str) -> str:
+        """
+        Queues a vCard upload, returning the resource name it gets, unless already taken on the server
+        """
+        filename = self.allocator.allocate(filename, get_vcard_uid(vcard))
+        self._pending.append(self._executor.submit(self._upload, vcard, filename))
+        self._collect(self._max_pending)
+        return filename
+
+    def close(self) -> None:
+        if self._executor is None:
+            return
+        try:
+            self._collect(0)
+        except CardDavError as exc:
+            logger.critical(f"Upload to {self.url} stopped: {exc}")
+        finally:
+            self._executor.shutdown()
+            self._executor = None
+            for connection in self._connections:
+                connection.close()
+        logger.info(
+            f"Uploaded {self.count} vCards to {self.url}, {self.failed} failed, {self.retried} retries"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -4,15 +4,19 @@
 # This file is part of csv2vcard
 
 
-from typing import Tuple, Union, Optional, Callable
+from typing import Tuple, Union, Optional, Callable, List, Iterable
+import re
 import base64
-from binascii import Error as binascii_Error
+from copy import deepcopy
 from datetime import datetime
 import json
 from logging import getLogger
 from email.utils import parseaddr
 from ofunctions.string_handling import convert_accents
 from ofunctions.misc import replace_in_iterable
+from csv2vcard.errors import ErrorAggregator
+from csv2vcard.dates import DateColumns, DATE_KEYS, format_date
+from csv2vcard.phones import PhoneNormalizer, format_tel
 
 
 logger = getLogger()
@@ -22,7 +26,7 @@ logger = getLogger()
 # BEGIN:VCARD
 # VERSION:2.1|3.0|4.0
 # ADR,TYPE=HOME|WORK:Postbox;Adress with street number;City;Region;ZIP;Country
-# ANNIVERSARY:YYYYMMJJ|ISO8601-date
+# ANNIVERSARY:YYYYMMJJ|ISO8601-date                                        # Dates are normalized, see dates.py
 # BDAY:YYYYMMJJ|ISO8601-date
 # CATEGORGIES:[comma separated tags]
 # EMAIL,TYPE=HOME|WORK:[emailadr]
@@ -49,7 +53,8 @@ logger = getLogger()
 # REV:[ISO8601-date timestamp for last vcard revision]
 # ROLE:[text]
 # SOURCE:http://example.tld/me.vcf
-# TEL;TYPE=HOME|WORK,CELL|FAX|PAGER,VOICE,VIDEO,TEXT,TEXTPHONE:[phone number]
+# TEL;TYPE=HOME|WORK,CELL|FAX|PAGER,VOICE,VIDEO,TEXT,TEXTPHONE:[phone number]    # V3 syntax, or V4 text syntax
+# TEL;VALUE=uri;TYPE=HOME|WORK,...:tel:+33123456789                          # V4 normalized syntax, see phones.py
 # TITLE:[text]
 # TZ:+0100                                                                  # V3 syntax
 # TZ:Europe/Paris                                                           # V4 syntax
@@ -124,221 +129,679 @@ def load_mapping_file(mapping_file: str):
         return json.load(fp)
 
 
-def create_vcard(
-    contact: dict,
-    version: int = 4,
-    mapping_file: dict = None,
-    strip_accents: bool = True,
-) -> Tuple[str, str]:
+# vCard properties that can either hold an URI or inline base64 data, with their v3 / v4 media types
+MEDIA_TYPES = {
+    "KEY": {3: "PGP", 4: "application/pgp-keys"},
+    "LOGO": {3: "PNG", 4: "application/png"},
+    "PHOTO": {3: "JPEG", 4: "image/jpeg"},
+}
+
+VALID_GENDERS = ["", "M", "F", "O", "N", "U"]
+
+# Output formats of create_cards(), vCard versions being given as strings
+JCARD = "jcard"
+CARD_FORMATS = ["3", "4", JCARD]
+# Properties whose ; separated components are arrays in jCard
+STRUCTURED_PROPERTIES = {"N", "ADR", "ORG", "GENDER"}
+# jCard value types of properties that are not text
+JCARD_VALUE_TYPES = {
+    "ANNIVERSARY": "date-and-or-time",
+    "BDAY": "date-and-or-time",
+    "GEO": "uri",
+    "KEY": "uri",
+    "LOGO": "uri",
+    "PHOTO": "uri",
+    "REV": "timestamp",
+    "SOURCE": "uri",
+    "URL": "uri",
+}
+REV_PATTERN = re.compile(r"^(\d{4})(\d{2})(\d{2})T(\d{2})(\d{2})(\d{2})Z$")
+# Normalized vCard 4.0 dates, with or without year, that jCard writes in extended format
+VCARD_DATE_PATTERN = re.compile(r"^(\d{4}|-)-?(\d{2})(\d{2})$")
+
+# Characters that are removed from concatenated values since they are vCard separators
+CONCAT_STRIP_TABLE = str.maketrans("", "", ",;:")
+
+
+class ContactRecord:
     """
-    The mappings used below are from https://www.w3.org/TR/vcard-rdf/#Mapping
+    Compact contact holding the values of a CSV row, in the order of a fields tuple shared by all rows
+
+    Can be read like a dict, although emitters of a bound mapping access values by offset
     """
 
-    if version not in [3, 4]:
-        raise ValueError("Incorrect Vcard version given. Currently supported: 3 or 4.")
-    if not mapping_file:
-        mapping = default_mapping
-    else:
-        mapping = load_mapping_file(mapping_file)
+    __slots__ = ("fields", "values")
 
-    if strip_accents:
-        mapping = replace_in_iterable(mapping, convert_accents)
+    def __init__(self, fields: Tuple[str, ...], values: Tuple[str, ...]):
+        self.fields = fields
+        self.values = values
 
-    vcard_map = {}
-    for key, value in mapping.items():
-        # Don't bother when no mapping is available
-        if not value:
-            continue
+    @classmethod
+    def from_dict(cls, contact: dict) -> "ContactRecord":
+        return cls(tuple(contact), tuple(contact.values()))
 
-        # Handle all keys with TYPE
+    def to_dict(self) -> dict:
+        return dict(zip(self.fields, self.values))
+
+    def __getitem__(self, column: str) -> str:
         try:
-            mapping[key]["TYPE"]
-        except (KeyError, TypeError):
-            pass
-        else:
-            for type_key, type_value in mapping[key]["TYPE"].items():
-                idkey = f"{key}-{type_key}-{type_value}"
-                if isinstance(mapping[key]["TYPE"][type_key], list):
-                    mapping_len = len(mapping[key]["TYPE"][type_key])
-                    composite_result = ""
-                    for num, sub_key in enumerate(mapping[key]["TYPE"][type_key]):
-                        if sub_key:
-                            try:
-                                if num == mapping_len - 1:
-                                    composite_result += f"{contact[sub_key]}"
-                                else:
-                                    composite_result += f"{contact[sub_key]};"
-                            except KeyError:
-                                if num < mapping_len - 1:
-                                    composite_result += ";"
-                                logger.error(
-                                    f"1010: Mapping {key} has no match in CSV file {sub_key}"
-                                )
-                    # Drop if result = ADDR,TYPE=HOME:;;;;
-                    if composite_result != ";;;;":
-                        vcard_map[idkey] = f"{key};TYPE={type_key}:{composite_result}"
-
-                else:
-                    # Emails are handled here
-                    try:
-                        if (
-                            mapping[key]["TYPE"][type_key]
-                            and contact[mapping[key]["TYPE"][type_key]]
-                        ):
-                            if key == "EMAIL":
-                                # parseaddr() returns a tuple of displayname, emailaddr or tuple None,None
-                                # Makes RFC822 email addr validation
-                                _, email = parseaddr(
-                                    contact[mapping[key]["TYPE"][type_key]]
-                                )
-                                if not email:
-                                    logger.error(
-                                        f"1014: No valid email addres in {contact}"
-                                    )
-                                    continue
-                            vcard_map[id] = (
-                                f"{key};TYPE={type_key}:{contact[mapping[key]['TYPE'][type_key]]}"
-                            )
-                    except (KeyError, TypeError):
-                        logger.error(
-                            f"1001: Mapping {key} has no match in CSV file {type_value}"
-                        )
+            return self.values[self.fields.index(column)]
+        except ValueError:
+            raise KeyError(column) from None
 
-            continue
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+
+def _missing_column(contact: ContactRecord, version: int) -> None:
+    """
+    Emitter for a mapped column that does not exist in the CSV file, which is reported once by
+    CompiledMapping.check_header() or CompiledMapping.bind(), not per contact
+    """
+    return None
+
+
+def _bind_columns(offsets: dict, columns: list) -> Callable[[ContactRecord], str]:
+    """
+    Returns a function joining multiple CSV columns into a ; separated vCard value
+    Unmapped or missing columns are kept as empty values so the vCard component order is preserved
+    """
+    indexes = [offsets.get(column) if column else None for column in columns]
+
+    def join(contact: ContactRecord) -> str:
+        values = contact.values
+        return ";".join(["" if index is None else values[index] for index in indexes])
+
+    return join
+
+
+def _bind_type_list(
+    offsets: dict, errors: ErrorAggregator, key: str, type_key: str, columns: list
+) -> Callable:
+    join = _bind_columns(offsets, columns)
+    empty_result = ";" * (len(columns) - 1)
+
+    def emit(contact: ContactRecord, version: int) -> Optional[str]:
+        composite_result = join(contact)
+        # Drop if result = ADR;TYPE=HOME:;;;;;
+        if composite_result == empty_result:
+            return None
+        return f"{key};TYPE={type_key}:{composite_result}"
+
+    return emit
+
+
+def _bind_type_value(
+    offsets: dict, errors: ErrorAggregator, key: str, type_key: str, column: str
+) -> Callable:
+    if column not in offsets:
+        return _missing_column
+    index = offsets[column]
+
+    def emit(contact: ContactRecord, version: int) -> Optional[str]:
+        data = contact.values[index]
+        if not data:
+            return None
+        if key == "EMAIL":
+            # parseaddr() returns a tuple of displayname, emailaddr or tuple None,None
+            # Makes RFC822 email addr validation
+            _, email = parseaddr(data)
+            if not email:
+                errors.add(1014, key, column, contact)
+                return None
+        return f"{key};TYPE={type_key}:{data}"
+
+    return emit
+
+
+def _bind_tel(
+    offsets: dict,
+    errors: ErrorAggregator,
+    key: str,
+    type_key: str,
+    phones: PhoneNormalizer,
+    column: str,
+) -> Callable:
+    """
+    Phone numbers are written as tel: URIs in vCard 4.0 and E.164 numbers in vCard 3.0, so without
+    version, lines of every version are returned by version. Other values are kept as is
+    """
+    if column not in offsets:
+        return _missing_column
+    index = offsets[column]
+
+    def emit(contact: ContactRecord, version: int) -> Union[str, dict, None]:
+        data = contact.values[index]
+        if not data:
+            return None
+        phone = phones.normalize(data)
+        if phone is None:
+            errors.add(1017, key, column, data)
+            return f"{key};TYPE={type_key}:{data}"
+        if version is None:
+            return {
+                3: f"{key};TYPE={type_key}:{format_tel(phone, 3)}",
+                4: f"{key};VALUE=uri;TYPE={type_key}:{format_tel(phone, 4)}",
+            }
+        if version == 3:
+            return f"{key};TYPE={type_key}:{format_tel(phone, 3)}"
+        return f"{key};VALUE=uri;TYPE={type_key}:{format_tel(phone, 4)}"
+
+    return emit
+
+
+def _bind_concat(
+    offsets: dict, errors: ErrorAggregator, key: str, columns: list
+) -> Callable:
+    columns = [column for column in columns if column]
+    indexes = [offsets[column] for column in columns if column in offsets]
+
+    def emit(contact: ContactRecord, version: int) -> Optional[str]:
+        values = contact.values
+        entries = []
+        for index in indexes:
+            # TODO: We could check if left or right has a space, and depending on it, replace with ' ' or ''
+            data = values[index].translate(CONCAT_STRIP_TABLE).strip()
+            if data:
+                entries.append(data)
+        if not entries:
+            errors.add(1012, key, None, contact)
+            return None
+        return f"{key}:{' '.join(entries)}"
+
+    return emit
+
+
+def _bind_list(
+    offsets: dict, errors: ErrorAggregator, key: str, columns: list
+) -> Callable:
+    join = _bind_columns(offsets, columns)
+
+    def emit(contact: ContactRecord, version: int) -> Optional[str]:
+        return f"{key}:{join(contact)}"
+
+    return emit
+
+
+def _media_line(key: str, data_type: dict, data: str, uri: bool, version: int) -> str:
+    if uri:
+        if version == 3:
+            return f"{key};TYPE={data_type[3]}:{data}"
+        return f"{key};MEDIATYPE={data_type[4]}:{data}"
+    if version == 3:
+        return f"{key};TYPE={data_type[3]};ENCODING=b:{data}"
+    return f"{key};data:{data_type[4]};base64,{data}"
+
+
+def _bind_media(
+    offsets: dict, errors: ErrorAggregator, key: str, column: str
+) -> Callable:
+    """
+    Media lines depend on the vCard version, so without version, lines of every version are
+    returned by version, the data being checked once
+    """
+    if column not in offsets:
+        return _missing_column
+    index = offsets[column]
+    data_type = MEDIA_TYPES[key]
+
+    def emit(contact: ContactRecord, version: int) -> Union[str, dict, None]:
+        data = contact.values[index]
+        contact_value = data.strip()
+        if not contact_value:
+            return None
+
+        uri = contact_value.lower().startswith("http")
+        if not uri:
+            try:
+                base64.b64decode(data)
+            # binascii.Error is a ValueError, which is also raised for non ASCII data
+            except (TypeError, ValueError):
+                errors.add(1005, key, column)
+                return None
+        if version is None:
+            return {
+                line_version: _media_line(key, data_type, data, uri, line_version)
+                for line_version in data_type
+            }
+        return _media_line(key, data_type, data, uri, version)
+
+    return emit
+
+
+def _bind_value(
+    offsets: dict, errors: ErrorAggregator, key: str, column: str
+) -> Callable:
+    if column not in offsets:
+        return _missing_column
+    index = offsets[column]
+
+    def emit(contact: ContactRecord, version: int) -> Optional[str]:
+        data = contact.values[index]
+        if not data:
+            return None
+
+        # Now check that we don't get garbage data
+        if key == "GENDER":
+            if data.upper() not in VALID_GENDERS:
+                errors.add(1006, key, column, data)
+                return None
+            return f"{key}:{data.upper()}"
+        if key == "GEO" and ";" not in data:
+            errors.add(1007, key, column, data)
+            return None
+        return f"{key}:{data}"
+
+    return emit
+
+
+def _bind_date(
+    offsets: dict, errors: ErrorAggregator, key: str, dates: DateColumns, column: str
+) -> Callable:
+    """
+    Dates are written as vCard dates of the requested version, so without version, lines of every
+    version are returned by version. Values that are not dates are kept as text in vCard 4.0 only,
+    their vCard 3.0 line being None
+    """
+    if column not in offsets:
+        return _missing_column
+    index = offsets[column]
+    normalizer = dates.get(column)
+
+    def emit(contact: ContactRecord, version: int) -> Union[str, dict, None]:
+        data = contact.values[index]
+        if not data:
+            return None
+        parts = normalizer.parse(data)
+        if parts is None:
+            errors.add(1016, key, column, data)
+            if version == 3:
+                return None
+            line = f"{key};VALUE=text:{data}"
+            return {3: None, 4: line} if version is None else line
+        if version is None:
+            return {
+                line_version: f"{key}:{format_date(parts, line_version)}"
+                for line_version in (3, 4)
+            }
+        return f"{key}:{format_date(parts, version)}"
+
+    return emit
+
+
+# Error codes of mapped columns that do not exist in the CSV file, per emitter factory
+MISSING_COLUMN_ERRORS = {
+    _bind_type_value: 1001,
+    _bind_tel: 1001,
+    _bind_list: 1002,
+    _bind_media: 1003,
+    _bind_value: 1004,
+    _bind_date: 1004,
+    _bind_type_list: 1010,
+    _bind_concat: 1011,
+}
+
+
+def _mapped_columns(value: Union[str, list, dict]) -> set:
+    """
+    Returns the CSV column names a mapping value refers to
+    """
+    if not value:
+        return set()
+    if isinstance(value, str):
+        return {value}
+    if isinstance(value, dict):
+        value = list(value.get("TYPE", {}).values()) + [value.get("CONCAT")]
+    columns = set()
+    for sub_value in value:
+        columns |= _mapped_columns(sub_value)
+    return columns
+
+
+def _compile_key(
+    key: str,
+    value: Union[str, list, dict],
+    dates: DateColumns = None,
+    phones: PhoneNormalizer = None,
+) -> List[tuple]:
+    """
+    Transforms a single mapping key into a list of (vcard_map key, emitter factory, factory args) tuples
+    Emitter factories are called once the CSV fields are known, see CompiledMapping.bind()
+    Date keys are normalized by the date normalizers of dates, and TEL values by phones, if given
+    """
+    # Don't bother when no mapping is available
+    if not value:
+        return []
+
+    if isinstance(value, dict):
+        # Handle all keys with TYPE
+        if "TYPE" in value:
+            plan = []
+            for type_key, type_value in value["TYPE"].items():
+                idkey = f"{key}-{type_key}"
+                if isinstance(type_value, list):
+                    plan.append((idkey, _bind_type_list, (key, type_key, type_value)))
+                elif type_value and key == "TEL" and phones is not None:
+                    plan.append((idkey, _bind_tel, (key, type_key, phones, type_value)))
+                elif type_value:
+                    plan.append((idkey, _bind_type_value, (key, type_key, type_value)))
+            return plan
 
         # Handle special concatenation case for FN where multiple colunms will be concatenated to a string
         # Also removes unecessary separator characters
-        try:
-            mapping[key]["CONCAT"]
-        except (KeyError, TypeError):
-            pass
-        else:
-            if isinstance(mapping[key]["CONCAT"], list):
-                fn_entry = ""
-                for sub_key in mapping[key]["CONCAT"]:
-                    if sub_key:
-                        try:
-                            data = contact[sub_key]
-                            for char in [",", ";", ":"]:
-                                # TODO: We could check if left or right has a space, and depending on it, replace with ' ' or ''
-                                data = data.replace(char, "")
-                            fn_entry += data.strip()
-                        except KeyError:
-                            logger.error(
-                                f"1011: Mapping {key} has no match in CSV file {sub_key}"
-                            )
-                if not fn_entry.strip():
-                    logger.error(f"1012: No Valid FN entry for {contact}")
-                else:
-                    vcard_map[key] = f"{key}:{fn_entry.strip()}"
-                continue
-            else:
-                logger.error(
-                    f"1013: Key {key} with CONCAT does not contain a list of columns to concatenate"
-                )
-                continue
+        if "CONCAT" in value:
+            if isinstance(value["CONCAT"], list):
+                return [(key, _bind_concat, (key, value["CONCAT"]))]
+            logger.error(
+                f"1013: Key {key} with CONCAT does not contain a list of columns to concatenate"
+            )
+            return []
 
-        # Handle all list types
-        if isinstance(mapping[key], list):
-            vcard_map[key] = f"{key}:"
-            for num, sub_key in enumerate(mapping[key]):
-                if sub_key:
-                    try:
-                        if num == mapping_len - 1:
-                            vcard_map[key] += f"{contact[sub_key]}"
-                        else:
-                            vcard_map[key] += f"{contact[sub_key]};"
-                    except KeyError:
-                        if num < mapping_len - 1:
-                            vcard_map[key] += ";"
-                        logger.error(
-                            f"1002: Mapping {key} has no match in CSV file {sub_key}"
-                        )
-            continue
+        logger.error(f"1004: Mapping {key} has no match in CSV file {value}")
+        return []
 
-        # Handle special cases for KEY, LOGO and PHOTO
-        if key in ["KEY", "LOGO", "PHOTO"]:
-            try:
-                contact_value = contact[value].strip()
-            except KeyError:
-                logger.error(f"1003: Mapping {key} has no match in CSV file {value}")
-                continue
+    # Handle all list types
+    if isinstance(value, list):
+        return [(key, _bind_list, (key, value))]
 
-            # pylint E0606 (possibly-used-before-assignment) fix
-            data_type = {3: "", 4: ""}
-            if key == "KEY":
-                data_type = {3: "PGP", 4: "application/pgp-keys"}
-            if key == "LOGO":
-                data_type = {3: "PNG", 4: "application/png"}
-            if key == "PHOTO":
-                data_type = {3: "JPEG", 4: "image/jpeg"}
-
-            if contact_value.lower().startswith("http"):
-                if version == 3:
-                    vcard_map[key] = f"{key};TYPE={data_type[3]}:{contact[value]}"
-                if version == 4:
-                    vcard_map[key] = f"{key};MEDIATYPE={data_type[4]}:{contact[value]}"
-            else:
-                try:
-                    base64.b64decode(contact[value])
-                except (TypeError, binascii_Error):
+    # Handle special cases for KEY, LOGO and PHOTO
+    if key in MEDIA_TYPES:
+        return [(key, _bind_media, (key, value))]
+
+    if key in DATE_KEYS and dates is not None:
+        return [(key, _bind_date, (key, dates, value))]
+
+    # Handle all other scenarios
+    return [(key, _bind_value, (key, value))]
+
+
+class CompiledMapping:
+    """
+    vCard mapping that is loaded and prepared once, then reused for every contact of a run
+
+    Every mapping key is turned into a flat plan of field emitters. Once bound to the fields of
+    a CSV file, an emitter is a callable taking a contact record and a vCard version, and returning
+    a vCard line or None, reading contact values by offsets resolved at bind time
+    An already loaded mapping dict can be given instead of a mapping file
+    columns holds every CSV column name the mapping refers to, columns_by_key the ones of every vCard key
+    Per contact errors are counted in errors, see ErrorAggregator, and only logged as they
+    happen when verbose is set
+    Dates are normalized by the per column normalizers of dates, ambiguous dates being read day
+    first unless day_first is False. date_formats are already inferred formats by column
+    With normalize_tel, TEL values are normalized by phones, national numbers being read in
+    tel_region, see PhoneNormalizer
+    Mapped columns missing from the CSV header are reported once by check_header(), or by bind() when
+    contacts come without header, eg as dicts
+    """
+
+    def __init__(
+        self,
+        mapping_file: str = None,
+        strip_accents: bool = True,
+        mapping: dict = None,
+        verbose: bool = False,
+        day_first: bool = True,
+        date_formats: dict = None,
+        normalize_tel: bool = False,
+        tel_region: str = None,
+    ):
+        if mapping is not None:
+            mapping = deepcopy(mapping)
+        elif mapping_file:
+            mapping = load_mapping_file(mapping_file)
+        else:
+            mapping = deepcopy(default_mapping)
+
+        # Column names need to match the CSV header, which has its accents stripped too
+        if strip_accents:
+            mapping = replace_in_iterable(mapping, convert_accents)
+
+        self.mapping_file = mapping_file
+        self.strip_accents = strip_accents
+        self.mapping = mapping
+        self.verbose = verbose
+        self.errors = ErrorAggregator(verbose)
+        self.dates = DateColumns(day_first, date_formats)
+        self.normalize_tel = normalize_tel
+        self.tel_region = tel_region
+        self.phones = PhoneNormalizer(tel_region) if normalize_tel else None
+        self.plan = []
+        self.columns = set()
+        self.columns_by_key = {}
+        for key, value in mapping.items():
+            self.plan += _compile_key(key, value, self.dates, self.phones)
+            self.columns_by_key[key] = _mapped_columns(value)
+            self.columns |= self.columns_by_key[key]
+        self._bound = {}
+        self.header = None
+        self._reported = set()
+
+    def _report_missing(self, columns: Iterable[str], reported: set) -> None:
+        for _, factory, args in self.plan:
+            key, key_columns = args[0], args[-1]
+            if isinstance(key_columns, str):
+                key_columns = [key_columns]
+            for column in key_columns:
+                if column and column not in columns and (key, column) not in reported:
+                    reported.add((key, column))
                     logger.error(
-                        f"1005: Contact key {key} has bogus data (no URI nor B64 encoded data) in CSV file map {value}"
+                        f"{MISSING_COLUMN_ERRORS[factory]}: Mapping {key} has no match in CSV file {column}"
                     )
+
+    def bind(self, fields: Tuple[str, ...]) -> List[Tuple[str, Callable]]:
+        """
+        Returns (vcard_map key, emitter) tuples for contact records holding the given fields
+        Emitters are cached per fields tuple, which is shared by every row of a CSV file
+        """
+        try:
+            return self._bound[fields]
+        except KeyError:
+            pass
+        offsets = {field: index for index, field in enumerate(fields)}
+        # Columns missing from a header are already reported, and short rows only lack values
+        if self.header is None:
+            self._report_missing(offsets, self._reported)
+        emitters = [
+            (idkey, factory(offsets, self.errors, *args))
+            for idkey, factory, args in self.plan
+        ]
+        self._bound[fields] = emitters
+        return emitters
+
+    def check_header(self, header: List[str]) -> bool:
+        """
+        Logs every mapped column missing from a CSV header once, before any row is converted
+        Returns False when none of the mapped columns exist, eg when the CSV delimiter is wrong
+        """
+        self.header = set(header)
+        self._report_missing(self.header, set())
+        if not self.columns & self.header:
+            logger.error(
+                "1015: None of the mapped columns exist in CSV file header, please check CSV delimiter and mapping"
+            )
+            return False
+        return True
+
+    def infer_dates(self, contacts: List[ContactRecord]) -> None:
+        """
+        Infers the date format of every date column from a sample of contacts, see DateColumns
+        """
+        for _, factory, args in self.plan:
+            if factory is not _bind_date:
+                continue
+            column = args[-1]
+            values = []
+            for contact in contacts:
+                try:
+                    values.append(contact[column])
+                except KeyError:
+                    # Short rows lack trailing columns
                     continue
+            self.dates.infer(column, values)
+
+    def __reduce__(self):
+        # Emitters are closures which cannot be pickled, so worker processes compile the mapping again
+        return (
+            self.__class__,
+            (
+                self.mapping_file,
+                self.strip_accents,
+                self.mapping,
+                self.verbose,
+                self.dates.day_first,
+                self.dates.formats,
+                self.normalize_tel,
+                self.tel_region,
+            ),
+            # Workers must not report columns missing from an already checked header
+            {"header": self.header},
+        )
+
+
+def _build_vcard_map(
+    contact: ContactRecord, version: Optional[int], mapping: CompiledMapping
+) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Returns the vCard lines of a contact by vcard_map key, and its vCard filename
+    Without version, version dependent lines are dicts of lines by version, see _bind_media()
+    """
+    vcard_map = {}
+    for idkey, emit in mapping.bind(contact.fields):
+        entry = emit(contact, version)
+        if entry:
+            vcard_map[idkey] = entry
+    # Actually add revision to our vcard if not exist
+    if "REV" not in vcard_map:
+        vcard_map["REV"] = "REV:" + datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
 
-                if version == 3:
-                    vcard_map[key] = (
-                        f"{key};TYPE={data_type[3]};ENCODING=b:{contact[value]}"
-                    )
-                if version == 4:
-                    vcard_map[key] = (
-                        f"{key};data:{data_type[4]};base64,{contact[value]}"
-                    )
-            continue
+    # Foolproof check
+    name = vcard_map.get("N", "N:")[2:]
+    if vcard_map.get("FN", "FN:") == "FN:" or not name.replace(";", ""):
+        mapping.errors.add(1008, "N", None, contact)
+        return None, None
 
-        # Handle all other scenarios
-        try:
-            data = contact[value]
-        except (KeyError, TypeError):
-            logger.error(f"1004: Mapping {key} has no match in CSV file {value}")
-            continue
+    vc_filename = "-".join(filter(None, name.split(";"))) + ".vcf"
+    return vcard_map, vc_filename
 
-        # Now check that we don't get garbage data
-        if key == "GENDER":
-            if data.upper() not in ["", "M", "F", "O", "N", "U"]:
-                logger.error(
-                    f"1006: Key {key} has invalid gender {data} in CSV file map {value}"
-                )
-            elif data:
-                vcard_map[key] = f"{key}:{data.upper()}"
+
+def _render_vcard(lines: Iterable[str], version: int) -> str:
+    return f"BEGIN:VCARD\nVERSION:{version}.0\n" + "\n".join(lines) + "\nEND:VCARD\n"
+
+
+def _jcard_property(line: str) -> list:
+    """
+    Converts a vCard 4.0 line into a jCard property, see RFC 7095
+    """
+    head, _, value = line.partition(":")
+    name, *params = head.split(";")
+    jcard_params = {}
+    value_type = JCARD_VALUE_TYPES.get(name, "text")
+    for param in params:
+        # Inline media lines hold a data URI
+        if param == "data":
+            value = f"data:{value}"
             continue
-        elif key == "GEO":
-            if not ";" in data:
-                logger.error(
-                    f"1007: Key {key} has invalid geo data {data} in CSV file map {value}"
-                )
-            elif data:
-                vcard_map[key] = f"{key}:{data}"
-        elif data:
-            vcard_map[key] = f"{key}:{data}"
+        param_name, _, param_value = param.partition("=")
+        # The value type is not a parameter in jCard
+        if param_name == "VALUE":
+            value_type = param_value.lower()
+            continue
+        values = param_value.lower().split(",")
+        jcard_params[param_name.lower()] = values[0] if len(values) == 1 else values
+
+    if name == "REV" and REV_PATTERN.match(value):
+        value = REV_PATTERN.sub(r"\1-\2-\3T\4:\5:\6Z", value)
+    elif name == "GEO":
+        value = f"geo:{value.replace(';', ',')}"
+    elif name in STRUCTURED_PROPERTIES and ";" in value:
+        value = value.split(";")
+    elif value_type == "date-and-or-time":
+        match = VCARD_DATE_PATTERN.match(value)
+        if match:
+            value = "-".join(match.groups())
+        else:
+            value_type = "text"
+    return [name.lower(), jcard_params, value_type, value]
 
-    # Actually add revision to our vcard if not exist
-    try:
-        vcard_map["REV"]
-    except KeyError:
-        vcard_map["REV"] = "REV:" + datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
 
-    vcard_str_content = ""
-    for entry in vcard_map:
-        vcard_str_content += vcard_map[entry] + "\n"
+def render_jcard(lines: Iterable[str]) -> str:
+    properties = [["version", {}, "text", "4.0"]]
+    properties += [_jcard_property(line) for line in lines]
+    return json.dumps(["vcard", properties], ensure_ascii=False)
 
-    # Foolproof check
-    if vcard_map["FN"] == "FN:" or vcard_map["N"] == "N:;;;;;":
-        logger.error(f"1008: Cannot create vcard for contact {contact}")
+
+def create_vcard(
+    contact: Union[dict, ContactRecord],
+    version: int = 4,
+    mapping_file: str = None,
+    strip_accents: bool = True,
+    mapping: CompiledMapping = None,
+) -> Tuple[str, str]:
+    """
+    The mappings used below are from https://www.w3.org/TR/vcard-rdf/#Mapping
+
+    contact can be a dict of CSV column names and values, or a ContactRecord
+    When no compiled mapping is given, one is built from mapping_file for this single contact,
+    and its errors are logged right away
+    """
+
+    if version not in [3, 4]:
+        raise ValueError("Incorrect Vcard version given. Currently supported: 3 or 4.")
+    if mapping is None:
+        mapping = CompiledMapping(mapping_file, strip_accents, verbose=True)
+    if not isinstance(contact, ContactRecord):
+        contact = ContactRecord.from_dict(contact)
+
+    vcard_map, vc_filename = _build_vcard_map(contact, version, mapping)
+    if vcard_map is None:
         return None, None
+    return _render_vcard(vcard_map.values(), version), vc_filename
 
-    vcard = f"BEGIN:VCARD\nVERSION:{version}.0\n" + vcard_str_content + "END:VCARD\n"
-    vc_filename = "-".join(filter(None, vcard_map["N"].split(";")))[2:] + ".vcf"
 
-    return vcard, vc_filename
+def create_cards(
+    contact: Union[dict, ContactRecord],
+    formats: Tuple[str, ...],
+    mapping_file: str = None,
+    strip_accents: bool = True,
+    mapping: CompiledMapping = None,
+) -> Tuple[Optional[Tuple[str, ...]], Optional[str]]:
+    """
+    Renders a contact to every requested format of CARD_FORMATS at once, returning the cards in
+    formats order and the vCard filename, or None, None when the contact cannot be converted
+
+    The contact is mapped once, only version dependent lines being rendered per format
+    jCards are rendered from vCard 4.0 lines
+    """
+    for output_format in formats:
+        if output_format not in CARD_FORMATS:
+            raise ValueError(
+                f"Unknown output format {output_format}. Currently supported: {', '.join(CARD_FORMATS)}."
+            )
+    if len(formats) == 1 and formats[0] != JCARD:
+        vcard, vc_filename = create_vcard(
+            contact, int(formats[0]), mapping_file, strip_accents, mapping
+        )
+        return (vcard,) if vcard else None, vc_filename
+
+    if mapping is None:
+        mapping = CompiledMapping(mapping_file, strip_accents, verbose=True)
+    if not isinstance(contact, ContactRecord):
+        contact = ContactRecord.from_dict(contact)
+    vcard_map, vc_filename = _build_vcard_map(contact, None, mapping)
+    if vcard_map is None:
+        return None, None
+
+    cards = []
+    for output_format in formats:
+        version = 4 if output_format == JCARD else int(output_format)
+        lines = [
+            entry if isinstance(entry, str) else entry[version]
+            for entry in vcard_map.values()
+        ]
+        # Lines that have no equivalent in this version
+        lines = [line for line in lines if line]
+        if output_format == JCARD:
+            cards.append(render_jcard(lines))
+        else:
+            cards.append(_render_vcard(lines, version))
+    return tuple(cards), vc_filename
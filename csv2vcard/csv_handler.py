@@ -4,14 +4,61 @@
 # This file is part of csv2vcard
 
 
+from typing import (
+    Iterator,
+    Iterable,
+    List,
+    Tuple,
+    Callable,
+    Union,
+    Optional,
+    IO,
+    TextIO,
+)
 import os
+import sys
+import shutil
+import tempfile
+import io
 import pathlib
 import csv
+import codecs
+import gzip
+import bz2
+import lzma
+from functools import partial
+from itertools import islice, chain
+from contextlib import contextmanager, ExitStack
 from logging import getLogger
-import re
-import unicodedata
-from csv2vcard.export_vcard import check_export_dir, export_vcard
-from csv2vcard.create_vcard import create_vcard
+from time import perf_counter
+from csv2vcard.export_vcard import (
+    check_export_dir,
+    RollingVcardWriter,
+    StreamVcardWriter,
+    BatchedVcardExporter,
+    ArchiveVcardWriter,
+    FilenameAllocator,
+    get_shard_index_size,
+    compact_shard_index,
+    is_archive_path,
+    sanitize_filename,
+    MAX_SHARD_DEPTH,
+)
+from csv2vcard.create_vcard import (
+    create_cards,
+    CompiledMapping,
+    ContactRecord,
+    CARD_FORMATS,
+    JCARD,
+)
+from csv2vcard.parallel import get_jobs, process_pool, batched, imap_ordered
+from csv2vcard.metrics import Metrics, profiled
+from csv2vcard.errors import ErrorAggregator
+from csv2vcard.manifest import ContactManifest, get_settings_digest
+from csv2vcard.mmap_reader import MappedCsv, is_splittable_encoding
+from csv2vcard.carddav import CardDavWriter, is_carddav_url
+from csv2vcard.dates import DATE_SAMPLE_ROWS
+from csv2vcard.phones import PhoneNormalizer
 from ofunctions.string_handling import convert_accents
 
 try:
@@ -24,65 +71,840 @@ except ImportError:
     )
     _NORMALIZER = False
 
+try:
+    import zstandard
+
+    _ZSTD = True
+except ImportError:
+    _ZSTD = False
+
 
 logger = getLogger()
 
+# Amount of data read from the beginning of a CSV file to guess its encoding
+ENCODING_PROBE_BYTES = 1024**2
+# When the guess confidence is lower, the probe is extended up to ENCODING_PROBE_MAX_FACTOR times
+ENCODING_MIN_CONFIDENCE = 0.5
+ENCODING_PROBE_MAX_FACTOR = 16
+
+# UTF-32 BOMs need to be checked before UTF-16 ones since they share their first bytes
+BOM_ENCODINGS = [
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+# Clean possible ugly CSV files where some jack*ss inserted \r\n or so between fields
+CLEAN_TABLE = str.maketrans("", "", "\n\t\r")
+
+# Source or output path meaning stdin or stdout
+STDIO = "-"
+
+# Magic bytes of compressed CSV files and streams, which are decompressed on the fly
+COMPRESSIONS = [
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+]
+MAGIC_BYTES = 6
+COMPRESSED_SUFFIXES = (".gz", ".bz2", ".xz", ".zst")
+# CSV files picked up when the source is a folder
+CSV_SUFFIXES = (".csv",) + tuple(f".csv{suffix}" for suffix in COMPRESSED_SUFFIXES)
+
+VcardWriter = Union[
+    RollingVcardWriter,
+    StreamVcardWriter,
+    BatchedVcardExporter,
+    ArchiveVcardWriter,
+    FilenameAllocator,
+    get_shard_index_size,
+    compact_shard_index,
+    CardDavWriter,
+]
+
+# Compiled mapping of vCard worker processes, see _init_vcard_worker()
+_worker_mapping = None
+
+
+def bom_encoding(sample: bytes) -> Optional[str]:
+    """
+    Returns the encoding given by the BOM a sample begins with, if any
+    """
+    for bom, encoding in BOM_ENCODINGS:
+        if sample.startswith(bom):
+            return encoding
+    return None
+
+
+def detect_encoding(csv_filename: str, probe_bytes: int = None) -> str:
+    """
+    Guesses the encoding of a CSV file from a bounded sample of its first bytes
+
+    A BOM is looked for first, then the sample is analyzed by charset_normalizer
+    More data is only read when the guess confidence is too low
+    """
+    if not probe_bytes:
+        probe_bytes = ENCODING_PROBE_BYTES
+
+    with open(csv_filename, "rb") as fp:
+        sample = fp.read(probe_bytes)
+        encoding = bom_encoding(sample)
+        if encoding:
+            return encoding
+        if not _NORMALIZER:
+            return "utf-8"
+
+        result = detect(_trim_sample(sample, probe_bytes))
+        confidence = result["confidence"] or 0
+        if confidence < ENCODING_MIN_CONFIDENCE and len(sample) == probe_bytes:
+            logger.info(
+                f"Low encoding detection confidence for {csv_filename}, probing more data"
+            )
+            probe_bytes *= ENCODING_PROBE_MAX_FACTOR
+            sample += fp.read(probe_bytes - len(sample))
+            result = detect(_trim_sample(sample, probe_bytes))
+    return result["encoding"] or "utf-8"
+
+
+def detect_sample_encoding(sample: bytes, truncated: bool = True) -> str:
+    """
+    Guesses the encoding of the first bytes of a CSV stream, which cannot be read again
+    """
+    encoding = bom_encoding(sample)
+    if encoding:
+        return encoding
+    if not _NORMALIZER:
+        return "utf-8"
+    if truncated:
+        sample = _trim_sample(sample, len(sample))
+    return detect(sample)["encoding"] or "utf-8"
+
+
+def _trim_sample(sample: bytes, probe_bytes: int) -> bytes:
+    """
+    Cuts a truncated sample at its last line ending, so we don't analyze a partial multibyte character
+    """
+    if len(sample) < probe_bytes:
+        return sample
+    return sample[: sample.rfind(b"\n") + 1] or sample
+
+
+def make_row_parser(
+    header: List[str],
+    strip_accents: bool,
+    columns: set = None,
+    records: bool = False,
+    metrics: Metrics = None,
+) -> Callable[[List[str]], Union[dict, ContactRecord]]:
+    """
+    Returns a function that turns a CSV row into a contact dict, or a ContactRecord when records is set
+
+    When columns is given, their indexes are resolved once from the header and only those columns
+    are kept, so per row work does not depend on the CSV file width
+    Values are cleaned from line breaks and tabs, accents only being converted for non ASCII values
+    """
+    strip = convert_accents
+    if metrics:
+        strip = metrics.timed("strip_accents", convert_accents)
+    indexes = []
+    fields = []
+    for index, column in enumerate(header):
+        if columns is None or column in columns:
+            indexes.append(index)
+            fields.append(column)
+    fields = tuple(fields)
+
+    def parse_row(row: List[str]) -> Union[dict, ContactRecord]:
+        values = []
+        row_len = len(row)
+        for index in indexes:
+            if index >= row_len:
+                break
+            value = row[index]
+            if value:
+                value = value.translate(CLEAN_TABLE)
+                if strip_accents and not value.isascii():
+                    value = strip(value)
+            values.append(value)
+        if records:
+            # Short rows only hold their first fields
+            if len(values) < len(fields):
+                return ContactRecord(fields[: len(values)], tuple(values))
+            return ContactRecord(fields, tuple(values))
+        return dict(zip(fields, values))
+
+    return parse_row
+
+
+def get_source_name(csv_source: Union[str, os.PathLike, IO]) -> str:
+    """
+    Returns a CSV file path, or the name of a file-like object, eg <stdin>, for logs and output filenames
+    """
+    if isinstance(csv_source, (str, os.PathLike)):
+        return str(csv_source)
+    return str(getattr(csv_source, "name", None) or "stream")
+
+
+class _PrefixedStream(io.RawIOBase):
+    """
+    Raw binary stream giving back already read bytes before reading the rest of a stream
+    Used to guess the encoding of pipes and sockets, which cannot be read twice
+    The wrapped stream is never closed
+    """
+
+    def __init__(self, prefix: bytes, stream: IO[bytes]):
+        self._prefix = prefix
+        self._stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._prefix:
+            size = min(len(buffer), len(self._prefix))
+            buffer[:size] = self._prefix[:size]
+            self._prefix = self._prefix[size:]
+            return size
+        data = self._stream.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def decompress_stream(stream: IO[bytes]) -> IO[bytes]:
+    """
+    Returns a binary stream decompressing gzip, bzip2, xz or zstd data on the fly, compression being
+    recognized by its magic bytes, or a stream giving back plain data as is
+    """
+    magic = stream.read(MAGIC_BYTES)
+    # Buffered so reads are not cut short at the end of the magic bytes
+    stream = io.BufferedReader(_PrefixedStream(magic, stream))
+    for signature, compression in COMPRESSIONS:
+        if not magic.startswith(signature):
+            continue
+        logger.info(f"Decompressing {compression} data")
+        if compression == "gzip":
+            return gzip.GzipFile(fileobj=stream, mode="rb")
+        if compression == "bz2":
+            return bz2.BZ2File(stream, mode="rb")
+        if compression == "xz":
+            return lzma.LZMAFile(stream, mode="rb")
+        if not _ZSTD:
+            raise OSError(
+                "zstd compressed data needs the zstandard package. Please install it via pip"
+            )
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    return stream
+
+
+def _is_compressed(csv_filename: Union[str, os.PathLike]) -> bool:
+    with open(csv_filename, "rb") as fp:
+        magic = fp.read(MAGIC_BYTES)
+    return any(magic.startswith(signature) for signature, _ in COMPRESSIONS)
+
+
+@contextmanager
+def open_csv(
+    csv_source: Union[str, os.PathLike, IO],
+    encoding: str = None,
+    encoding_probe_bytes: int = None,
+    metrics: Metrics = None,
+) -> Iterator[TextIO]:
+    """
+    Opens a CSV file path, or wraps a text or binary file-like object, as a text stream
+
+    Compressed files and binary streams are decompressed on the fly, see decompress_stream()
+    Streams given by the caller are not closed
+    When no encoding is given, it is guessed from the file or the first bytes of a binary stream
+    """
+    name = get_source_name(csv_source)
+    with ExitStack() as stack:
+        if isinstance(csv_source, (str, os.PathLike)) and _is_compressed(csv_source):
+            csv_source = stack.enter_context(open(csv_source, "rb"))
+        text_stream = isinstance(csv_source, io.TextIOBase) or hasattr(
+            csv_source, "encoding"
+        )
+        if not text_stream and not isinstance(csv_source, (str, os.PathLike)):
+            csv_source = stack.enter_context(decompress_stream(csv_source))
+
+        if not encoding and not text_stream:
+            if metrics:
+                metrics.enter("detect_encoding")
+            try:
+                if isinstance(csv_source, (str, os.PathLike)):
+                    encoding = detect_encoding(csv_source, encoding_probe_bytes)
+                else:
+                    probe_bytes = encoding_probe_bytes or ENCODING_PROBE_BYTES
+                    probe = csv_source.read(probe_bytes)
+                    encoding = detect_sample_encoding(
+                        probe, truncated=len(probe) >= probe_bytes
+                    )
+                    csv_source = _PrefixedStream(probe, csv_source)
+            finally:
+                if metrics:
+                    metrics.exit()
+            logger.info(f"Guessed file encoding for {name}: {encoding}")
+
+        if isinstance(csv_source, (str, os.PathLike)):
+            yield stack.enter_context(open(csv_source, "r", encoding=encoding))
+        elif text_stream:
+            yield csv_source
+        else:
+            if not isinstance(csv_source, _PrefixedStream):
+                csv_source = _PrefixedStream(b"", csv_source)
+            yield io.TextIOWrapper(io.BufferedReader(csv_source), encoding=encoding)
+
+
+def map_csv(
+    csv_filename: Union[str, os.PathLike, IO],
+    encoding: str = None,
+    encoding_probe_bytes: int = None,
+    metrics: Metrics = None,
+) -> Tuple[Optional[MappedCsv], Optional[str]]:
+    """
+    Memory maps a local CSV file, returning the mapped file and its encoding, which is guessed if not given
+
+    Streams, compressed or empty files, and encodings whose quotes and line breaks cannot be found
+    by their bytes, give no mapped file, so they are read by open_csv() instead
+    """
+    if (
+        not isinstance(csv_filename, (str, os.PathLike))
+        or not os.path.isfile(csv_filename)
+        or not os.path.getsize(csv_filename)
+        or _is_compressed(csv_filename)
+    ):
+        return None, encoding
+    if not encoding:
+        if metrics:
+            with metrics.stage("detect_encoding"):
+                encoding = detect_encoding(csv_filename, encoding_probe_bytes)
+        else:
+            encoding = detect_encoding(csv_filename, encoding_probe_bytes)
+        logger.info(f"Guessed file encoding for {csv_filename}: {encoding}")
+    if not is_splittable_encoding(encoding):
+        logger.info(
+            f"CSV file {csv_filename} encoding {encoding} cannot be memory mapped, reading it as a stream"
+        )
+        return None, encoding
+    return MappedCsv(csv_filename, encoding), encoding
+
+
+def _log_decode_error(encoding: str, exc: UnicodeDecodeError) -> None:
+    logger.error(
+        f"Failed to decode file with encoding {encoding}. Try to adjust manually with --encoding parameter. Good test values are 'ansi', 'cp850', 'cp1250', 'unicode_escape'... See Python encodings for more."
+    )
+    logger.error(f"Error: {exc}")
+
 
 def parse_csv(
-    csv_filename: str,
+    csv_filename: Union[str, os.PathLike, IO],
     csv_delimiter: str,
     encoding: str = None,
     strip_accents: bool = True,
-) -> dict:
+    encoding_probe_bytes: int = None,
+    columns: set = None,
+    records: bool = False,
+    metrics: Metrics = None,
+    check_header: Callable[[List[str]], bool] = None,
+    strict: bool = False,
+    use_mmap: bool = False,
+) -> Iterator[Union[dict, ContactRecord]]:
     """
     Simple csv parser with a ; delimiter
-    """
 
-    if not encoding and _NORMALIZER:
-        with open(csv_filename, "rb") as fp:
-            # Read first MB of data
-            encoding = detect(fp.read(1024**3))["encoding"]
-        logger.info(f"Guessed file encoding: {encoding}")
-    elif not encoding:
-        encoding = "utf-8"
+    csv_filename can also be a text or binary file-like object, eg a pipe, socket file or in memory buffer
+    Contacts are yielded one by one while the file is read, so memory usage does not grow with file size
+    When columns is given, contacts only hold those columns, eg the ones used by a compiled mapping
+    With records, contacts are yielded as compact ContactRecord instead of dicts
+    Given metrics, encoding detection and accent stripping times are recorded
+    check_header is called with the header before the first row, no rows being read if it returns False
+    With strict, read errors are raised once logged, so callers know the file was not entirely read
+    With use_mmap, local CSV files are read through a memory map when possible, see map_csv()
+    """
 
-    logger.info("Parsing csv..")
+    name = get_source_name(csv_filename)
     try:
-        with open(f"{csv_filename}", "r", encoding=encoding) as fh:
-            contacts = csv.reader(fh, delimiter=csv_delimiter)
-            header = next(contacts)
+        logger.info("Parsing csv..")
+        with ExitStack() as stack:
+            mapped = None
+            if use_mmap:
+                mapped, encoding = map_csv(
+                    csv_filename, encoding, encoding_probe_bytes, metrics
+                )
+            if mapped:
+                stack.enter_context(mapped)
+                header, start = mapped.read_header(csv_delimiter)
+                contacts = mapped.iter_rows(start, csv_delimiter)
+            else:
+                fh = stack.enter_context(
+                    open_csv(csv_filename, encoding, encoding_probe_bytes, metrics)
+                )
+                encoding = fh.encoding
+                contacts = csv.reader(fh, delimiter=csv_delimiter)
+                header = next(contacts, None)
+            if header is None:
+                logger.error(f"CSV file {name} is empty")
+                return
             if strip_accents:
                 header_parsed = []
                 for col in header:
                     header_parsed.append(convert_accents(col))
+            else:
+                header_parsed = header
+            if check_header and not check_header(header_parsed):
+                return
 
-            # Clean possible ugly CSV files where some jack*ss inserted \r\n or so between fields
             # Also opt in to remove accents when file encoding is unclear
-            parsed_contacts = []
-            pattern = re.compile(r"\n|\t|\r")
+            parse_row = make_row_parser(
+                header_parsed, strip_accents, columns, records, metrics
+            )
             for row in contacts:
-                row_parsed = []
-                for col in row:
-                    col_parsed = pattern.sub("", col)
-                    if strip_accents:
-                        col_parsed = convert_accents(col_parsed)
-                    row_parsed.append(col_parsed)
-                parsed_contacts.append(dict(zip(header_parsed, row_parsed)))
-            # parsed_contacts = [dict(zip(header, row)) for row in contacts]
-            return parsed_contacts
+                yield parse_row(row)
     except OSError as exc:
-        logger.error(f"OS error for {csv_filename}: {exc}")
-        return []
+        logger.error(f"OS error for {name}: {exc}")
+        if strict:
+            raise
     except UnicodeDecodeError as exc:
-        logger.error(
-            f"Failed to decode file with encoding {encoding}. Try to adjust manually with --encoding parameter. Good test values are 'ansi', 'cp850', 'cp1250', 'unicode_escape'... See Python encodings for more."
+        _log_decode_error(encoding, exc)
+        if strict:
+            raise
+
+
+def _init_vcard_worker(mapping: CompiledMapping) -> None:
+    global _worker_mapping
+    _worker_mapping = mapping
+
+
+def _create_cards(
+    contacts: List[ContactRecord], formats: Tuple[str, ...]
+) -> Tuple[List[Tuple[Tuple[str, ...], str]], ErrorAggregator]:
+    """
+    Creates the cards of a batch of contacts in a worker process
+
+    Rejected contacts are kept as (None, None), so they can be counted like in serial runs
+    Errors of the batch are returned too, so the parent process can report them
+    """
+    cards = [
+        create_cards(contact, formats, mapping=_worker_mapping) for contact in contacts
+    ]
+    return cards, _worker_mapping.errors.pop()
+
+
+def iter_cards(
+    contacts: Iterable[Union[dict, ContactRecord]],
+    formats: Tuple[str, ...],
+    mapping: CompiledMapping,
+    jobs: int = 1,
+    batch_size: int = 1000,
+) -> Iterator[Tuple[Tuple[str, ...], str]]:
+    """
+    Yields (cards, filename) tuples for contacts, in their original order, cards holding
+    the contact in every output format, see create_cards()
+
+    When jobs > 1, contacts are sent by batches to worker processes
+    """
+    if jobs < 2:
+        for contact in contacts:
+            yield create_cards(contact, formats, mapping=mapping)
+        return
+
+    batches = batched(contacts, batch_size)
+    # Workers get the mapping as it is once the first batch is read, eg with inferred date formats
+    first_batch = next(batches, None)
+    if first_batch is None:
+        return
+    with process_pool(
+        jobs, initializer=_init_vcard_worker, initargs=(mapping,)
+    ) as executor:
+        for cards, errors in imap_ordered(
+            executor,
+            partial(_create_cards, formats=formats),
+            chain([first_batch], batches),
+            max_pending=jobs * 2,
+        ):
+            mapping.errors.merge(errors)
+            yield from cards
+
+
+def iter_vcards(
+    contacts: Iterable[Union[dict, ContactRecord]],
+    version: int,
+    mapping: CompiledMapping,
+    jobs: int = 1,
+    batch_size: int = 1000,
+) -> Iterator[Tuple[str, str]]:
+    """
+    Yields (vcard, filename) tuples for contacts, in their original order, see iter_cards()
+    """
+    for cards, filename in iter_cards(
+        contacts, (str(version),), mapping, jobs, batch_size
+    ):
+        yield (cards[0] if cards else None), filename
+
+
+def _convert_range(
+    byte_range: Tuple[int, int],
+    csv_filename: str,
+    encoding: str,
+    header: List[str],
+    csv_delimiter: str,
+    strip_accents: bool,
+    formats: Tuple[str, ...],
+) -> Tuple[List[Tuple[Tuple[str, ...], str]], ErrorAggregator]:
+    """
+    Parses and converts a byte range of a memory mapped CSV file in a worker process
+    """
+    parse_row = make_row_parser(
+        header, strip_accents, _worker_mapping.columns, records=True
+    )
+    start, end = byte_range
+    with MappedCsv(csv_filename, encoding) as mapped:
+        cards = [
+            create_cards(parse_row(row), formats, mapping=_worker_mapping)
+            for row in mapped.rows(start, end, csv_delimiter)
+        ]
+    return cards, _worker_mapping.errors.pop()
+
+
+def infer_dates(
+    contacts: Iterable[ContactRecord], mapping: CompiledMapping
+) -> Iterator[ContactRecord]:
+    """
+    Yields contacts, once the date formats of mapping are inferred from the first ones
+    """
+    contacts = iter(contacts)
+    sample = list(islice(contacts, DATE_SAMPLE_ROWS))
+    mapping.infer_dates(sample)
+    yield from sample
+    yield from contacts
+
+
+def iter_mapped_cards(
+    csv_filename: Union[str, os.PathLike],
+    csv_delimiter: str,
+    encoding: str,
+    strip_accents: bool,
+    formats: Tuple[str, ...],
+    mapping: CompiledMapping,
+    jobs: int,
+    encoding_probe_bytes: int = None,
+    chunk_size: int = None,
+    metrics: Metrics = None,
+) -> Iterator[Tuple[Tuple[str, ...], str]]:
+    """
+    Yields (cards, filename) tuples of a local CSV file, in their original order, see iter_cards()
+
+    The file is memory mapped and split into byte ranges of whole records of about chunk_size bytes,
+    every range being parsed and converted by a worker process, so rows are never sent to workers
+    Files that cannot be memory mapped are parsed by this process, see map_csv()
+    """
+    name = get_source_name(csv_filename)
+    try:
+        mapped, encoding = map_csv(
+            csv_filename, encoding, encoding_probe_bytes, metrics
+        )
+    except OSError as exc:
+        logger.error(f"OS error for {name}: {exc}")
+        return
+    if not mapped:
+        contacts = parse_csv(
+            csv_filename,
+            csv_delimiter,
+            encoding,
+            strip_accents,
+            encoding_probe_bytes,
+            columns=mapping.columns,
+            records=True,
+            metrics=metrics,
+            check_header=mapping.check_header,
         )
-        logger.error(f"Error: {exc}")
-        return []
+        if metrics:
+            contacts = metrics.timed_iter("parse_csv", contacts, "rows_read")
+        yield from iter_cards(infer_dates(contacts, mapping), formats, mapping, jobs)
+        return
+
+    with mapped:
+        try:
+            header, start = mapped.read_header(csv_delimiter)
+            if header is None:
+                logger.error(f"CSV file {name} is empty")
+                return
+            if strip_accents:
+                header = [convert_accents(column) for column in header]
+            if not mapping.check_header(header):
+                return
+            # Dates are inferred from the first range, before workers get the mapping
+            parse_row = make_row_parser(
+                header, strip_accents, mapping.columns, records=True
+            )
+            sample_range = next(mapped.ranges(start, csv_delimiter, chunk_size), None)
+            if sample_range:
+                rows = mapped.rows(*sample_range, csv_delimiter)
+                mapping.infer_dates(
+                    [parse_row(row) for row in islice(rows, DATE_SAMPLE_ROWS)]
+                )
+            with process_pool(
+                jobs, initializer=_init_vcard_worker, initargs=(mapping,)
+            ) as executor:
+                for cards, errors in imap_ordered(
+                    executor,
+                    partial(
+                        _convert_range,
+                        csv_filename=os.fspath(csv_filename),
+                        encoding=mapped.encoding,
+                        header=header,
+                        csv_delimiter=csv_delimiter,
+                        strip_accents=strip_accents,
+                        formats=formats,
+                    ),
+                    mapped.ranges(start, csv_delimiter, chunk_size),
+                    max_pending=jobs * 2,
+                ):
+                    mapping.errors.merge(errors)
+                    if metrics:
+                        metrics.count("rows_read", len(cards))
+                    yield from cards
+        except UnicodeDecodeError as exc:
+            _log_decode_error(mapped.encoding, exc)
+
+
+def _iter_contacts(
+    rows: Iterable[Union[dict, ContactRecord]], strip_accents: bool, columns: set
+) -> Iterator[ContactRecord]:
+    """
+    Cleans contact dicts given by the caller like CSV rows, ContactRecords being used as is
+    """
+    parsers = {}
+    for row in rows:
+        if isinstance(row, ContactRecord):
+            yield row
+            continue
+        fields = tuple(row)
+        try:
+            parse_row = parsers[fields]
+        except KeyError:
+            header = fields
+            if strip_accents:
+                header = [convert_accents(field) for field in fields]
+            parse_row = parsers[fields] = make_row_parser(
+                header, strip_accents, columns, records=True
+            )
+        yield parse_row(list(row.values()))
+
+
+def stream_vcards(
+    source: Union[str, os.PathLike, IO, Iterable[dict]],
+    csv_delimiter: str = ";",
+    encoding: str = None,
+    vcard_version: int = 4,
+    mapping_file: str = None,
+    strip_accents: bool = False,
+    mapping: CompiledMapping = None,
+    jobs: int = 1,
+    batch_size: int = 1000,
+    encoding_probe_bytes: int = None,
+) -> Iterator[Tuple[str, str]]:
+    """
+    Yields (vcard, filename) tuples without any temporary file
+
+    source can be a CSV file path, a text or binary file-like object like a pipe, socket file or
+    in memory buffer, or any iterable of contact dicts whose keys are CSV column names
+    Contacts that cannot be converted are skipped, and their errors summarized once done
+    """
+    if mapping is None:
+        mapping = CompiledMapping(mapping_file, strip_accents)
+    if isinstance(source, (str, os.PathLike)) or hasattr(source, "read"):
+        name = get_source_name(source)
+        contacts = parse_csv(
+            source,
+            csv_delimiter,
+            encoding,
+            strip_accents,
+            encoding_probe_bytes,
+            columns=mapping.columns,
+            records=True,
+            check_header=mapping.check_header,
+        )
+    else:
+        name = "contacts"
+        contacts = _iter_contacts(source, strip_accents, mapping.columns)
+    try:
+        for vcard, filename in iter_vcards(
+            infer_dates(contacts, mapping), vcard_version, mapping, jobs, batch_size
+        ):
+            if vcard:
+                yield vcard, filename
+    finally:
+        mapping.errors.pop().log_summary(name)
+
+
+def write_vcards(vcards: Iterable[Tuple[str, str]], stream: IO) -> int:
+    """
+    Writes vCards to a text or binary writable stream, separated by an empty line like single vCard files
+    Returns the number of written vCards
+    """
+    binary = not (isinstance(stream, io.TextIOBase) or hasattr(stream, "encoding"))
+    count = 0
+    for vcard, _ in vcards:
+        if count:
+            vcard = "\n" + vcard
+        stream.write(vcard.encode("utf-8") if binary else vcard)
+        count += 1
+    return count
+
+
+def get_output_basename(name: str) -> str:
+    """
+    Returns the single vCard file basename of a CSV source, without compression suffix
+    """
+    basename = os.path.basename(name)
+    if basename.lower().endswith(COMPRESSED_SUFFIXES):
+        basename = os.path.splitext(basename)[0]
+    # Don't keep brackets of stream names like <stdin>
+    return sanitize_filename(basename.strip("<>"))
+
+
+class OutputTarget:
+    """
+    Output format and sink of a conversion, a single conversion being able to write multiple targets
+
+    output_format is one of CARD_FORMATS, output the path of a folder of per contact files, a single
+    file folder with single_vcard_file or output_template, - for stdout, or an archive path
+    A writer can be given, eg to write multiple CSV files into the same archive, which is not closed
+    An allocator can be given, so per contact files of multiple CSV files never get the same name
+    """
+
+    def __init__(
+        self,
+        output_format: str = "4",
+        output: str = None,
+        single_vcard_file: bool = False,
+        max_vcard_file_size: int = None,
+        max_vcards_per_file: int = None,
+        output_template: str = None,
+        writer: VcardWriter = None,
+        allocator: FilenameAllocator = None,
+    ):
+        output_format = str(output_format).lower()
+        if output_format not in CARD_FORMATS:
+            raise ValueError(
+                f"Unknown output format {output_format}. Currently supported: {', '.join(CARD_FORMATS)}."
+            )
+        if not output:
+            raise ValueError("Output target needs an output path")
+        self.output_format = output_format
+        self.output = output
+        self.single_vcard_file = single_vcard_file
+        self.max_vcard_file_size = max_vcard_file_size
+        self.max_vcards_per_file = max_vcards_per_file
+        self.output_template = output_template
+        self.writer = writer
+        self.allocator = allocator
+
+    def __repr__(self) -> str:
+        return f"{self.output_format}:{self.output}"
+
+    # Writers only exist in the process that opened them
+    def __getstate__(self) -> dict:
+        return dict(self.__dict__, writer=None)
+
+
+# Options of a --target spec, see parse_target(), by OutputTarget argument
+TARGET_OPTIONS = {
+    "format": "output_format",
+    "output": "output",
+    "single": "single_vcard_file",
+    "max_size": "max_vcard_file_size",
+    "max_vcards": "max_vcards_per_file",
+    "template": "output_template",
+}
+
+
+def parse_target(spec: str) -> OutputTarget:
+    """
+    Parses a target spec like format=jcard,output=contacts.json or format=3,output=out,single,max_vcards=490
+    """
+    kwargs = {}
+    for option in spec.split(","):
+        key, separator, value = option.partition("=")
+        key = key.strip().lower()
+        if key not in TARGET_OPTIONS:
+            raise ValueError(
+                f"Unknown target option {key}. Currently supported: {', '.join(TARGET_OPTIONS)}."
+            )
+        if key == "single":
+            kwargs[TARGET_OPTIONS[key]] = True
+        elif not separator:
+            raise ValueError(f"Target option {key} needs a value")
+        elif key in ["max_size", "max_vcards"]:
+            kwargs[TARGET_OPTIONS[key]] = int(value)
+        else:
+            kwargs[TARGET_OPTIONS[key]] = value
+    return OutputTarget(**kwargs)
+
+
+def _open_writer(
+    target: OutputTarget,
+    name: str,
+    fsync: bool,
+    overwrite: bool,
+    carddav_connections: int = None,
+    shard_depth: int = 0,
+    keep_existing: bool = False,
+) -> VcardWriter:
+    """
+    Returns the writer of an output target for the CSV source name
+    """
+    output_dir = target.output
+    if is_carddav_url(output_dir):
+        return CardDavWriter(
+            output_dir,
+            connections=carddav_connections,
+            overwrite=overwrite,
+            output_format=target.output_format,
+        )
+    if is_archive_path(output_dir):
+        return ArchiveVcardWriter(output_dir, overwrite=overwrite)
+    if output_dir == STDIO:
+        if not target.output_template:
+            if target.max_vcard_file_size or target.max_vcards_per_file:
+                logger.warning("vCard file limits are ignored when writing to stdout")
+            return StreamVcardWriter(
+                sys.stdout.buffer, "<stdout>", output_format=target.output_format
+            )
+        # Output templates are relative to the current directory
+        output_dir = ""
+    if target.single_vcard_file or target.output_template:
+        if output_dir:
+            check_export_dir(output_dir)
+        return RollingVcardWriter(
+            output_dir,
+            # Don't keep brackets of stream names like <stdin>
+            get_output_basename(name),
+            # Make sure we are counting in KB
+            max_file_size=(
+                target.max_vcard_file_size * 1024
+                if target.max_vcard_file_size
+                else None
+            ),
+            max_vcards=target.max_vcards_per_file,
+            template=target.output_template,
+            output_format=target.output_format,
+        )
+    check_export_dir(output_dir, shard_depth)
+    return BatchedVcardExporter(
+        output_dir,
+        fsync=fsync,
+        keep_existing=keep_existing,
+        shard_depth=shard_depth,
+        allocator=target.allocator,
+    )
 
 
 def csv2vcard(
-    csv_filename: str,
+    csv_filename: Union[str, os.PathLike, IO],
     csv_delimiter: str = ";",
     mapping_file: str = None,
     encoding: str = None,
@@ -92,67 +914,417 @@ def csv2vcard(
     max_vcard_file_size: int = None,
     max_vcards_per_file: int = None,
     strip_accents: bool = False,
-) -> None:
+    encoding_probe_bytes: int = None,
+    fsync: bool = False,
+    overwrite: bool = False,
+    mapping: CompiledMapping = None,
+    jobs: int = 1,
+    batch_size: int = 1000,
+    metrics: Metrics = None,
+    verbose: bool = False,
+    output_template: str = None,
+    writer: VcardWriter = None,
+    incremental: bool = False,
+    use_mmap: bool = False,
+    targets: List[OutputTarget] = None,
+    carddav_connections: int = None,
+    shard_depth: int = 0,
+    keep_existing: bool = False,
+) -> int:
     """
     Main function
+
+    csv_filename can also be a file-like object, see parse_csv()
+    A compiled mapping can be given so it is shared between multiple CSV files
+    When jobs > 1, vCards are created by worker processes from batches of batch_size contacts
+    With fsync, per contact vCard files are synced to disk by batches
+    Per contact vCard files replace the files of earlier runs, unless keep_existing is set
+    Unless overwrite is set, existing archives and CardDAV contacts are never replaced
+    Given metrics, stage times and counters are recorded
+    Per contact errors are logged as a summary once the file is converted, and as they happen with verbose
+    An output_dir of - writes a single VCF stream to stdout, unless output_template is given
+    output_template names single vCard files, see RollingVcardWriter, and implies single_vcard_file
+    An output_dir ending with an archive suffix like .zip or .tar.gz is written by ArchiveVcardWriter
+    An http(s) output_dir is a CardDAV address book collection, where vCards are uploaded by
+    carddav_connections concurrent connections, see CardDavWriter
+    With shard_depth, per contact vCard files are spread over 256 hashed folders per level, see
+    get_shard_path()
+    A writer can also be given, eg to write multiple CSV files into the same archive, which is not closed
+    targets replace output_dir, vcard_version and the single file settings, so every contact is mapped
+    once and written in every target format, see OutputTarget
+    With incremental, only added or changed contacts are converted into per contact vCard files,
+    and vCard files of deleted contacts are removed, see ContactManifest
+    With use_mmap, local CSV files are read through a memory map, and with jobs > 1 worker processes
+    parse byte ranges of the file themselves, see iter_mapped_cards()
+    Returns the number of converted contacts
     """
-    check_export_dir(output_dir)
+    name = get_source_name(csv_filename)
+    if not targets:
+        targets = [
+            OutputTarget(
+                vcard_version,
+                output_dir,
+                single_vcard_file,
+                max_vcard_file_size,
+                max_vcards_per_file,
+                output_template,
+                writer,
+            )
+        ]
+    if mapping is None:
+        mapping = CompiledMapping(mapping_file, strip_accents, verbose=verbose)
+    formats = tuple(target.output_format for target in targets)
 
-    vcards = ""
-    if max_vcard_file_size:
-        # Make sure we are counting in KB
-        max_vcard_file_size *= 1024
-        file_num = "1"
-    else:
-        max_vcard_file_size = None
-        file_num = ""
-    if max_vcards_per_file:
-        file_num = 1
-    else:
-        file_num = ""
+    writers = []
+    try:
+        for target in targets:
+            writers.append(
+                target.writer
+                or _open_writer(
+                    target,
+                    name,
+                    fsync,
+                    overwrite,
+                    carddav_connections,
+                    shard_depth,
+                    keep_existing,
+                )
+            )
+    except BaseException:
+        for target, target_writer in zip(targets, writers):
+            if not target.writer:
+                target_writer.close()
+        raise
+
+    manifest = None
+    if (
+        incremental
+        and len(targets) == 1
+        and isinstance(writers[0], BatchedVcardExporter)
+    ):
+        manifest = ContactManifest(
+            targets[0].output, name, mapping, get_settings_digest(mapping, formats[0])
+        )
+        manifest.reserve_filenames(writers[0].allocator)
+    elif incremental:
+        logger.warning(
+            "Incremental mode only applies to a single target of per contact vCard files"
+        )
+
+    # Shared writers already hold vCards of other CSV files
+    start_counts = [(writer.count, writer.bytes_written) for writer in writers]
     count = 0
-    for contact in parse_csv(csv_filename, csv_delimiter, encoding, strip_accents):
-        vcard, filename = create_vcard(contact, vcard_version, mapping_file)
-        if vcard:
+    try:
+        if use_mmap and jobs > 1 and not manifest:
+            cards = iter_mapped_cards(
+                csv_filename,
+                csv_delimiter,
+                encoding,
+                strip_accents,
+                formats,
+                mapping,
+                jobs,
+                encoding_probe_bytes,
+                metrics=metrics,
+            )
+        else:
+            contacts = parse_csv(
+                csv_filename,
+                csv_delimiter,
+                encoding,
+                strip_accents,
+                encoding_probe_bytes,
+                columns=mapping.columns,
+                records=True,
+                metrics=metrics,
+                check_header=(
+                    manifest.check_header(mapping.check_header)
+                    if manifest
+                    else mapping.check_header
+                ),
+                strict=manifest is not None,
+                use_mmap=use_mmap,
+            )
+            if metrics:
+                contacts = metrics.timed_iter("parse_csv", contacts, "rows_read")
+            contacts = infer_dates(contacts, mapping)
+            if manifest:
+                contacts = manifest.filter(contacts, writers[0].allocator)
+                if metrics:
+                    contacts = metrics.timed_iter("hash_rows", contacts)
+            cards = iter_cards(contacts, formats, mapping, jobs, batch_size)
+        if metrics:
+            cards = metrics.timed_iter("create_vcard", cards)
+            writes = [metrics.timed("write_vcard", writer.write) for writer in writers]
+        else:
+            writes = [writer.write for writer in writers]
+        # jCard files get their own extension
+        jcards = [output_format == JCARD for output_format in formats]
+        for contact_cards, filename in cards:
+            if not contact_cards:
+                if metrics:
+                    metrics.count("rows_rejected")
+                if manifest:
+                    manifest.add(None)
+                continue
             count += 1
-            if not single_vcard_file:
-                export_vcard(vcard, output_dir, filename)
+            for write, card, jcard in zip(writes, contact_cards, jcards):
+                written_filename = write(
+                    card, f"{filename[:-4]}.json" if jcard else filename
+                )
+            if manifest:
+                manifest.add(written_filename)
+    except OSError as exc:
+        logger.critical(f"Could not write vCard file for {name}: {exc}")
+    finally:
+        if metrics:
+            metrics.enter("write_vcard")
+        try:
+            for target, writer in zip(targets, writers):
+                if not target.writer:
+                    writer.close()
+        finally:
+            if metrics:
+                metrics.exit()
+    if manifest:
+        manifest.remove_stale(writers[0].allocator)
+        try:
+            manifest.save()
+        except OSError as exc:
+            logger.error(f"Cannot write manifest {manifest.path}: {exc}")
+        logger.info(
+            f"Incremental conversion of {name}: {count} vCards written, {manifest.unchanged} unchanged, {manifest.removed} removed"
+        )
+    errors = mapping.errors.pop()
+    errors.log_summary(name)
+    if metrics:
+        for code, value in errors.by_code().items():
+            metrics.count_error(str(code), value)
+        metrics.count("csv_files")
+        if manifest:
+            metrics.count("vcards_unchanged", manifest.unchanged)
+            metrics.count("vcards_removed", manifest.removed)
+        for target, writer, (start_count, start_bytes) in zip(
+            targets, writers, start_counts
+        ):
+            metrics.count("vcards_written", writer.count - start_count)
+            metrics.count("bytes_written", writer.bytes_written - start_bytes)
+            if isinstance(writer, BatchedVcardExporter):
+                metrics.count("vcard_files", writer.count)
+            elif isinstance(writer, ArchiveVcardWriter):
+                if not target.writer:
+                    metrics.count("vcard_files", 1)
+            elif isinstance(writer, CardDavWriter):
+                metrics.count("vcard_files", writer.count - start_count)
             else:
-                vcards += "\n" + vcard
-                if (max_vcard_file_size and len(vcards) > max_vcard_file_size) or (
-                    max_vcards_per_file and count >= max_vcards_per_file
-                ):
-                    logger.info(f"Creating sub file for {csv_filename}")
-                    export_vcard(
-                        vcards,
-                        output_dir,
-                        os.path.basename(csv_filename) + f"{file_num}.vcf",
-                    )
-                    file_num = str(int(file_num) + 1)
-                    vcards = ""
-                    count = 0
-    if single_vcard_file:
-        export_vcard(
-            vcards,
-            output_dir,
-            os.path.basename(csv_filename) + f"{file_num}.vcf",
+                metrics.count("vcard_files", len(writer.files))
+                metrics.count("files_rolled", max(len(writer.files) - 1, 0))
+    return count
+
+
+def _convert_files(
+    sources: List[pathlib.Path],
+    settings: dict,
+    mapping: CompiledMapping,
+    metrics: Metrics = None,
+) -> Tuple[List[Tuple[str, int]], Optional[Metrics]]:
+    """
+    Converts CSV files one after the other, returning the number of vCards created per file
+    Metrics are returned too, since worker processes fill their own copy
+    """
+    results = []
+    for src in sources:
+        name = get_source_name(src)
+        logger.info(f"Running conversion for {name}")
+        file_settings = dict(settings, csv_filename=src)
+        results.append(
+            (name, csv2vcard(**file_settings, mapping=mapping, metrics=metrics))
+        )
+    return results, metrics
+
+
+def _share_allocators(
+    targets: List[OutputTarget], settings: dict, claims: bool
+) -> List[str]:
+    """
+    Gives targets of per contact vCard files a filename allocator shared by every CSV file of a run
+    With claims, names are also claimed in a folder of the output directory, so worker processes
+    converting other CSV files never use them, see FilenameAllocator. Returns the claim folders
+    """
+    shard_depth = settings.get("shard_depth", 0)
+    allocators = {}
+    claims_dirs = []
+    for target in targets:
+        if target.output == STDIO or target.single_vcard_file or target.output_template:
+            continue
+        # Targets writing in the same directory, eg vCards and jCards, share their names too
+        output_dir = os.path.normcase(os.path.abspath(target.output))
+        if output_dir not in allocators:
+            check_export_dir(target.output, shard_depth)
+            claims_dir = None
+            if claims:
+                claims_dir = tempfile.mkdtemp(
+                    prefix=".csv2vcard-names-", dir=target.output
+                )
+                claims_dirs.append(claims_dir)
+            allocators[output_dir] = FilenameAllocator(
+                target.output if settings.get("keep_existing") else None,
+                shard_depth,
+                claims_dir,
+            )
+        target.allocator = allocators[output_dir]
+    return claims_dirs
+
+
+def _run_conversion(
+    sources: List[pathlib.Path],
+    settings: dict,
+    mapping: CompiledMapping,
+    metrics: Metrics = None,
+) -> bool:
+    jobs = get_jobs(settings.get("jobs"))
+    targets = settings["targets"]
+    # Archives, stdout and CardDAV collections receive the vCards of every CSV file through the
+    # same writer, so CardDAV connections are kept from one CSV file to the next
+    shared = [
+        target
+        for target in targets
+        if is_archive_path(target.output)
+        or is_carddav_url(target.output)
+        or (target.output == STDIO and not target.output_template)
+    ]
+    # Parallel CSV file conversions would mix their vCards on stdout or in the archive
+    parallel = not (
+        jobs == 1
+        or len(sources) < 2
+        or shared
+        or any(target.output == STDIO for target in targets)
+    )
+    # Contacts of different CSV files sharing a name must not overwrite each other
+    try:
+        claims_dirs = _share_allocators(
+            [target for target in targets if target not in shared],
+            settings,
+            parallel,
         )
+    except OSError as exc:
+        logger.error(f"Cannot prepare output: {exc}")
+        return False
+    # Shard indexes are appended to by the exporter of every CSV file, and compacted once
+    index_starts = {}
+    if settings.get("shard_depth"):
+        for target in targets:
+            if target.allocator and target.output not in index_starts:
+                index_starts[target.output] = get_shard_index_size(target.output)
+    try:
+        return _run_jobs(sources, settings, mapping, metrics, jobs, shared, parallel)
+    finally:
+        for target in targets:
+            target.allocator = None
+        for claims_dir in claims_dirs:
+            shutil.rmtree(claims_dir, ignore_errors=True)
+        for output_dir, start in index_starts.items():
+            try:
+                compact_shard_index(output_dir, start)
+            except (OSError, UnicodeDecodeError) as exc:
+                logger.error(f"Cannot compact shard index of {output_dir}: {exc}")
+
+
+def _run_jobs(
+    sources: List[pathlib.Path],
+    settings: dict,
+    mapping: CompiledMapping,
+    metrics: Metrics,
+    jobs: int,
+    shared: List[OutputTarget],
+    parallel: bool,
+) -> bool:
+    if not parallel:
+        # A single CSV file can still be converted by multiple processes
+        settings["jobs"] = jobs
+        try:
+            for target in shared:
+                try:
+                    target.writer = _open_writer(
+                        target,
+                        STDIO,
+                        settings.get("fsync", False),
+                        settings.get("overwrite", False),
+                        settings.get("carddav_connections"),
+                    )
+                except (OSError, ValueError) as exc:
+                    logger.error(f"Cannot open output {target.output}: {exc}")
+                    return False
+            results, _ = _convert_files(sources, settings, mapping, metrics)
+        finally:
+            for target in shared:
+                if target.writer:
+                    target.writer.close()
+                    target.writer = None
+        for src, count in results:
+            logger.info(f"Created {count} vCards from {src}")
+        return True
+
+    # CSV files sharing the same name would write the same single vCard files, so they are
+    # converted in order by the same worker, which keeps output naming identical to serial runs
+    groups = {}
+    for src in sources:
+        groups.setdefault(src.name, []).append(src)
+
+    # Every CSV file is converted by a single worker process
+    settings["jobs"] = 1
+    result = True
+    logger.info(f"Converting {len(sources)} CSV files using {jobs} processes")
+    with process_pool(jobs) as executor:
+        futures = [
+            (
+                group,
+                executor.submit(
+                    _convert_files,
+                    group,
+                    settings,
+                    mapping,
+                    Metrics() if metrics else None,
+                ),
+            )
+            for group in groups.values()
+        ]
+        for group, future in futures:
+            try:
+                results, worker_metrics = future.result()
+            except Exception as exc:
+                logger.error(
+                    f"Conversion failed for {', '.join(str(src) for src in group)}: {exc}"
+                )
+                result = False
+                continue
+            for src, count in results:
+                logger.info(f"Created {count} vCards from {src}")
+            if metrics:
+                metrics.merge(worker_metrics)
+    return result
 
 
 def interface_entrypoint(config: dict) -> bool:
     settings = config["settings"]
     source = pathlib.Path(settings["csv_filename"])
     sources = []
-    if not os.path.exists(source):
-        logger.error(f"Source path does not exist")
+    if settings["csv_filename"] == STDIO:
+        sources = [sys.stdin.buffer]
+    elif not os.path.exists(source):
+        logger.error("Source path does not exist")
         return False
     elif os.path.isdir(source):
-        sources = source.glob("**/*.csv")
+        sources = sorted(
+            path
+            for path in source.glob("**/*")
+            if path.name.lower().endswith(CSV_SUFFIXES) and path.is_file()
+        )
     else:
         sources = [source]
 
     if len(settings["csv_delimiter"]) != 1:
-        logger.error(f"CSV Delimiter char should be exactly one character")
+        logger.error("CSV Delimiter char should be exactly one character")
         return False
 
     max_vcard_file_size = settings["max_vcard_file_size"]
@@ -160,11 +1332,99 @@ def interface_entrypoint(config: dict) -> bool:
         try:
             settings["max_vcard_file_size"] = int(max_vcard_file_size)
         except TypeError:
-            logger.error(f"Max vcard file size should be an integer")
+            logger.error("Max vcard file size should be an integer")
             return False
 
-    for src in sources:
-        settings["csv_filename"] = src
-        logger.info(f"Running conversion for {src}")
-        csv2vcard(**settings)
-    return True
+    if not 0 <= settings.get("shard_depth", 0) <= MAX_SHARD_DEPTH:
+        logger.error(f"Shard depth should be between 0 and {MAX_SHARD_DEPTH}")
+        return False
+
+    if settings.get("tel_region"):
+        try:
+            PhoneNormalizer(settings["tel_region"])
+        except ValueError as exc:
+            logger.error(f"{exc}")
+            return False
+
+    # Load and prepare the mapping once for all CSV files
+    try:
+        mapping = CompiledMapping(
+            settings["mapping_file"],
+            settings["strip_accents"],
+            verbose=settings.get("verbose", False),
+            day_first=not settings.get("month_first", False),
+            normalize_tel=settings.get("normalize_tel", False),
+            tel_region=settings.get("tel_region"),
+        )
+    except (OSError, ValueError) as exc:
+        logger.error(f"Cannot load mapping file {settings['mapping_file']}: {exc}")
+        return False
+
+    # -o and its options make the first target, others are given as --target specs
+    targets = list(settings.get("targets") or [])
+    if settings.get("output_dir"):
+        try:
+            targets.insert(
+                0,
+                OutputTarget(
+                    settings.get("vcard_version", 4),
+                    settings["output_dir"],
+                    settings.get("single_vcard_file", False),
+                    settings.get("max_vcard_file_size"),
+                    settings.get("max_vcards_per_file"),
+                    settings.get("output_template"),
+                ),
+            )
+        except ValueError as exc:
+            logger.error(f"Invalid output: {exc}")
+            return False
+    if not targets:
+        logger.error("No output given")
+        return False
+
+    for target in targets:
+        output_template = target.output_template
+        if output_template:
+            try:
+                numbered = output_template.format(
+                    name="", num=1
+                ) != output_template.format(name="", num=2)
+            except (KeyError, IndexError, ValueError) as exc:
+                logger.error(f"Invalid output template {output_template}: {exc}")
+                return False
+            if not numbered and (
+                target.max_vcard_file_size or target.max_vcards_per_file
+            ):
+                logger.error("Output template needs a {num} field to split vCard files")
+                return False
+
+        if (is_archive_path(target.output) or is_carddav_url(target.output)) and (
+            target.single_vcard_file or output_template
+        ):
+            logger.warning(
+                "Single vCard file options are ignored when writing to an archive or a CardDAV server"
+            )
+
+    settings = dict(settings, targets=targets)
+    # Already part of the compiled mapping
+    for key in ["month_first", "normalize_tel", "tel_region"]:
+        settings.pop(key, None)
+    # Instrumentation settings are not conversion settings
+    metrics_file = settings.pop("metrics_file", None)
+    profile_file = settings.pop("profile_file", None)
+    if not metrics_file and not profile_file:
+        return _run_conversion(sources, settings, mapping)
+
+    # Time spent outside of conversion stages, eg waiting for worker processes, is charged to "other"
+    metrics = Metrics()
+    with profiled(profile_file), metrics.stage("other"):
+        start = perf_counter()
+        result = _run_conversion(sources, settings, mapping, metrics)
+        metrics.seconds = perf_counter() - start
+    metrics.log_summary()
+    if metrics_file:
+        try:
+            metrics.write(metrics_file)
+        except OSError as exc:
+            logger.error(f"Cannot write metrics file {metrics_file}: {exc}")
+    return result
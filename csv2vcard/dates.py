@@ -0,0 +1,187 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+#
+# This file is part of csv2vcard
+
+
+"""
+Normalization of BDAY and ANNIVERSARY values into vCard dates
+
+The date format of a CSV column is inferred once, from a sample of its values when available,
+else from its first value, so every row is parsed by a single precompiled pattern
+Values that do not match the column format are inferred on their own, and results are cached
+since birthdays of large exports repeat a lot
+"""
+
+from typing import Iterable, List, Optional, Tuple
+import re
+from datetime import date, timedelta
+from functools import lru_cache
+from logging import getLogger
+
+
+logger = getLogger()
+
+# vCard keys holding dates
+DATE_KEYS = ("BDAY", "ANNIVERSARY")
+# Rows read to infer date formats of a CSV file
+DATE_SAMPLE_ROWS = 1000
+# About every day of a century, dates repeating a lot in large exports
+DATE_CACHE_SIZE = 32768
+# Spreadsheet serials count days since 1899-12-30, five digit ones being years 1927 to 2173
+EXCEL_EPOCH = date(1899, 12, 30)
+
+# Date patterns by format name, groups being (year, month, day) in format order
+DATE_PATTERNS = {
+    "iso": re.compile(r"^(\d{4})-(\d{1,2})-(\d{1,2})(?:[T ][\d:.]*Z?)?$"),
+    "basic": re.compile(r"^(\d{4})(\d{2})(\d{2})$"),
+    "ymd": re.compile(r"^(\d{4})[/.](\d{1,2})[/.](\d{1,2})$"),
+    "no_year": re.compile(r"^--(\d{2})-?(\d{2})$"),
+    "dmy": re.compile(r"^(\d{1,2})[/.-](\d{1,2})[/.-](\d{4}|\d{2})$"),
+    "mdy": re.compile(r"^(\d{1,2})[/.-](\d{1,2})[/.-](\d{4}|\d{2})$"),
+    "excel": re.compile(r"^(\d{5})(?:\.0+)?$"),
+}
+# Components of a date, year being None when unknown
+DateParts = Tuple[Optional[int], int, int]
+
+
+def _expand_year(year: str) -> int:
+    # Two digit years are in the past, since these are birthdays and anniversaries
+    if len(year) == 2:
+        current_year = date.today().year
+        year = int(year) + current_year // 100 * 100
+        return year if year <= current_year else year - 100
+    return int(year)
+
+
+def parse_date(value: str, date_format: str) -> Optional[DateParts]:
+    """
+    Returns (year, month, day) of a value in the given format, or None if it does not match
+    """
+    match = DATE_PATTERNS[date_format].match(value)
+    if not match:
+        return None
+    groups = match.groups()
+    if date_format == "excel":
+        parts = EXCEL_EPOCH + timedelta(days=int(groups[0]))
+        return parts.year, parts.month, parts.day
+    if date_format == "no_year":
+        year, month, day = None, int(groups[0]), int(groups[1])
+    elif date_format == "dmy":
+        year, month, day = _expand_year(groups[2]), int(groups[1]), int(groups[0])
+    elif date_format == "mdy":
+        year, month, day = _expand_year(groups[2]), int(groups[0]), int(groups[1])
+    else:
+        year, month, day = int(groups[0]), int(groups[1]), int(groups[2])
+    try:
+        # Leap year of dates without year
+        date(2000 if year is None else year, month, day)
+    except ValueError:
+        return None
+    return year, month, day
+
+
+def get_date_formats(day_first: bool = True) -> List[str]:
+    """
+    Returns date format names in inference order, ambiguous dates like 03/04/1965 being read
+    day first unless day_first is False
+    """
+    formats = list(DATE_PATTERNS)
+    if not day_first:
+        formats.remove("mdy")
+        formats.insert(formats.index("dmy"), "mdy")
+    return formats
+
+
+def infer_date_format(values: Iterable[str], day_first: bool = True) -> Optional[str]:
+    """
+    Returns the format matching most values of a sample, or None if none matches
+    """
+    values = [value.strip() for value in values if value and value.strip()]
+    best_format = None
+    best_count = 0
+    for date_format in get_date_formats(day_first):
+        count = sum(1 for value in values if parse_date(value, date_format))
+        if count > best_count:
+            best_format, best_count = date_format, count
+    return best_format
+
+
+def format_date(parts: DateParts, version: int) -> str:
+    """
+    Returns a vCard 4.0 date like 19650312 or --0312, or a vCard 3.0 one like 1965-03-12
+    """
+    year, month, day = parts
+    if version == 3:
+        if year is None:
+            return f"--{month:02d}-{day:02d}"
+        return f"{year:04d}-{month:02d}-{day:02d}"
+    if year is None:
+        return f"--{month:02d}{day:02d}"
+    return f"{year:04d}{month:02d}{day:02d}"
+
+
+class DateNormalizer:
+    """
+    Parses the dates of a CSV column, see infer_date_format()
+
+    Without date_format, the format of the first parsable value becomes the column format
+    """
+
+    def __init__(
+        self,
+        date_format: str = None,
+        day_first: bool = True,
+        cache_size: int = DATE_CACHE_SIZE,
+    ):
+        self.day_first = day_first
+        self.cache_size = cache_size
+        self.reset(date_format)
+
+    def reset(self, date_format: str = None) -> None:
+        self.date_format = date_format
+        self.parse = lru_cache(maxsize=self.cache_size)(self._parse)
+
+    def _parse(self, value: str) -> Optional[DateParts]:
+        value = value.strip()
+        if self.date_format:
+            parts = parse_date(value, self.date_format)
+            if parts:
+                return parts
+        for date_format in get_date_formats(self.day_first):
+            parts = parse_date(value, date_format)
+            if parts:
+                if not self.date_format:
+                    self.date_format = date_format
+                return parts
+        return None
+
+
+class DateColumns:
+    """
+    Date normalizers of the CSV columns mapped to date keys, shared by every bound mapping
+    """
+
+    def __init__(self, day_first: bool = True, formats: dict = None):
+        self.day_first = day_first
+        self.formats = dict(formats or {})
+        self.normalizers = {}
+
+    def get(self, column: str) -> DateNormalizer:
+        try:
+            return self.normalizers[column]
+        except KeyError:
+            pass
+        normalizer = DateNormalizer(self.formats.get(column), self.day_first)
+        self.normalizers[column] = normalizer
+        return normalizer
+
+    def infer(self, column: str, values: Iterable[str]) -> None:
+        """
+        Sets the date format of a column from a sample of its values, eg the first rows of a CSV file
+        """
+        date_format = infer_date_format(values, self.day_first)
+        self.formats[column] = date_format
+        self.get(column).reset(date_format)
+        if date_format:
+            logger.debug(f"Dates of column {column} are read as {date_format}")
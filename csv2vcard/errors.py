@@ -0,0 +1,100 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+#
+# This file is part of csv2vcard
+
+
+from typing import Any
+from logging import getLogger
+
+
+logger = getLogger()
+
+# Messages of per contact conversion errors, value being the faulty data or contact
+ERROR_MESSAGES = {
+    1001: "Mapping {key} has no match in CSV file {column}",
+    1002: "Mapping {key} has no match in CSV file {column}",
+    1003: "Mapping {key} has no match in CSV file {column}",
+    1004: "Mapping {key} has no match in CSV file {column}",
+    1005: "Contact key {key} has bogus data (no URI nor B64 encoded data) in CSV file map {column}",
+    1006: "Key {key} has invalid gender {value} in CSV file map {column}",
+    1007: "Key {key} has invalid geo data {value} in CSV file map {column}",
+    1008: "Cannot create vcard for contact {value}",
+    1010: "Mapping {key} has no match in CSV file {column}",
+    1011: "Mapping {key} has no match in CSV file {column}",
+    1012: "No Valid FN entry for {value}",
+    1014: "No valid email addres in {value}",
+    1016: "Key {key} has invalid date {value} in CSV file map {column}",
+    1017: "Key {key} has invalid phone number {value} in CSV file map {column}",
+}
+
+# Amount of distinct example messages kept per error code and column
+MAX_ERROR_SAMPLES = 3
+
+
+class ErrorAggregator:
+    """
+    Counts per contact conversion errors by error code, vCard key and CSV column
+
+    Only a few example messages are built, and everything is logged as one summary line
+    per error kind, so a mapping that does not match a huge CSV file does not flood the logs
+    With verbose, every error is also logged as soon as it happens
+    """
+
+    def __init__(self, verbose: bool = False, max_samples: int = MAX_ERROR_SAMPLES):
+        self.verbose = verbose
+        self.max_samples = max_samples
+        self.counts = {}
+        self.samples = {}
+
+    def add(self, code: int, key: str, column: str = None, value: Any = None) -> None:
+        error = (code, key, column)
+        count = self.counts.get(error, 0)
+        self.counts[error] = count + 1
+        if not self.verbose and count >= self.max_samples:
+            return
+        message = ERROR_MESSAGES[code].format(key=key, column=column, value=value)
+        if self.verbose:
+            logger.error(f"{code}: {message}")
+        if count < self.max_samples:
+            samples = self.samples.setdefault(error, [])
+            if message not in samples:
+                samples.append(message)
+
+    def merge(self, other: "ErrorAggregator") -> None:
+        for error, count in other.counts.items():
+            self.counts[error] = self.counts.get(error, 0) + count
+        for error, messages in other.samples.items():
+            samples = self.samples.setdefault(error, [])
+            for message in messages:
+                if len(samples) < self.max_samples and message not in samples:
+                    samples.append(message)
+
+    def pop(self) -> "ErrorAggregator":
+        """
+        Returns the errors counted so far and starts counting again, eg to send them to another process
+        """
+        errors = ErrorAggregator(self.verbose, self.max_samples)
+        errors.counts, errors.samples = self.counts, self.samples
+        self.counts = {}
+        self.samples = {}
+        return errors
+
+    def by_code(self) -> dict:
+        counts = {}
+        for (code, _, _), count in self.counts.items():
+            counts[code] = counts.get(code, 0) + count
+        return counts
+
+    def log_summary(self, source: str = None) -> None:
+        for (code, key, column), count in sorted(
+            self.counts.items(), key=lambda item: (item[0][0], str(item[0][1:]))
+        ):
+            samples = self.samples[(code, key, column)]
+            summary = f"{code}: {samples[0]} ({count} times"
+            if source:
+                summary += f" in {source}"
+            summary += ")"
+            if len(samples) > 1:
+                summary += f", other examples: {' | '.join(samples[1:])}"
+            logger.error(summary)
@@ -4,18 +4,30 @@
 # This file is part of csv2vcard
 
 
+from typing import List, Tuple, Optional, BinaryIO
 import os
+import io
+import re
+import time
+import hashlib
+import tarfile
+import zipfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
+from csv2vcard.create_vcard import JCARD
 
 
 logger = getLogger()
 
 
-def export_vcard(vcard: str, output_dir: str, filename: str):
+def export_vcard(vcard: str, output_dir: str, filename: str, shard_depth: int = 0):
     """
     Exporting a vCard in one or multiple files
+    With shard_depth, the file is written in its shard folder, see check_export_dir()
     """
-    filepath = os.path.join(output_dir, filename)
+    filepath = os.path.join(output_dir, get_shard_path(filename, shard_depth))
     try:
         with open(filepath, "w", encoding="utf-8") as fp:
             fp.write(vcard)
@@ -25,10 +37,703 @@ def export_vcard(vcard: str, output_dir: str, filename: str):
         logger.critical(f"Could not write file {filepath}: {exc}")
 
 
-def check_export_dir(output_dir: str) -> None:
+# Characters rejected by Windows, macOS or Linux filesystems
+FORBIDDEN_FILENAME_CHARS = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+# Windows reserved device names, which cannot be used as filenames whatever their extension is
+RESERVED_FILENAMES = (
+    ["CON", "PRN", "AUX", "NUL"]
+    + [f"COM{num}" for num in range(1, 10)]
+    + [f"LPT{num}" for num in range(1, 10)]
+)
+MAX_FILENAME_LENGTH = 200
+# Per contact files are spread over 256 folders per shard level, see get_shard_path()
+SHARD_NAMES = frozenset(f"{num:02x}" for num in range(256))
+MAX_SHARD_DEPTH = 2
+# Tab separated list of the sharded path and UID of every written vCard file
+SHARD_INDEX = ".csv2vcard-index.tsv"
+
+
+def sanitize_filename(filename: str) -> str:
+    """
+    Makes a vCard filename acceptable by any filesystem
+    """
+    stem, extension = os.path.splitext(filename)
+    stem = FORBIDDEN_FILENAME_CHARS.sub("_", stem)
+    # Windows does not allow trailing dots or spaces
+    stem = stem.strip().rstrip(".")[:MAX_FILENAME_LENGTH]
+    if not stem:
+        stem = "contact"
+    elif stem.upper() in RESERVED_FILENAMES:
+        stem = f"_{stem}"
+    return stem + extension
+
+
+def get_vcard_uid(vcard: str) -> Optional[str]:
+    """
+    Returns the UID of a vCard without its urn:uuid: prefix, if any
+    """
+    start = vcard.find("\nUID:")
+    if start == -1:
+        return None
+    start += len("\nUID:")
+    uid = vcard[start : vcard.find("\n", start)].strip()
+    if uid.lower().startswith("urn:uuid:"):
+        uid = uid[len("urn:uuid:") :]
+    return uid or None
+
+
+class FilenameAllocator:
+    """
+    Hands out unique and filesystem safe vCard filenames
+
+    Names already present in the output directory are indexed once, so no stat() is needed per file
+    Names are compared case insensitively, since Windows and macOS filesystems are
+    When a name is already used, the vCard UID is added to it if known, else a -2, -3... suffix
+    With shard_depth, names of the shard folders of the output directory are indexed too
+    With claims_dir, every name is also claimed by creating an empty file of that name in claims_dir,
+    so allocators of other processes writing in the same output directory never hand it out
+    """
+
+    def __init__(
+        self, output_dir: str = None, shard_depth: int = 0, claims_dir: str = None
+    ):
+        self._used = set()
+        self._suffixes = {}
+        self._lock = threading.Lock()
+        self.claims_dir = claims_dir
+        if output_dir:
+            self._index(output_dir, shard_depth)
+
+    def _index(self, path: str, shard_depth: int) -> None:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if (
+                    shard_depth
+                    and entry.name in SHARD_NAMES
+                    and entry.is_dir(follow_symlinks=False)
+                ):
+                    self._index(entry.path, shard_depth - 1)
+                else:
+                    self._used.add(entry.name.casefold())
+
+    def _reserve(self, filename: str) -> bool:
+        key = filename.casefold()
+        if key in self._used:
+            return False
+        self._used.add(key)
+        if self.claims_dir:
+            try:
+                os.close(
+                    os.open(
+                        os.path.join(self.claims_dir, key),
+                        os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                    )
+                )
+            except FileExistsError:
+                return False
+        return True
+
+    def reserve(self, filename: str) -> None:
+        """
+        Marks a filename as used, eg the one of a file that is kept from an earlier run
+        """
+        with self._lock:
+            self._reserve(filename)
+
+    def release(self, filename: str) -> None:
+        """
+        Makes the filename of a removed file available again
+        """
+        key = filename.casefold()
+        with self._lock:
+            self._used.discard(key)
+            if self.claims_dir:
+                try:
+                    os.remove(os.path.join(self.claims_dir, key))
+                except FileNotFoundError:
+                    pass
+
+    def allocate(self, filename: str, uid: str = None) -> str:
+        filename = sanitize_filename(filename)
+        with self._lock:
+            if self._reserve(filename):
+                return filename
+            stem, extension = os.path.splitext(filename)
+            if uid:
+                uid_filename = sanitize_filename(f"{stem}-{uid}{extension}")
+                if self._reserve(uid_filename):
+                    return uid_filename
+            key = stem.casefold()
+            suffix = self._suffixes.get(key, 1)
+            while True:
+                suffix += 1
+                suffixed_filename = f"{stem}-{suffix}{extension}"
+                if self._reserve(suffixed_filename):
+                    self._suffixes[key] = suffix
+                    return suffixed_filename
+
+    # Allocators are sent to worker processes, which get their own lock
+    def __getstate__(self) -> dict:
+        return dict(self.__dict__, _lock=None)
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state, _lock=threading.Lock())
+
+
+def get_shard_path(filename: str, shard_depth: int) -> str:
+    """
+    Returns the path of a vCard file relative to the output directory, eg ab/cd/Name.vcf
+    Shards only depend on the filename, compared case insensitively like FilenameAllocator does
+    """
+    if not shard_depth:
+        return filename
+    digest = hashlib.blake2b(
+        filename.casefold().encode("utf-8"), digest_size=shard_depth
+    ).hexdigest()
+    return os.path.join(
+        *(digest[level * 2 : level * 2 + 2] for level in range(shard_depth)), filename
+    )
+
+
+def check_export_dir(output_dir: str, shard_depth: int = 0) -> None:
     """
     Checks if export folder exists in directory
+    With shard_depth, every shard folder is created once, so files are written without any check
     """
+    if not 0 <= shard_depth <= MAX_SHARD_DEPTH:
+        raise ValueError(f"Shard depth should be between 0 and {MAX_SHARD_DEPTH}")
     if not os.path.exists(output_dir):
         logger.info(f"Creating {output_dir} folder...")
-        os.makedirs(output_dir)
+        # Parallel workers may create the same folder at once
+        os.makedirs(output_dir, exist_ok=True)
+    # Folders are created level by level in order, so once the last one exists, all of them do
+    if not shard_depth or os.path.isdir(
+        os.path.join(output_dir, *[max(SHARD_NAMES)] * shard_depth)
+    ):
+        return
+    parents = [output_dir]
+    for _ in range(shard_depth):
+        folders = []
+        for parent in parents:
+            for name in sorted(SHARD_NAMES):
+                folder = os.path.join(parent, name)
+                try:
+                    os.mkdir(folder)
+                except FileExistsError:
+                    pass
+                folders.append(folder)
+        parents = folders
+    logger.info(f"Using {len(parents)} shard folders in {output_dir}")
+
+
+def get_shard_index_size(output_dir: str) -> int:
+    """
+    Returns the size of the SHARD_INDEX file, so lines written later can be told from older ones
+    """
+    try:
+        return os.path.getsize(os.path.join(output_dir, SHARD_INDEX))
+    except FileNotFoundError:
+        return 0
+
+
+def _parse_shard_index(data: bytes) -> dict:
+    return dict(
+        line.partition("\t")[::2] for line in data.decode("utf-8").splitlines() if line
+    )
+
+
+def compact_shard_index(output_dir: str, start: int = 0) -> None:
+    """
+    Rewrites the SHARD_INDEX file with a single line per existing vCard file, later lines winning
+    Lines after the start offset were written by the current run, so only older lines of files
+    that were not written again are checked, eg files removed by incremental conversions
+    """
+    index_path = os.path.join(output_dir, SHARD_INDEX)
+    try:
+        with open(index_path, "rb") as fp:
+            data = fp.read()
+    except FileNotFoundError:
+        return
+    previous = _parse_shard_index(data[:start])
+    written = _parse_shard_index(data[start:])
+    entries = {
+        path: uid
+        for path, uid in previous.items()
+        if path not in written and os.path.isfile(os.path.join(output_dir, path))
+    }
+    entries.update(written)
+    # Write a temporary file first, so an interrupted run leaves the previous index intact
+    temp_path = f"{index_path}.tmp"
+    with open(temp_path, "w", encoding="utf-8", newline="\n") as fp:
+        fp.writelines(f"{path}\t{uid}\n" for path, uid in entries.items())
+    os.replace(temp_path, index_path)
+
+
+class CardFraming:
+    """
+    How cards are laid out in a single file or stream of an output format
+    """
+
+    def __init__(
+        self,
+        prefix: str = "",
+        separator: str = "\n",
+        suffix: str = "",
+        extension: str = ".vcf",
+    ):
+        self.prefix = prefix
+        self.separator = separator
+        self.suffix = suffix
+        self.extension = extension
+
+    def encode(self, text: str) -> bytes:
+        if os.linesep != "\n":
+            text = text.replace("\n", os.linesep)
+        return text.encode("utf-8")
+
+
+# vCards are separated by an empty line, since they end with a line break
+VCARD_FRAMING = CardFraming()
+# jCards are written as a JSON array, see RFC 7095
+JCARD_FRAMING = CardFraming("[\n", ",\n", "\n]\n", ".json")
+
+
+def get_framing(output_format: str = None) -> CardFraming:
+    return JCARD_FRAMING if output_format == JCARD else VCARD_FRAMING
+
+
+class RollingVcardWriter:
+    """
+    Writes vCards one after another into a single VCF file, rolling to the next numbered file
+    whenever max_file_size (in bytes) or max_vcards would be exceeded
+
+    Files are named {basename}.vcf, or {basename}1.vcf, {basename}2.vcf... when a limit is set
+    A template like "{name}-{num:03d}.vcf" can be given instead, name being the basename and
+    num the file number, missing subdirectories being created
+    With the jcard output_format, jCards are written as JSON arrays in .json files
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        basename: str,
+        max_file_size: int = None,
+        max_vcards: int = None,
+        template: str = None,
+        output_format: str = None,
+    ):
+        self.output_dir = output_dir
+        self.basename = basename
+        self.template = template
+        self.framing = get_framing(output_format)
+        self._prefix = self.framing.encode(self.framing.prefix)
+        self._separator = self.framing.encode(self.framing.separator)
+        self._suffix = self.framing.encode(self.framing.suffix)
+        self.max_file_size = max_file_size
+        self.max_vcards = max_vcards
+        self.file_num = 0
+        self.files = []
+        self.count = 0
+        self.bytes_written = 0
+        self._fp = None
+        self._filename = None
+        self._size = 0
+        self._count = 0
+
+    def _open_next(self) -> None:
+        self.close()
+        if self.template or self.max_file_size or self.max_vcards:
+            self.file_num += 1
+            if self.file_num > 1:
+                logger.info(f"Creating sub file for {self.basename}")
+        if self.template:
+            self._filename = self.template.format(name=self.basename, num=self.file_num)
+        elif self.file_num:
+            self._filename = f"{self.basename}{self.file_num}{self.framing.extension}"
+        else:
+            self._filename = f"{self.basename}{self.framing.extension}"
+        filepath = os.path.join(self.output_dir, self._filename)
+        if self.template and os.path.dirname(filepath):
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        self._fp = open(filepath, "wb")
+        self.files.append(self._filename)
+        if self._prefix:
+            self._fp.write(self._prefix)
+            self._size = len(self._prefix)
+            self.bytes_written += len(self._prefix)
+
+    def write(self, vcard: str, filename: str = None) -> None:
+        """
+        Writes a vCard straight to disk, counting the bytes that are actually written
+
+        filename is ignored, it only exists to be interchangeable with BatchedVcardExporter
+        """
+        data = self.framing.encode(vcard)
+        separator = self._separator if self._fp is not None else b""
+        size = len(separator) + len(data) + len(self._suffix)
+
+        if self._fp is None or (
+            (self.max_vcards and self._count >= self.max_vcards)
+            or (self.max_file_size and self._size + size > self.max_file_size)
+        ):
+            # No separator is needed since we start a new file
+            separator = b""
+            self._open_next()
+            size = len(self._prefix) + len(data) + len(self._suffix)
+            if self.max_file_size and size > self.max_file_size:
+                logger.warning(
+                    f"vCard is bigger than max file size {self.max_file_size} and will be written alone in {self._filename}"
+                )
+
+        self._fp.write(separator + data if separator else data)
+        self._size += len(separator) + len(data)
+        self._count += 1
+        self.count += 1
+        self.bytes_written += len(separator) + len(data)
+
+    def close(self) -> None:
+        if self._fp is None:
+            return
+        if self._suffix:
+            self._fp.write(self._suffix)
+            self.bytes_written += len(self._suffix)
+        self._fp.close()
+        self._fp = None
+        logger.info(f"Created vCard file {self._filename} with {self._count} vCards")
+        self._size = 0
+        self._count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class StreamVcardWriter:
+    """
+    Writes vCards one after another to a binary stream, eg stdout, like a single VCF file without limits
+    With the jcard output_format, jCards are written as a JSON array
+
+    The stream is flushed once done, but never closed
+    """
+
+    def __init__(self, stream: BinaryIO, name: str = "-", output_format: str = None):
+        self.stream = stream
+        self.files = [name]
+        self.framing = get_framing(output_format)
+        self.count = 0
+        self.bytes_written = 0
+        self.closed = False
+
+    def write(self, vcard: str, filename: str = None) -> None:
+        """
+        filename is ignored, it only exists to be interchangeable with BatchedVcardExporter
+        """
+        framing = self.framing
+        vcard = (framing.separator if self.count else framing.prefix) + vcard
+        data = framing.encode(vcard)
+        self.stream.write(data)
+        self.count += 1
+        self.bytes_written += len(data)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        # An empty jCard array is still valid JSON
+        suffix = (
+            self.framing.suffix
+            if self.count
+            else self.framing.prefix + self.framing.suffix
+        )
+        if suffix:
+            data = self.framing.encode(suffix)
+            self.stream.write(data)
+            self.bytes_written += len(data)
+        self.stream.flush()
+        logger.info(f"Written {self.count} vCards to {self.files[0]}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Output paths written as a single archive of per contact vCard files, and their tarfile compression
+ARCHIVE_SUFFIXES = {
+    ".zip": None,
+    ".tar": "",
+    ".tar.gz": "gz",
+    ".tgz": "gz",
+    ".tar.bz2": "bz2",
+    ".tar.xz": "xz",
+}
+
+
+def is_archive_path(path: str) -> bool:
+    return bool(path) and str(path).lower().endswith(tuple(ARCHIVE_SUFFIXES))
+
+
+class ArchiveVcardWriter:
+    """
+    Writes one archive member per vCard into a zip or tar file, so thousands of contacts don't
+    need thousands of files, nor a temporary directory to archive afterwards
+
+    The archive format is given by the path suffix, see ARCHIVE_SUFFIXES
+    Member names are made unique like BatchedVcardExporter filenames
+    Unless overwrite is set, an existing archive is never replaced
+    """
+
+    def __init__(self, path: str, overwrite: bool = False):
+        self.path = path
+        self.files = [path]
+        self.count = 0
+        self.bytes_written = 0
+        self.allocator = FilenameAllocator(None)
+        mode = "w" if overwrite else "x"
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        compression = next(
+            compression
+            for suffix, compression in ARCHIVE_SUFFIXES.items()
+            if path.lower().endswith(suffix)
+        )
+        self._zip = None
+        self._tar = None
+        if compression is None:
+            self._zip = zipfile.ZipFile(path, mode, compression=zipfile.ZIP_DEFLATED)
+        elif compression:
+            self._tar = tarfile.open(path, f"{mode}:{compression}")
+        else:
+            self._tar = tarfile.open(path, mode)
+        self._mtime = time.time()
+
+    def write(self, vcard: str, filename: str) -> None:
+        filename = self.allocator.allocate(filename, get_vcard_uid(vcard))
+        if os.linesep != "\n":
+            vcard = vcard.replace("\n", os.linesep)
+        data = vcard.encode("utf-8")
+        if self._zip is not None:
+            self._zip.writestr(filename, data)
+        else:
+            info = tarfile.TarInfo(filename)
+            info.size = len(data)
+            info.mtime = self._mtime
+            info.mode = 0o644
+            self._tar.addfile(info, io.BytesIO(data))
+        self.count += 1
+        self.bytes_written += len(data)
+
+    def close(self) -> None:
+        archive = self._zip if self._zip is not None else self._tar
+        if archive is None:
+            return
+        archive.close()
+        self._zip = None
+        self._tar = None
+        logger.info(f"Created archive {self.path} with {self.count} vCards")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class BatchedVcardExporter:
+    """
+    Writes one file per vCard, by batches handled by a small thread pool
+
+    The output directory is opened once so files are created relative to it when the OS allows it
+    With fsync, every batch is synced to disk once, instead of syncing every single file
+    A summary line is logged every log_every files instead of one line per file
+    Contacts sharing the same name get unique filenames. Files of earlier runs are replaced, like
+    export_vcard() does, unless keep_existing is set, new files then getting unique filenames too
+    With shard_depth, files are spread over hashed folders made by check_export_dir(), see
+    get_shard_path(), and every written file is appended to the SHARD_INDEX file, which is compacted
+    once closed, see compact_shard_index()
+    An allocator can be given, so files of multiple exporters writing in the same directory, eg one
+    per CSV file, never get the same name. Its owner then compacts the SHARD_INDEX file once every
+    exporter is closed instead
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        threads: int = 4,
+        batch_size: int = 100,
+        fsync: bool = False,
+        log_every: int = 1000,
+        keep_existing: bool = False,
+        shard_depth: int = 0,
+        allocator: FilenameAllocator = None,
+    ):
+        self.output_dir = output_dir
+        self.keep_existing = keep_existing
+        self.shard_depth = shard_depth
+        self._compact_index = allocator is None
+        self.allocator = allocator or FilenameAllocator(
+            output_dir if keep_existing else None, shard_depth
+        )
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.log_every = log_every
+        self.count = 0
+        self.bytes_written = 0
+        self._batch = []
+        self._pending = deque()
+        self._max_pending = threads * 2
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._dir_fd = None
+        if os.open in os.supports_dir_fd:
+            self._dir_fd = os.open(output_dir, os.O_RDONLY)
+        self._index = None
+        if shard_depth:
+            self._index_start = get_shard_index_size(output_dir)
+            # Lines of a batch are appended by a single write, so exporters of other processes
+            # never interleave them
+            self._index = os.open(
+                os.path.join(output_dir, SHARD_INDEX),
+                os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+                0o666,
+            )
+
+    def _opener(self, path: str, flags: int) -> int:
+        return os.open(path, flags, 0o666, dir_fd=self._dir_fd)
+
+    def _get_filepath(self, path: str) -> str:
+        if self._dir_fd is None:
+            return os.path.join(self.output_dir, path)
+        return path
+
+    def _create(self, filename: str) -> str:
+        """
+        Creates an empty file exclusively, so files created by other processes since the index was
+        built are kept too, returning its path
+        """
+        while True:
+            path = get_shard_path(filename, self.shard_depth)
+            try:
+                os.close(
+                    self._opener(
+                        self._get_filepath(path), os.O_WRONLY | os.O_CREAT | os.O_EXCL
+                    )
+                )
+                return path
+            except FileExistsError:
+                filename = self.allocator.allocate(filename)
+
+    def _write_batch(
+        self, batch: List[Tuple[str, str]]
+    ) -> Tuple[int, int, List[Tuple[str, str]]]:
+        """
+        Writes a batch of (vCard, path) tuples, returning the number of files and bytes written, and
+        with shard_depth, the paths and UIDs of written files
+        """
+        synced_files = []
+        written = 0
+        size = 0
+        paths = []
+        try:
+            for vcard, path in batch:
+                if os.linesep != "\n":
+                    vcard = vcard.replace("\n", os.linesep)
+                data = vcard.encode("utf-8")
+                try:
+                    fp = open(self._get_filepath(path), "wb", opener=self._opener)
+                    try:
+                        fp.write(data)
+                    finally:
+                        if self.fsync:
+                            synced_files.append(fp)
+                        else:
+                            fp.close()
+                except OSError as exc:
+                    logger.critical(
+                        f"Could not write file {os.path.join(self.output_dir, path)}: {exc}"
+                    )
+                    continue
+                logger.debug(f"Created vCard for {path}")
+                written += 1
+                size += len(data)
+                if self.shard_depth:
+                    paths.append((path, get_vcard_uid(vcard) or ""))
+
+            for fp in synced_files:
+                fp.flush()
+                os.fsync(fp.fileno())
+            # Also make sure new directory entries are on disk
+            if synced_files and self._dir_fd is not None:
+                os.fsync(self._dir_fd)
+        finally:
+            for fp in synced_files:
+                fp.close()
+        return written, size, paths
+
+    def _collect(self, max_pending: int) -> None:
+        while len(self._pending) > max_pending:
+            written, size, paths = self._pending.popleft().result()
+            if paths:
+                os.write(
+                    self._index,
+                    "".join(f"{path}\t{uid}\n" for path, uid in paths).encode("utf-8"),
+                )
+            previous_count = self.count
+            self.count += written
+            self.bytes_written += size
+            if self.count // self.log_every > previous_count // self.log_every:
+                logger.info(f"Created {self.count} vCards in {self.output_dir}")
+
+    def _flush(self) -> None:
+        if self._batch:
+            self._pending.append(self._executor.submit(self._write_batch, self._batch))
+            self._batch = []
+        self._collect(self._max_pending)
+
+    def write(self, vcard: str, filename: str) -> str:
+        """
+        Queues a vCard, returning the unique path it gets, relative to the output directory
+        """
+        filename = self.allocator.allocate(filename, get_vcard_uid(vcard))
+        if self.keep_existing:
+            path = self._create(filename)
+        else:
+            path = get_shard_path(filename, self.shard_depth)
+        self._batch.append((vcard, path))
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+        return path
+
+    def close(self) -> None:
+        if self._executor is None:
+            return
+        try:
+            self._flush()
+            self._collect(0)
+        finally:
+            self._executor.shutdown()
+            self._executor = None
+            if self._dir_fd is not None:
+                os.close(self._dir_fd)
+                self._dir_fd = None
+            if self._index is not None:
+                os.close(self._index)
+                self._index = None
+                if self._compact_index:
+                    try:
+                        compact_shard_index(self.output_dir, self._index_start)
+                    except (OSError, UnicodeDecodeError) as exc:
+                        logger.error(
+                            f"Cannot compact shard index of {self.output_dir}: {exc}"
+                        )
+        # Don't log the same summary twice
+        if not self.count or self.count % self.log_every:
+            logger.info(f"Created {self.count} vCards in {self.output_dir}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,233 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+#
+# This file is part of csv2vcard
+
+
+"""
+State of incremental conversions into per contact vCard files
+
+A manifest is stored per CSV source in the output directory. It maps a stable contact key to a hash
+of the contact row and the path of its vCard file, so later runs only convert added or changed rows
+and remove the vCard files of deleted rows
+"""
+
+from typing import Iterator, Iterable, Callable, List, Tuple
+import os
+import json
+import hashlib
+from collections import deque
+from logging import getLogger
+from csv2vcard.create_vcard import CompiledMapping, ContactRecord
+from csv2vcard.export_vcard import FilenameAllocator, sanitize_filename
+
+
+logger = getLogger()
+
+MANIFEST_VERSION = 1
+# vCard keys whose columns identify a contact, in order of preference
+CONTACT_KEYS = ["UID", "N"]
+# Separates values when hashing rows, since it cannot appear in CSV values once cleaned
+VALUE_SEPARATOR = "\x1f"
+
+
+def get_manifest_path(output_dir: str, source_name: str) -> str:
+    """
+    Returns the manifest path of a CSV source, CSV files sharing the same name in different folders
+    getting different manifests
+    """
+    digest = hashlib.blake2b(source_name.encode("utf-8"), digest_size=4).hexdigest()
+    basename = sanitize_filename(os.path.basename(source_name).strip("<>"))
+    return os.path.join(output_dir, f".csv2vcard-{basename}-{digest}.json")
+
+
+def get_settings_digest(mapping: CompiledMapping, output_format: str) -> str:
+    """
+    Hashes the settings that change vCards of unchanged rows, so they are converted again
+    """
+    settings = json.dumps(
+        [
+            mapping.mapping,
+            mapping.strip_accents,
+            output_format,
+            mapping.dates.day_first,
+            mapping.normalize_tel,
+            mapping.tel_region,
+        ],
+        sort_keys=True,
+    )
+    return hashlib.blake2b(settings.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _hash_values(values: Iterable[str]) -> str:
+    data = VALUE_SEPARATOR.join(values).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class ContactManifest:
+    """
+    Tracks which contacts of a CSV source need to be converted, see filter()
+
+    Contacts are identified by the values of the columns mapped to UID, else to N, contacts
+    sharing the same key being numbered in row order. Rows without any key value are identified
+    by their content, so changing them removes the old vCard and creates a new one
+    Stale vCard files are only removed once the whole CSV file has been read, so a CSV file that
+    cannot be read or does not match the mapping never removes existing vCards
+    """
+
+    def __init__(
+        self, output_dir: str, source_name: str, mapping: CompiledMapping, settings: str
+    ):
+        self.output_dir = output_dir
+        self.path = get_manifest_path(output_dir, source_name)
+        self.mapping = mapping
+        self.settings = settings
+        self.contacts = {}
+        self.unchanged = 0
+        self.removed = 0
+        self.complete = False
+        self._previous = {}
+        self._seen = set()
+        self._occurrences = {}
+        self._pending = deque()
+        self._key_offsets = {}
+        self._header_ok = False
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as fp:
+                manifest = json.load(fp)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            logger.warning(f"Cannot read manifest {self.path}, converting again: {exc}")
+            return
+        if manifest.get("version") != MANIFEST_VERSION:
+            logger.info(f"Manifest {self.path} has another version, converting again")
+            return
+        self._previous = manifest["contacts"]
+        if manifest.get("settings") != self.settings:
+            # Every vCard is created again, under the same key so no file is left behind
+            logger.info(
+                "Mapping or vCard version changed since last run, converting again"
+            )
+            for entry in self._previous.values():
+                entry[0] = None
+
+    def reserve_filenames(self, allocator: FilenameAllocator) -> None:
+        """
+        Keeps new vCards from being written over the vCard files of earlier runs
+        """
+        for _, path in self._previous.values():
+            allocator.reserve(os.path.basename(path))
+
+    def check_header(self, check_header: Callable[[List[str]], bool]) -> Callable:
+        """
+        Wraps a header check, so rows are known to match the mapping
+        """
+
+        def wrapper(header: List[str]) -> bool:
+            self._header_ok = check_header(header)
+            return self._header_ok
+
+        return wrapper
+
+    def _get_key_offsets(self, fields: Tuple[str, ...]) -> List[int]:
+        try:
+            return self._key_offsets[fields]
+        except KeyError:
+            pass
+        offsets = []
+        for key in CONTACT_KEYS:
+            columns = self.mapping.columns_by_key.get(key, set()) & set(fields)
+            if columns:
+                offsets = [fields.index(column) for column in sorted(columns)]
+                break
+        self._key_offsets[fields] = offsets
+        return offsets
+
+    def _remove(self, path: str, allocator: FilenameAllocator) -> None:
+        try:
+            os.remove(os.path.join(self.output_dir, path))
+        except FileNotFoundError:
+            pass
+        allocator.release(os.path.basename(path))
+
+    def filter(
+        self, contacts: Iterable[ContactRecord], allocator: FilenameAllocator
+    ) -> Iterator[ContactRecord]:
+        """
+        Yields added or changed contacts, whose outdated vCard files are removed right away
+        Every yielded contact needs its vCard to be recorded by add(), in the same order
+        """
+        try:
+            for contact in contacts:
+                row_hash = _hash_values(contact.values)
+                key = VALUE_SEPARATOR.join(
+                    contact.values[offset]
+                    for offset in self._get_key_offsets(contact.fields)
+                )
+                if not key.strip(VALUE_SEPARATOR):
+                    key = row_hash
+                occurrence = self._occurrences.get(key, 0) + 1
+                self._occurrences[key] = occurrence
+                if occurrence > 1:
+                    key = f"{key}{VALUE_SEPARATOR}{occurrence}"
+                self._seen.add(key)
+
+                previous = self._previous.get(key)
+                if previous:
+                    if previous[0] == row_hash:
+                        self.contacts[key] = previous
+                        self.unchanged += 1
+                        continue
+                    self._remove(previous[1], allocator)
+                self._pending.append((key, row_hash))
+                yield contact
+        except (OSError, UnicodeDecodeError):
+            # Already logged by parse_csv()
+            return
+        self.complete = self._header_ok
+
+    def add(self, path: str = None) -> None:
+        """
+        Records the vCard file path of the next yielded contact, relative to the output directory,
+        None meaning it was rejected
+        """
+        key, row_hash = self._pending.popleft()
+        if path:
+            self.contacts[key] = [row_hash, path]
+
+    def remove_stale(self, allocator: FilenameAllocator) -> None:
+        """
+        Removes vCard files of contacts that are gone from the CSV file
+        When the CSV file was not entirely read, their entries are kept for the next run instead
+        """
+        for key, entry in self._previous.items():
+            if key in self._seen:
+                continue
+            if not self.complete:
+                self.contacts[key] = entry
+                continue
+            self._remove(entry[1], allocator)
+            self.removed += 1
+        if not self.complete:
+            logger.warning(
+                "CSV file was not entirely read, vCards of missing contacts are kept"
+            )
+
+    def save(self) -> None:
+        # Write a temporary file first, so an interrupted run leaves the previous manifest intact
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as fp:
+            json.dump(
+                {
+                    "version": MANIFEST_VERSION,
+                    "settings": self.settings,
+                    "contacts": self.contacts,
+                },
+                fp,
+                separators=(",", ":"),
+            )
+        os.replace(temp_path, self.path)
@@ -0,0 +1,161 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+#
+# This file is part of csv2vcard
+
+
+from typing import Iterator, Iterable, Callable, Any
+import json
+import cProfile
+from time import perf_counter
+from contextlib import contextmanager
+from logging import getLogger
+
+
+logger = getLogger()
+
+
+class Metrics:
+    """
+    Wall time and counters of conversion stages
+
+    Stage times are exclusive: while a stage runs inside another one, eg accent stripping
+    while parsing, its time is not charged to the outer stage, so stage times add up
+    Metrics of other processes can be merged, since they are picklable, in which case
+    stage times are summed across processes and may exceed the measured run time
+    """
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.stages = {}
+        self.counters = {}
+        self.errors = {}
+        self._stack = []
+        self._last = None
+
+    def _charge(self) -> None:
+        now = perf_counter()
+        if self._stack:
+            self.stages[self._stack[-1]][0] += now - self._last
+        self._last = now
+
+    def enter(self, name: str) -> None:
+        self._charge()
+        self.stages.setdefault(name, [0.0, 0])[1] += 1
+        self._stack.append(name)
+
+    def exit(self) -> None:
+        self._charge()
+        self._stack.pop()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.exit()
+
+    def timed(self, name: str, fn: Callable) -> Callable:
+        """
+        Returns fn, charging every call to the given stage
+        """
+
+        def wrapper(*args, **kwargs):
+            self.enter(name)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.exit()
+
+        return wrapper
+
+    def timed_iter(
+        self, name: str, iterable: Iterable, counter: str = None
+    ) -> Iterator[Any]:
+        """
+        Yields the items of iterable, charging the time needed to get them to the given stage
+        and counting them in counter
+        """
+        iterator = iter(iterable)
+        while True:
+            self.enter(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.exit()
+            if counter:
+                self.count(counter)
+            yield item
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def count_error(self, code: str, value: int = 1) -> None:
+        self.errors[code] = self.errors.get(code, 0) + value
+
+    def merge(self, other: "Metrics") -> None:
+        for name, (seconds, calls) in other.stages.items():
+            stage = self.stages.setdefault(name, [0.0, 0])
+            stage[0] += seconds
+            stage[1] += calls
+        for name, value in other.counters.items():
+            self.count(name, value)
+        for code, value in other.errors.items():
+            self.count_error(code, value)
+
+    def to_dict(self) -> dict:
+        return {
+            "seconds": round(self.seconds, 6),
+            "stages": {
+                name: {"seconds": round(seconds, 6), "calls": calls}
+                for name, (seconds, calls) in self.stages.items()
+            },
+            "counters": dict(self.counters),
+            "errors": dict(sorted(self.errors.items())),
+        }
+
+    def log_summary(self) -> None:
+        logger.info(f"Conversion took {self.seconds:.3f}s")
+        for name, (seconds, calls) in self.stages.items():
+            logger.info(f"Stage {name}: {seconds:.3f}s in {calls} calls")
+        for name, value in self.counters.items():
+            logger.info(f"{name}: {value}")
+        for code, value in sorted(self.errors.items()):
+            logger.info(f"Error {code}: {value} times")
+
+    def write(self, filename: str) -> None:
+        with open(filename, "w", encoding="utf-8") as fp:
+            json.dump(self.to_dict(), fp, indent=4)
+
+    # Pending stages only make sense in the process that measures them
+    def __getstate__(self) -> dict:
+        return {
+            "stages": self.stages,
+            "counters": self.counters,
+            "errors": self.errors,
+        }
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__()
+        self.__dict__.update(state)
+
+
+@contextmanager
+def profiled(profile_file: str = None) -> Iterator[None]:
+    """
+    Dumps cProfile stats of the current process to profile_file, readable with pstats or snakeviz
+    """
+    if not profile_file:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_file)
+        logger.info(f"Profile written to {profile_file}")
@@ -0,0 +1,238 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+#
+# This file is part of csv2vcard
+
+
+"""
+Memory mapped CSV reader
+
+A local CSV file is mapped once and split into byte ranges holding whole CSV records, line breaks
+inside quoted values, eg multiline notes, never being taken as record boundaries
+Every range is decoded straight from the mapping, so worker processes can parse ranges of the same
+file without reading it through a single file object
+"""
+
+from typing import Iterator, List, Tuple, Union
+import io
+import csv
+import mmap
+import codecs
+from logging import getLogger
+
+
+logger = getLogger()
+
+# Amount of CSV data in a byte range, ranges being extended to the next record boundary
+MMAP_CHUNK_BYTES = 4 * 1024**2
+# Encodings that can hold quote or line break bytes in multibyte characters, or shift states
+UNSPLITTABLE_ENCODINGS = ("utf-16", "utf-32", "utf-7", "iso2022", "hz")
+
+
+def is_splittable_encoding(encoding: str) -> bool:
+    """
+    Returns True when quotes and line breaks of an encoding can be found by looking for their ASCII bytes
+    """
+    try:
+        name = codecs.lookup(encoding).name
+    except LookupError:
+        return False
+    if name.startswith(UNSPLITTABLE_ENCODINGS):
+        return False
+    # The BOM is only written at the beginning of the data
+    if name == "utf-8-sig":
+        return True
+    return '"\r\n'.encode(name) == b'"\r\n'
+
+
+class RecordScanner:
+    """
+    Finds the line breaks ending CSV records, reading quotes like csv.reader does
+    A quote only opens a quoted value at the start of a field, quotes inside unquoted values being
+    kept as is, and a quoted value ends at a quote which is not doubled
+    Data is bytes when an encoding is given, else text. Scans can be resumed as more data comes,
+    the scanner keeping the position up to which data is known to be outside quoted values
+    """
+
+    def __init__(self, csv_delimiter: str, encoding: str = None):
+        if encoding:
+            self._quote, self._newline = b'"', b"\n"
+            field_ends = (csv_delimiter.encode(encoding), b"\r", b"\n")
+        else:
+            self._quote, self._newline = '"', "\n"
+            field_ends = (csv_delimiter, "\r", "\n")
+        self._field_ends = tuple(
+            (field_end, len(field_end)) for field_end in set(field_ends)
+        )
+        self.reset()
+
+    def reset(self, start: int = 0) -> None:
+        """
+        Starts a new scan at start, which needs to be the beginning of a record
+        """
+        self.position = start
+        self.record_start = start
+        self.last_end = -1
+
+    def shift(self, offset: int) -> None:
+        """
+        Follows the removal of the offset first characters of the data, which must hold whole records
+        """
+        self.position -= offset
+        self.record_start = 0
+        self.last_end = -1
+
+    def _skip_quote(
+        self, data: Union[bytes, str], quote: int, end: int, final: bool
+    ) -> int:
+        """
+        Returns the offset following a quote and, when it opens a quoted value, the whole value,
+        or -1 when the value may go on after end
+        """
+        if quote != self.record_start and not any(
+            data[quote - length : quote] == field_end
+            for field_end, length in self._field_ends
+        ):
+            return quote + 1
+        position = quote + 1
+        while True:
+            position = data.find(self._quote, position, end)
+            if position == -1:
+                return -1
+            if position + 1 == end and not final:
+                # The quote may be doubled by the next data
+                return -1
+            if data[position + 1 : position + 2] != self._quote:
+                return position + 1
+            position += 2
+
+    def scan(self, data: Union[bytes, str], end: int = None, final: bool = True) -> int:
+        """
+        Scans data up to end, returning the offset following the last line break outside quoted
+        values found since the last reset or shift, or -1
+        Unless final, data may go on after end
+        """
+        end = len(data) if end is None else end
+        position = self.position
+        while position < end:
+            quote = data.find(self._quote, position, end)
+            newline = data.rfind(self._newline, position, end if quote == -1 else quote)
+            if newline != -1:
+                self.last_end = newline + 1
+            if quote == -1:
+                position = end
+                break
+            next_position = self._skip_quote(data, quote, end, final)
+            if next_position == -1:
+                position = quote
+                break
+            position = next_position
+        self.position = position
+        return self.last_end
+
+    def record_end(self, data: Union[bytes, str], position: int) -> int:
+        """
+        Returns the offset following the first line break at or after position which is not inside
+        a quoted value, or -1, data being complete
+        """
+        if self.position < position:
+            self.scan(data, position, final=False)
+        while self.position < len(data):
+            newline = data.find(self._newline, max(self.position, position))
+            if newline == -1:
+                return -1
+            quote = data.find(self._quote, self.position, newline)
+            if quote == -1:
+                self.position = newline + 1
+                return self.position
+            self.position = self._skip_quote(data, quote, len(data), True)
+            if self.position == -1:
+                return -1
+        return -1
+
+
+class MappedCsv:
+    """
+    Read only memory map of a local CSV file, whose records are read by byte ranges
+
+    The file needs to be non empty, and its encoding splittable, see is_splittable_encoding()
+    A UTF-8 BOM is skipped when the encoding is utf-8-sig, like Python text files do
+    """
+
+    def __init__(self, csv_filename: str, encoding: str):
+        self.csv_filename = csv_filename
+        self.encoding = codecs.lookup(encoding).name
+        self._fp = open(csv_filename, "rb")
+        try:
+            self._mm = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self._fp.close()
+            raise
+        self.size = len(self._mm)
+        self.data_start = 0
+        if self.encoding == "utf-8-sig":
+            self.encoding = "utf-8"
+            if self._mm[:3] == codecs.BOM_UTF8:
+                self.data_start = 3
+
+    def record_end(self, start: int, position: int, csv_delimiter: str) -> int:
+        """
+        Returns the offset following the first line break at or after position which is not inside
+        a quoted value, start being the beginning of a record, or the file size
+        """
+        scanner = RecordScanner(csv_delimiter, self.encoding)
+        scanner.reset(start)
+        end = scanner.record_end(self._mm, position)
+        return self.size if end == -1 else end
+
+    def read_header(self, csv_delimiter: str) -> Tuple[List[str], int]:
+        """
+        Returns the header and the offset of the first record
+        """
+        end = self.record_end(self.data_start, self.data_start, csv_delimiter)
+        rows = list(self.rows(self.data_start, end, csv_delimiter))
+        return (rows[0] if rows else None), end
+
+    def ranges(
+        self, start: int, csv_delimiter: str, chunk_size: int = None
+    ) -> Iterator[Tuple[int, int]]:
+        """
+        Yields (start, end) byte ranges of whole records, of about chunk_size bytes
+        """
+        chunk_size = chunk_size or MMAP_CHUNK_BYTES
+        while start < self.size:
+            end = self.size
+            if start + chunk_size < self.size:
+                end = self.record_end(start, start + chunk_size, csv_delimiter)
+            yield start, end
+            start = end
+
+    def iter_rows(
+        self, start: int, csv_delimiter: str, chunk_size: int = None
+    ) -> Iterator[List[str]]:
+        """
+        Yields the CSV rows following start, range after range
+        """
+        for range_start, range_end in self.ranges(start, csv_delimiter, chunk_size):
+            yield from self.rows(range_start, range_end, csv_delimiter)
+
+    def rows(self, start: int, end: int, csv_delimiter: str) -> Iterator[List[str]]:
+        """
+        Yields the CSV rows of a byte range, which is decoded without being copied first
+        """
+        with memoryview(self._mm)[start:end] as view:
+            text = str(view, self.encoding)
+        return csv.reader(io.StringIO(text, newline=""), delimiter=csv_delimiter)
+
+    def close(self) -> None:
+        if self._mm is None:
+            return
+        self._mm.close()
+        self._mm = None
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,99 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+#
+# This file is part of csv2vcard
+
+
+from typing import Iterator, Iterable, Callable, List, Any
+import os
+from itertools import islice
+from collections import deque
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Executor
+from contextlib import contextmanager
+from logging import getLogger
+from logging.handlers import QueueHandler, QueueListener
+
+
+logger = getLogger()
+
+
+def get_jobs(jobs: int = None) -> int:
+    """
+    Returns the number of worker processes to use, 0 meaning one per CPU
+    """
+    if jobs is None:
+        return 1
+    if jobs < 1:
+        return os.cpu_count() or 1
+    return jobs
+
+
+def _init_worker(
+    log_queue: multiprocessing.Queue,
+    log_level: int,
+    initializer: Callable = None,
+    initargs: tuple = (),
+) -> None:
+    """
+    Sends every log record of a worker process back to the parent process
+    """
+    worker_logger = getLogger()
+    worker_logger.handlers = [QueueHandler(log_queue)]
+    worker_logger.setLevel(log_level)
+    if initializer:
+        initializer(*initargs)
+
+
+@contextmanager
+def process_pool(
+    jobs: int, initializer: Callable = None, initargs: tuple = ()
+) -> Iterator[ProcessPoolExecutor]:
+    """
+    Process pool which worker logs are written by the parent process handlers, so
+    log files and console output are never written concurrently
+
+    An optional initializer is run once in every worker, eg to share a compiled mapping
+    """
+    log_queue = multiprocessing.Queue()
+    # A logger has a handle() method, so it can be used as QueueListener handler
+    # This way, records coming from workers go through the parent logger filters and handlers
+    listener = QueueListener(log_queue, logger)
+    listener.start()
+    try:
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(log_queue, logger.getEffectiveLevel(), initializer, initargs),
+        ) as executor:
+            yield executor
+    finally:
+        listener.stop()
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[List[Any]]:
+    """
+    Splits an iterable into lists of at most size items
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def imap_ordered(
+    executor: Executor, fn: Callable, iterable: Iterable, max_pending: int
+) -> Iterator[Any]:
+    """
+    Like executor.map(), but keeps at most max_pending tasks in flight, so the iterable
+    is consumed lazily and results are yielded in their original order
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
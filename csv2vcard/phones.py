@@ -0,0 +1,157 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+#
+# This file is part of csv2vcard
+
+
+"""
+Normalization of TEL values into E.164 numbers, eg +491705252525
+
+National numbers are read in a default region. The phonenumbers package is used when installed,
+else numbers are normalized by their international or trunk prefixes and national number lengths,
+for the regions of NATIONAL_PREFIXES only
+Results are cached by raw value, since switchboard and fax numbers repeat a lot in company exports
+"""
+
+from typing import Optional, Tuple
+import re
+from functools import lru_cache
+from logging import getLogger
+
+try:
+    import phonenumbers
+
+    _PHONENUMBERS = True
+except ImportError:
+    _PHONENUMBERS = False
+
+
+logger = getLogger()
+
+PHONE_CACHE_SIZE = 65536
+# Country calling code, trunk prefix, international prefix and national number length range by
+# region, when phonenumbers is missing
+NATIONAL_PREFIXES = {
+    "AT": ("43", "0", "00", 7, 13),
+    "AU": ("61", "0", "0011", 9, 9),
+    "BE": ("32", "0", "00", 8, 9),
+    "BR": ("55", "0", "00", 10, 11),
+    "CA": ("1", "1", "011", 10, 10),
+    "CH": ("41", "0", "00", 9, 9),
+    "DE": ("49", "0", "00", 6, 11),
+    "DK": ("45", "", "00", 8, 8),
+    "DZ": ("213", "0", "00", 8, 9),
+    "ES": ("34", "", "00", 9, 9),
+    "FI": ("358", "0", "00", 5, 12),
+    "FR": ("33", "0", "00", 9, 9),
+    "GB": ("44", "0", "00", 9, 10),
+    "IE": ("353", "0", "00", 7, 9),
+    "IN": ("91", "0", "00", 10, 10),
+    "IT": ("39", "", "00", 6, 11),
+    "LU": ("352", "", "00", 4, 11),
+    "MA": ("212", "0", "00", 9, 9),
+    "NL": ("31", "0", "00", 9, 9),
+    "NO": ("47", "", "00", 8, 8),
+    "NZ": ("64", "0", "00", 8, 10),
+    "PL": ("48", "", "00", 9, 9),
+    "PT": ("351", "", "00", 9, 9),
+    "SE": ("46", "0", "00", 7, 10),
+    "TN": ("216", "", "00", 8, 8),
+    "US": ("1", "1", "011", 10, 10),
+}
+# Extensions like "x 12", "ext. 12", "poste 12" or ;ext=12
+EXTENSION_PATTERN = re.compile(
+    r"\s*(?:;ext=|#|\b(?:x|ext|extension|poste|durchwahl)\.?)\s*(\d{1,6})\s*$",
+    re.IGNORECASE,
+)
+# Visual separators, and the (0) trunk prefix written after country codes, eg +49 (0)170
+SEPARATORS_PATTERN = re.compile(r"\(0\)|[\s.\-()/\u2010-\u2015]")
+# E.164 numbers have up to 15 digits, country code included
+E164_PATTERN = re.compile(r"^\+[1-9]\d{6,14}$")
+# Phone number, and its extension if any
+Phone = Tuple[str, Optional[str]]
+
+
+def _normalize_builtin(value: str, region: str = None) -> Optional[Phone]:
+    extension = None
+    match = EXTENSION_PATTERN.search(value)
+    if match:
+        extension = match.group(1)
+        value = value[: match.start()]
+    number = SEPARATORS_PATTERN.sub("", value)
+    if region and not number.startswith("+"):
+        (
+            country_code,
+            trunk_prefix,
+            international_prefix,
+            min_length,
+            max_length,
+        ) = NATIONAL_PREFIXES[region]
+        if number.startswith(international_prefix):
+            number = "+" + number[len(international_prefix) :]
+        else:
+            # Spreadsheets often drop the leading zero of numbers, so the trunk prefix is optional,
+            # the national number length telling them from local numbers without area code
+            if trunk_prefix and number.startswith(trunk_prefix):
+                number = number[len(trunk_prefix) :]
+            if not min_length <= len(number) <= max_length:
+                return None
+            number = f"+{country_code}{number}"
+    elif number.startswith("00"):
+        number = "+" + number[2:]
+    if not E164_PATTERN.match(number):
+        return None
+    return number, extension
+
+
+def _normalize_phonenumbers(value: str, region: str = None) -> Optional[Phone]:
+    try:
+        number = phonenumbers.parse(value, region)
+    except phonenumbers.NumberParseException:
+        return None
+    # Local numbers without area code are possible, but cannot be dialed from elsewhere
+    if (
+        phonenumbers.is_possible_number_with_reason(number)
+        != phonenumbers.ValidationResult.IS_POSSIBLE
+    ):
+        return None
+    return (
+        phonenumbers.format_number(number, phonenumbers.PhoneNumberFormat.E164),
+        number.extension or None,
+    )
+
+
+def format_tel(phone: Phone, version: int) -> str:
+    """
+    Returns a tel: URI like tel:+491705252525;ext=12 for vCard 4.0, or the E.164 number for vCard 3.0
+    """
+    number, extension = phone
+    if version == 3:
+        return f"{number} ext. {extension}" if extension else number
+    return f"tel:{number};ext={extension}" if extension else f"tel:{number}"
+
+
+class PhoneNormalizer:
+    """
+    Turns TEL values into (E.164 number, extension) tuples, national numbers being read in region,
+    a two letter ISO 3166 country code
+    """
+
+    def __init__(self, region: str = None, cache_size: int = PHONE_CACHE_SIZE):
+        self.region = region.upper() if region else None
+        if self.region:
+            supported = (
+                phonenumbers.SUPPORTED_REGIONS if _PHONENUMBERS else NATIONAL_PREFIXES
+            )
+            if self.region not in supported:
+                message = f"Unknown phone region {region}"
+                if not _PHONENUMBERS:
+                    message += ". Install the phonenumbers package to use other regions"
+                raise ValueError(message)
+        self._normalize = (
+            _normalize_phonenumbers if _PHONENUMBERS else _normalize_builtin
+        )
+        self.normalize = lru_cache(maxsize=cache_size)(self._normalize_value)
+
+    def _normalize_value(self, value: str) -> Optional[Phone]:
+        return self._normalize(value.strip(), self.region)
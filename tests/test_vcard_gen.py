@@ -17,6 +17,8 @@ __licence__ = "MIT"
 __build__ = "2023112401"
 
 from csv2vcard.csv_handler import *
+from csv2vcard.create_vcard import create_vcard
+from csv2vcard.export_vcard import FilenameAllocator, export_vcard
 
 
 def test_csv2vcard(version: int = 4):
@@ -54,6 +56,678 @@ def test_csv2vcard(version: int = 4):
     export_vcard(vcard, output_dir, filename)
 
 
+def test_compiled_mapping():
+    """
+    A compiled mapping must give the same vCards as the per contact mapping, and keep every TYPE entry
+    """
+    contact = {
+        "last_name": "Gump",
+        "first_name": "Forrest",
+        "email": "forrestgump@example.com",
+        "email_home": "forrestgump@examplehome.com",
+        "phone": "+49 170 5 25 25 25",
+        "mobile_phone": "+19177777777",
+    }
+    mapping = CompiledMapping(strip_accents=True)
+    vcard, filename = create_vcard(contact, 4, mapping=mapping)
+    reference_vcard, reference_filename = create_vcard(contact, 4)
+    assert vcard.split("REV:")[0] == reference_vcard.split("REV:")[0]
+    assert filename == reference_filename == "Gump-Forrest.vcf"
+    assert "EMAIL;TYPE=HOME:forrestgump@examplehome.com" in vcard
+    assert "EMAIL;TYPE=WORK:forrestgump@example.com" in vcard
+    assert "TEL;TYPE=WORK,CELL:+19177777777" in vcard
+    assert "TEL;TYPE=WORK,VOICE:+49 170 5 25 25 25" in vcard
+    assert "N:Gump;Forrest;;;" in vcard
+
+
+def test_parse_csv_columns():
+    """
+    Only mapped columns must be kept, short rows keeping their first fields, and accents must only
+    be stripped from non ASCII values
+    """
+    from csv2vcard.metrics import Metrics
+
+    csv_data = io.StringIO(
+        "last_name;note;first_name;email\nGump;x\tyz;Forrest;a@x.com\nDupont;Jérôme\nÉlise;;Zoé;\n"
+    )
+    metrics = Metrics()
+    contacts = list(
+        parse_csv(
+            csv_data,
+            ";",
+            encoding="utf-8",
+            strip_accents=True,
+            columns={"last_name", "first_name", "email"},
+            metrics=metrics,
+        )
+    )
+    assert contacts == [
+        {"last_name": "Gump", "first_name": "Forrest", "email": "a@x.com"},
+        {"last_name": "Dupont"},
+        {"last_name": "Elise", "first_name": "Zoe", "email": ""},
+    ]
+    # Dropped columns are never cleaned, ASCII values never stripped
+    assert metrics.stages["strip_accents"][1] == 2
+
+    csv_data.seek(0)
+    records = list(
+        parse_csv(
+            csv_data,
+            ";",
+            encoding="utf-8",
+            strip_accents=False,
+            columns={"note"},
+            records=True,
+        )
+    )
+    assert records[0].fields == ("note",) and records[0].values == ("xyz",)
+    assert records[1].values == ("Jérôme",)
+
+
+def test_contact_record():
+    """
+    Contact records and dicts must give the same vCards
+    """
+    contact = {"last_name": "Gump", "first_name": "Forrest", "email": "bad <>"}
+    record = ContactRecord.from_dict(contact)
+    assert record["first_name"] == "Forrest"
+    assert record.to_dict() == contact
+    mapping = CompiledMapping()
+    vcard, filename = create_vcard(record, 3, mapping=mapping)
+    reference_vcard, reference_filename = create_vcard(contact, 3, mapping=mapping)
+    assert vcard.split("REV:")[0] == reference_vcard.split("REV:")[0]
+    assert filename == reference_filename
+    assert "EMAIL" not in vcard
+
+
+def test_rolling_vcard_writer(tmp_path):
+    """
+    Split files must never exceed the byte limit, nor the max number of vCards
+    """
+    vcard = "BEGIN:VCARD\nVERSION:4.0\nFN:Jérôme\nN:Jérôme;;;;\nEND:VCARD\n"
+    with RollingVcardWriter(str(tmp_path), "size", max_file_size=200) as writer:
+        for _ in range(10):
+            writer.write(vcard)
+    assert len(writer.files) > 1
+    for filename in writer.files:
+        assert (tmp_path / filename).stat().st_size <= 200
+
+    with RollingVcardWriter(str(tmp_path), "count", max_vcards=4) as writer:
+        for _ in range(10):
+            writer.write(vcard)
+    assert writer.files == ["count1.vcf", "count2.vcf", "count3.vcf"]
+    content = (tmp_path / "count3.vcf").read_text(encoding="utf-8")
+    assert content.count("BEGIN:VCARD") == 2
+
+    with RollingVcardWriter(
+        str(tmp_path), "stdin", max_vcards=5, template="split/{name}-{num:02d}.vcf"
+    ) as writer:
+        for _ in range(10):
+            writer.write(vcard)
+    assert writer.files == ["split/stdin-01.vcf", "split/stdin-02.vcf"]
+
+
+def test_batched_vcard_exporter(tmp_path):
+    """
+    Every vCard must end up in its own file, even when batches are not full
+    """
+    with BatchedVcardExporter(str(tmp_path), batch_size=3, fsync=True) as exporter:
+        for num in range(10):
+            exporter.write(f"BEGIN:VCARD\nFN:{num}\nEND:VCARD\n", f"{num}.vcf")
+    assert exporter.count == 10
+    assert (tmp_path / "9.vcf").read_text(encoding="utf-8").startswith("BEGIN:VCARD")
+
+    # Running again replaces files of the earlier run, unless they are kept
+    with BatchedVcardExporter(str(tmp_path)) as exporter:
+        assert exporter.write("BEGIN:VCARD\nEND:VCARD\n", "9.vcf") == "9.vcf"
+    assert (tmp_path / "9.vcf").read_text(
+        encoding="utf-8"
+    ) == "BEGIN:VCARD\nEND:VCARD\n"
+    with BatchedVcardExporter(str(tmp_path), keep_existing=True) as exporter:
+        assert exporter.write("BEGIN:VCARD\nEND:VCARD\n", "9.vcf") == "9-2.vcf"
+        # Created by another process once the folder was indexed
+        (tmp_path / "new.vcf").write_text("", encoding="utf-8")
+        assert exporter.write("BEGIN:VCARD\nEND:VCARD\n", "new.vcf") == "new-2.vcf"
+    assert (tmp_path / "new.vcf").read_text(encoding="utf-8") == ""
+    assert (tmp_path / "new-2.vcf").read_text(encoding="utf-8").startswith("BEGIN")
+
+
+def test_filename_allocator(tmp_path):
+    """
+    Contacts sharing a name must never overwrite each other, nor files of earlier runs
+    """
+    (tmp_path / "Gump-Forrest.vcf").write_text("", encoding="utf-8")
+    allocator = FilenameAllocator(str(tmp_path))
+    assert allocator.allocate("Gump-Forrest.vcf") == "Gump-Forrest-2.vcf"
+    assert allocator.allocate("gump-forrest.vcf", uid="1234") == "gump-forrest-1234.vcf"
+    assert allocator.allocate("Gump-Forrest.vcf") == "Gump-Forrest-3.vcf"
+    assert allocator.allocate("a/b:c.vcf") == "a_b_c.vcf"
+    assert allocator.allocate("CON.vcf") == "_CON.vcf"
+
+
+def test_detect_encoding(tmp_path, monkeypatch):
+    """
+    BOMs must win over detection, and more data must only be probed when confidence is low
+    """
+    from csv2vcard import csv_handler
+
+    text = "last_name;first_name\nGümp;Jérôme\n" * 20
+    for encoding in ("utf-8-sig", "utf-16"):
+        (tmp_path / encoding).write_bytes(text.encode(encoding))
+        detected = detect_encoding(str(tmp_path / encoding))
+        assert (tmp_path / encoding).read_bytes().decode(detected) == text
+    assert detect_encoding(str(tmp_path / "utf-8-sig")) == "utf-8-sig"
+
+    (tmp_path / "cp1252").write_bytes(text.encode("cp1252"))
+    detected = detect_encoding(str(tmp_path / "cp1252"))
+    assert (tmp_path / "cp1252").read_bytes().decode(detected) == text
+
+    samples = []
+
+    def detect(sample):
+        samples.append(len(sample))
+        return {"encoding": None, "confidence": 0.1}
+
+    monkeypatch.setattr(csv_handler, "detect", detect)
+    assert detect_encoding(str(tmp_path / "cp1252"), probe_bytes=64) == "utf-8"
+    assert samples[0] <= 64 < samples[1]
+
+
+def test_metrics():
+    """
+    Nested stages must not be charged twice, and worker metrics must survive pickling
+    """
+    import pickle
+    from time import sleep
+    from csv2vcard.metrics import Metrics
+
+    metrics = Metrics()
+    parse = metrics.timed("strip_accents", lambda value: sleep(0.01) or value)
+    rows = metrics.timed_iter("parse_csv", (parse(row) for row in "abc"), "rows_read")
+    assert list(rows) == ["a", "b", "c"]
+    assert metrics.stages["strip_accents"][0] >= 0.03
+    assert metrics.stages["parse_csv"][0] < 0.03
+    assert metrics.counters["rows_read"] == 3
+
+    worker_metrics = pickle.loads(pickle.dumps(metrics))
+    metrics.merge(worker_metrics)
+    assert metrics.counters["rows_read"] == 6
+    assert metrics.stages["parse_csv"][1] == 8
+
+
+def test_error_aggregator():
+    """
+    Per contact errors must be counted by code and column, keeping only a few examples
+    """
+    mapping = CompiledMapping(mapping={"FN": "name", "N": ["name"], "GENDER": "gender"})
+    assert mapping.check_header(["name", "gender"])
+    assert not mapping.check_header(["name;gender"])
+
+    for num in range(100):
+        create_vcard({"name": str(num), "gender": f"X{num}"}, mapping=mapping)
+    errors = mapping.errors.pop()
+    assert errors.counts == {(1006, "GENDER", "gender"): 100}
+    assert len(errors.samples[(1006, "GENDER", "gender")]) == 3
+    assert not mapping.errors.counts
+
+
+def test_missing_column_reported_once(tmp_path, caplog):
+    """
+    Mapped columns missing from a CSV header must be logged once, not counted per contact
+    """
+    csv_file = tmp_path / "contacts.csv"
+    csv_file.write_text("name;gender\n" + "Gump;M\n" * 20 + "Short\n")
+    mapping = CompiledMapping(
+        mapping={"FN": "name", "N": ["name", "first_name"], "GENDER": "gender"}
+    )
+    metrics = Metrics()
+    assert (
+        csv2vcard(
+            str(csv_file), output_dir=str(tmp_path), mapping=mapping, metrics=metrics
+        )
+        == 21
+    )
+    missing = [
+        record
+        for record in caplog.records
+        if "has no match in CSV file first_name" in record.getMessage()
+    ]
+    assert len(missing) == 1
+    assert not metrics.errors
+
+    # Contacts without header are checked once per set of fields
+    caplog.clear()
+    mapping = CompiledMapping(mapping={"FN": "name", "N": ["name", "first_name"]})
+    for _ in range(5):
+        create_vcard({"name": "Gump"}, mapping=mapping)
+    assert len(caplog.records) == 1
+    assert not mapping.errors.pop().counts
+
+
+def test_parallel_conversion(tmp_path):
+    """
+    Worker processes must give the same vCards, in the same order, and the same error counts
+    as a serial run, whether they convert whole CSV files or batches of a single one
+    """
+    import json
+    import re
+
+    source_dir = tmp_path / "csv"
+    source_dir.mkdir()
+    for num in range(3):
+        rows = [
+            f"Name{num}-{row};First{row};{'X' if row % 7 else 'M'}" for row in range(50)
+        ]
+        # Contacts of different CSV files sharing a name must all be written
+        rows.append("Gump;Forrest;M")
+        (source_dir / f"contacts{num}.csv").write_text(
+            "last_name;first_name;gender\n" + "\n".join(rows) + "\n"
+        )
+
+    def read_vcards(path):
+        return {
+            file.relative_to(path).as_posix(): re.sub(r"REV:\S+", "", file.read_text())
+            for file in path.glob("**/*.vcf")
+        }
+
+    results = []
+    for jobs in (1, 2):
+        output_dir = tmp_path / f"vcards{jobs}"
+        metrics_file = tmp_path / f"metrics{jobs}.json"
+        config = {
+            "settings": {
+                "csv_filename": str(source_dir),
+                "csv_delimiter": ";",
+                "mapping_file": None,
+                "strip_accents": False,
+                "max_vcard_file_size": None,
+                "output_dir": str(output_dir),
+                "jobs": jobs,
+                "metrics_file": str(metrics_file),
+            }
+        }
+        assert interface_entrypoint(config)
+        with open(metrics_file, encoding="utf-8") as fp:
+            errors = json.load(fp)["errors"]
+        results.append((read_vcards(output_dir), errors))
+    assert len(results[0][0]) == 153
+    assert results[0] == results[1]
+    assert results[1][1]["1006"] == 126
+
+    # Batches of a single CSV file, also when workers read its byte ranges themselves
+    csv_file = str(source_dir / "contacts0.csv")
+    results = []
+    for jobs, use_mmap in ((1, False), (2, False), (2, True)):
+        output_dir = tmp_path / f"single{jobs}{use_mmap}"
+        metrics = Metrics()
+        csv2vcard(
+            csv_file,
+            output_dir=str(output_dir),
+            single_vcard_file=True,
+            jobs=jobs,
+            batch_size=7,
+            use_mmap=use_mmap,
+            metrics=metrics,
+        )
+        results.append((read_vcards(output_dir), metrics.errors))
+    assert results[0] == results[1] == results[2]
+    assert results[0][1]["1006"] == 42
+
+
+def test_aconvert():
+    """
+    Records split across stream chunks, even inside quoted values, must be converted once
+    """
+    import io
+    import asyncio
+    from csv2vcard.async_handler import aconvert
+
+    data = "FN;last_name;first_name\n" + '"For\nrest";Gump;"Forrest ""F"""\n' * 100
+
+    async def stream():
+        for index in range(0, len(data), 7):
+            yield data[index : index + 7].encode("utf-8")
+
+    output = io.BytesIO()
+    mapping = CompiledMapping(mapping={"FN": "FN", "N": ["last_name", "first_name"]})
+    count = asyncio.run(
+        aconvert(stream(), output, encoding="utf-8", mapping=mapping, batch_chars=100)
+    )
+    assert count == 100
+    assert output.getvalue().count(b'N:Gump;Forrest "F"\n') == 100
+
+    # A quote inside an unquoted value, eg 6" below, does not open a quoted value, so the line
+    # break following "For must not be taken as a record boundary whatever chunk it ends
+    data = (
+        'FN;last_name;first_name\nShrimp 6" Man;Gump;Forrest\n'
+        + '"For\nrest";Gump;"Forrest ""F"""\n' * 99
+    )
+
+    async def byte_stream():
+        for index in range(len(data)):
+            yield data[index].encode("utf-8")
+
+    output = io.BytesIO()
+    count = asyncio.run(
+        aconvert(
+            byte_stream(), output, encoding="utf-8", mapping=mapping, batch_chars=100
+        )
+    )
+    assert count == 100
+    assert output.getvalue().count(b'FN:Shrimp 6" Man\n') == 1
+    assert output.getvalue().count(b"FN:Forrest\n") == 99
+    assert output.getvalue().count(b'N:Gump;Forrest "F"\n') == 99
+
+
+def test_stream_vcards():
+    """
+    Binary, text and row dict sources must give the same vCards, without any file
+    """
+    import io
+
+    data = "last_name;first_name\nGump;Forrest\nDupont;Zoé\n"
+    rows = [
+        {"last_name": "Gump", "first_name": "Forrest"},
+        {"last_name": "Dupont", "first_name": "Zoé"},
+    ]
+    results = []
+    for source in [io.BytesIO(data.encode("cp1252")), io.StringIO(data), rows]:
+        output = io.BytesIO()
+        assert write_vcards(stream_vcards(source, strip_accents=True), output) == 2
+        results.append(output.getvalue())
+    assert b"N:Dupont;Zoe;;;\n" in results[0]
+    # Only REV timestamps may differ
+    assert len({len(result) for result in results}) == 1
+
+
+def test_compressed_archive(tmp_path):
+    """
+    gzip data must be decompressed on the fly, and contacts sharing a name get unique archive members
+    """
+    import gzip
+    import io
+    import zipfile
+    from csv2vcard.export_vcard import ArchiveVcardWriter
+
+    data = "last_name;first_name\nGump;Forrest\nGump;Forrest\n"
+    source = io.BytesIO(gzip.compress(data.encode("utf-8")))
+    archive = str(tmp_path / "contacts.zip")
+    with ArchiveVcardWriter(archive) as writer:
+        for vcard, filename in stream_vcards(source):
+            writer.write(vcard, filename)
+    with zipfile.ZipFile(archive) as zip_file:
+        names = zip_file.namelist()
+        assert len(names) == 2 and len(set(names)) == 2
+        assert b"N:Gump;Forrest;;;" in zip_file.read(names[0])
+
+
+def test_incremental(tmp_path):
+    """
+    Unchanged contacts must be kept as is, changed ones rewritten and deleted ones removed
+    """
+    csv_file = tmp_path / "contacts.csv"
+    output_dir = str(tmp_path / "vcards")
+    csv_file.write_text(
+        "last_name;first_name;email\nGump;Forrest;a@x.com\nDupont;Jean;b@x.com\n"
+    )
+    assert csv2vcard(str(csv_file), output_dir=output_dir, incremental=True) == 2
+
+    csv_file.write_text(
+        "last_name;first_name;email\nGump;Forrest;c@x.com\nSmith;Ana;d@x.com\n"
+    )
+    assert csv2vcard(str(csv_file), output_dir=output_dir, incremental=True) == 2
+    assert sorted(os.listdir(output_dir))[1:] == ["Gump-Forrest.vcf", "Smith-Ana.vcf"]
+    assert "c@x.com" in (tmp_path / "vcards" / "Gump-Forrest.vcf").read_text()
+
+    assert csv2vcard(str(csv_file), output_dir=output_dir, incremental=True) == 0
+
+
+def test_mapped_csv(tmp_path):
+    """
+    Byte ranges must end on record boundaries, even with line breaks inside quoted values
+    """
+    import csv
+    from csv2vcard.mmap_reader import MappedCsv
+
+    csv_file = tmp_path / "contacts.csv"
+    rows = [["last_name", "remarks"]] + [
+        [f"Gump{num}", f'Shrimp\r\nboat "{num}"\r\nrun'] for num in range(50)
+    ]
+    with open(csv_file, "w", encoding="utf-8-sig", newline="") as fp:
+        csv.writer(fp, delimiter=";").writerows(rows)
+
+    with MappedCsv(str(csv_file), "utf-8-sig") as mapped:
+        header, start = mapped.read_header(";")
+        assert header == rows[0]
+        ranges = list(mapped.ranges(start, ";", chunk_size=64))
+        assert len(ranges) > 1
+        assert [
+            row for byte_range in ranges for row in mapped.rows(*byte_range, ";")
+        ] == rows[1:]
+
+    # A quote inside an unquoted value does not open a quoted value, so the line break that follows
+    # it ends the record, whereas the ones of the next quoted value do not
+    lines = ["last_name;remarks"]
+    for num in range(50):
+        lines.append(f'Gump{num};6" shrimp')
+        lines.append(f'Forrest{num};"Shrimp\nboat ""{num}""\nrun"')
+    csv_file.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    with open(csv_file, encoding="utf-8", newline="") as fp:
+        rows = list(csv.reader(fp, delimiter=";"))
+
+    with MappedCsv(str(csv_file), "utf-8") as mapped:
+        header, start = mapped.read_header(";")
+        for chunk_size in (1, 7, 64):
+            ranges = list(mapped.ranges(start, ";", chunk_size=chunk_size))
+            assert len(ranges) > 1
+            assert [
+                row for byte_range in ranges for row in mapped.rows(*byte_range, ";")
+            ] == rows[1:]
+
+
+def test_multiple_targets(tmp_path):
+    """
+    Every target must get every contact in its own format, from a single conversion
+    """
+    import json
+
+    csv_file = tmp_path / "contacts.csv"
+    csv_file.write_text("last_name;first_name;email\nGump;Forrest;a@x.com\n")
+    targets = [
+        parse_target(f"format=3,output={tmp_path / 'v3'}"),
+        parse_target(f"format=jcard,output={tmp_path / 'jcard'},single"),
+    ]
+    assert csv2vcard(str(csv_file), targets=targets) == 1
+    vcard = (tmp_path / "v3" / "Gump-Forrest.vcf").read_text()
+    assert "VERSION:3.0" in vcard
+    jcards = json.loads((tmp_path / "jcard" / "contacts.csv.json").read_text())
+    properties = {prop[0]: prop for prop in jcards[0][1]}
+    assert properties["version"][3] == "4.0"
+    assert properties["n"][3] == ["Gump", "Forrest", "", "", ""]
+    assert properties["email"][3] == "a@x.com"
+
+
+def test_sharded_exporter(tmp_path):
+    """
+    Files must land in the shard folder of their name, and be listed in the index
+    """
+    from csv2vcard.export_vcard import (
+        BatchedVcardExporter,
+        get_shard_path,
+        SHARD_INDEX,
+    )
+
+    output_dir = str(tmp_path)
+    check_export_dir(output_dir, shard_depth=1)
+    assert len(os.listdir(output_dir)) == 256
+    with BatchedVcardExporter(output_dir, shard_depth=1) as writer:
+        paths = [writer.write("BEGIN:VCARD\nEND:VCARD\n", "Gump.vcf") for _ in "ab"]
+    assert paths == [get_shard_path("Gump.vcf", 1), get_shard_path("Gump-2.vcf", 1)]
+    assert all(os.path.isfile(tmp_path / path) for path in paths)
+    assert (tmp_path / SHARD_INDEX).read_text().splitlines() == [
+        f"{path}\t" for path in paths
+    ]
+
+    # Running again must not list files twice, nor files that are gone
+    os.remove(tmp_path / paths[1])
+    with BatchedVcardExporter(output_dir, shard_depth=1) as writer:
+        writer.write("BEGIN:VCARD\nUID:1234\nEND:VCARD\n", "Gump.vcf")
+    assert (tmp_path / SHARD_INDEX).read_text().splitlines() == [f"{paths[0]}\t1234"]
+
+
+def test_dates():
+    """
+    Column formats must be inferred from a sample, other formats being read per value
+    """
+    from csv2vcard.dates import DateNormalizer, infer_date_format, format_date
+
+    sample = ["03/04/1965", "25/12/1970", ""]
+    assert infer_date_format(sample) == "dmy"
+    assert infer_date_format(sample[:1], day_first=False) == "mdy"
+    normalizer = DateNormalizer("dmy")
+    assert normalizer.parse("03/04/1965") == (1965, 4, 3)
+    assert normalizer.parse("1999-06-01") == (1999, 6, 1)
+    assert normalizer.parse("23813") == (1965, 3, 12)
+    assert normalizer.parse("31/02/1965") is None
+    assert format_date((None, 3, 12), 4) == "--0312"
+    assert format_date((1965, 3, 12), 3) == "1965-03-12"
+
+    contacts = [
+        {"last_name": "Gump", "birthday": "12/03/1965"},
+        {"last_name": "Dupont", "birthday": "circa 1800"},
+    ]
+    vcards = [vcard for vcard, _ in stream_vcards(contacts)]
+    assert "\nBDAY:19650312\n" in vcards[0]
+    assert "\nBDAY;VALUE=text:circa 1800\n" in vcards[1]
+
+    # Text dates have no vCard 3.0 equivalent, other formats keep them
+    (vcard3, vcard4, jcard), _ = create_cards(contacts[1], ("3", "4", "jcard"))
+    assert "BDAY" not in vcard3
+    assert "\nBDAY;VALUE=text:circa 1800\n" in vcard4
+    assert '["bday", {}, "text", "circa 1800"]' in jcard
+
+    # Short rows must not keep the other rows from being sampled
+    mapping = CompiledMapping()
+    mapping.infer_dates(
+        [
+            ContactRecord(("last_name",), ("Gump",)),
+            ContactRecord(("last_name", "birthday"), ("Gump", "04/03/1965")),
+            ContactRecord(("last_name", "birthday"), ("Gump", "12/25/1970")),
+        ]
+    )
+    assert mapping.dates.formats["birthday"] == "mdy"
+
+
+def test_normalize_tel():
+    """
+    National and international numbers must give the same tel: URI, and unreadable ones kept as is
+    """
+    mapping = CompiledMapping(normalize_tel=True, tel_region="DE")
+    contacts = [
+        {"last_name": "Gump", "phone": "+49 (0)170 5 25 25 25", "fax": "0170-5252525"},
+        {"last_name": "Dupont", "phone": "call me"},
+    ]
+    vcards = [vcard for vcard, _ in stream_vcards(contacts, mapping=mapping)]
+    assert "TEL;VALUE=uri;TYPE=WORK,VOICE:tel:+491705252525\n" in vcards[0]
+    assert "TEL;VALUE=uri;TYPE=WORK,FAX:tel:+491705252525\n" in vcards[0]
+    assert "TEL;TYPE=WORK,VOICE:call me\n" in vcards[1]
+    vcard, _ = create_vcard(contacts[0], 3, mapping=mapping)
+    assert "TEL;TYPE=WORK,FAX:+491705252525\n" in vcard
+
+    from csv2vcard.phones import PhoneNormalizer, format_tel
+
+    phones = PhoneNormalizer("US")
+    phone = phones.normalize("(555) 123-4567 ext. 89")
+    assert phone == ("+15551234567", "89")
+    assert format_tel(phone, 4) == "tel:+15551234567;ext=89"
+    assert format_tel(phone, 3) == "+15551234567 ext. 89"
+    # Local numbers lack their area code
+    assert phones.normalize("555-1234") is None
+    assert PhoneNormalizer("DE").normalize("12345") is None
+    assert PhoneNormalizer("FR").normalize("6 12 34 56 78") == ("+33612345678", None)
+
+
+def test_carddav_writer():
+    """
+    Uploads must be retried, and must not replace contacts that already exist on the server, nor
+    create them twice when the response of a stored upload was lost, nor take another contact
+    for them when the lost upload was not stored
+    """
+    import threading
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from csv2vcard.carddav import CardDavWriter
+
+    resources = {
+        "/contacts/Gump-Forrest.vcf": b"existing",
+        "/contacts/Smith-Ana.vcf": b"BEGIN:VCARD\r\nFN:Ana Smith\r\nEND:VCARD\r\n",
+    }
+    requests = []
+    dropped = set()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_PUT(self):
+            data = self.rfile.read(int(self.headers["Content-Length"]))
+            requests.append(self.path)
+            if len(requests) == 1:
+                status = 503
+            elif (
+                self.path == "/contacts/Dupont-Jean.vcf" and self.path not in resources
+            ):
+                # Store the vCard, but drop the connection before responding
+                resources[self.path] = data
+                self.close_connection = True
+                return
+            elif self.path == "/contacts/Smith-Ana.vcf" and self.path not in dropped:
+                # Drop the connection without storing the vCard
+                dropped.add(self.path)
+                self.close_connection = True
+                return
+            elif self.headers.get("If-None-Match") == "*" and self.path in resources:
+                status = 412
+            else:
+                resources[self.path] = data
+                status = 201
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.send_header("ETag", f'"{len(requests)}"')
+            self.end_headers()
+
+        def do_GET(self):
+            data = resources.get(self.path)
+            self.send_response(200 if data else 404)
+            self.send_header("Content-Length", str(len(data or b"")))
+            self.end_headers()
+            self.wfile.write(data or b"")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/contacts"
+        with CardDavWriter(url, connections=2, backoff=0) as writer:
+            for vcard, filename in stream_vcards(
+                [
+                    {"last_name": "Gump", "first_name": "Forrest"},
+                    {"last_name": "Dupont", "first_name": "Jean"},
+                    {"last_name": "Smith", "first_name": "Ana"},
+                ]
+            ):
+                writer.write(vcard, filename)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert writer.count == 3 and writer.retried == 3 and not writer.failed
+    assert resources["/contacts/Gump-Forrest.vcf"] == b"existing"
+    assert resources["/contacts/Gump-Forrest-2.vcf"].startswith(b"BEGIN:VCARD\r\n")
+    assert "/contacts/Dupont-Jean-2.vcf" not in resources
+    assert b"FN:Smith Ana" in resources["/contacts/Smith-Ana-2.vcf"]
+    assert set(writer.etags) == {"Gump-Forrest-2.vcf", "Smith-Ana-2.vcf"}
+
+
 if __name__ == "__main__":
     print("Example code for %s, %s" % (__intname__, __build__))
     test_csv2vcard()